@@ -5,6 +5,12 @@ Streamlit Application for the Text Transformation Prompt Combiner.
 import os
 import streamlit as st
 from prompt_combiner import PromptCombiner
+from prompt_converter import get_display_title, describe_content
+from prompt_watcher import LibraryWatcher
+from prompt_shared import SHARED_ENV
+from prompt_cache import ResponseCache
+from prompt_chunking import TextChunker
+from prompt_transform import TransformError, TransformExecutor, TransformRunner, get_backend
 
 # Set page configuration
 st.set_page_config(
@@ -103,21 +109,182 @@ st.markdown("""
 </style>
 """, unsafe_allow_html=True)
 
+@st.cache_resource(show_spinner=False)
+def _load_combiner(json_file):
+    """
+    Load a PromptCombiner once, shared across sessions.
+    
+    A background watcher reconverts system-prompts/ when its Markdown files
+    change and swaps the new library into the combiner, so edits show up on
+    the next rerun without restarting the app.
+    """
+    combiner = PromptCombiner(json_file=json_file)
+    source_directory = 'system-prompts' if os.path.isdir('system-prompts') else None
+    watcher = LibraryWatcher(json_file, source_directory)
+    watcher.add_combiner(combiner)
+    watcher.start()
+    return combiner
+
+@st.cache_resource(show_spinner=False)
+def _attach_combiner(shared_library):
+    """Attach a PromptCombiner to a library published by 'cli.py publish', shared across sessions."""
+    return PromptCombiner(shared_library=shared_library)
+
 def load_prompts():
-    """Load prompts from the JSON file."""
+    """Load prompts from the JSON file, or from shared memory when a library is published."""
     json_file = 'system_prompts.json'
     
+    shared_library = os.environ.get(SHARED_ENV)
+    if shared_library:
+        try:
+            combiner = _attach_combiner(shared_library)
+            # Pick up a generation published since the last rerun
+            combiner.refresh()
+            return combiner
+        except Exception as e:
+            st.error(f"Error attaching to the shared prompt library '{shared_library}': {e}")
+            return None
+    
     if not os.path.exists(json_file):
         st.warning("No prompt database found. Please make sure system_prompts.json exists.")
         return None
     
     try:
-        combiner = PromptCombiner(json_file=json_file)
-        return combiner
+        return _load_combiner(json_file)
     except Exception as e:
         st.error(f"Error loading prompts: {e}")
         return None
 
+@st.cache_resource(show_spinner=False)
+def _get_transform_runner():
+    """
+    Create the transformation backend once, shared across sessions.
+    
+    The backend comes from $PROMPT_COMBINER_BACKEND, $OPENAI_API_KEY,
+    $OPENAI_BASE_URL and $PROMPT_COMBINER_MODEL. Its keep-alive connections
+    are reused by every transformation, and responses are cached so
+    transforming the same text again on a rerun returns at once. Long
+    dictations are split into chunks that are transformed concurrently.
+    """
+    return TransformRunner(TransformExecutor(get_backend(), cache=ResponseCache(), chunker=TextChunker()))
+
+def show_transformation(system_prompt, text, key):
+    """Transform dictated text with a system prompt and display the result."""
+    try:
+        runner = _get_transform_runner()
+    except ValueError as e:
+        st.info(f"Text transformation is not configured: {e}")
+        return
+    
+    with st.spinner("Transforming text..."):
+        try:
+            transformed = runner.transform(system_prompt, text)
+        except TransformError as e:
+            st.error(f"Error transforming text: {e}")
+            return
+    
+    st.subheader("Transformed Text")
+    st.text_area("", value=transformed, height=300, key=key)
+
+def prompt_title(prompt):
+    """Get the display title the converter stored for a prompt."""
+    # Libraries converted before display fields existed fall back to the title
+    if 'display_title' in prompt:
+        return prompt['display_title']
+    return get_display_title(prompt['title'])
+
+def describe_prompt(prompt, category):
+    """Get the short description shown below a prompt's checkbox."""
+    if 'description' in prompt:
+        return prompt['description']
+    return describe_content(prompt.get('content'), category)
+
+@st.cache_resource(show_spinner=False, max_entries=2)
+def build_view_model(library_hash, _combiner):
+    """
+    Precompute everything the prompt selection page displays.
+    
+    The result only depends on the library version, so it is built once per
+    library hash and shared by every rerun and session. Only the current and
+    previous versions are kept, so reloads do not accumulate old ones.
+    """
+    combiner = _combiner
+    special_ids = {"basic-cleanup", "system-prompt", "user-prompt"}
+    
+    basic_prompt = combiner.get_prompt_by_id("basic-cleanup")
+    
+    # AI prompts have their own section
+    ai_prompts = []
+    for prompt_id in ['system-prompt', 'user-prompt']:
+        prompt = combiner.get_prompt_by_id(prompt_id)
+        if prompt:
+            title = prompt_title(prompt)
+            ai_prompts.append({
+                'id': prompt['id'],
+                'title': title,
+                'checkbox_key': f"checkbox_ai_{prompt['id']}",
+                'description': "Reformats the text as " + title.lower() + " instructions." if prompt.get('content') else None
+            })
+    ai_prompts.sort(key=lambda x: x['title'])
+    
+    category_views = []
+    for category in sorted(combiner.get_categories()):
+        # Skip displaying AI prompts here since we have a separate section for them
+        if category == "ai-prompts":
+            continue
+        
+        # Skip the basic-cleanup prompt and the AI prompts
+        prompts = [p for p in combiner.get_prompts_by_category(category) if p['id'] not in special_ids]
+        
+        # The converter already orders prompts by subcategory, or by file name
+        # for prompts directly in the category, and then by title
+        entries = []
+        for prompt in prompts:
+            entries.append({
+                'id': prompt['id'],
+                'title': prompt_title(prompt),
+                'checkbox_key': f"checkbox_{category}_{prompt['id']}",
+                'description': describe_prompt(prompt, category)
+            })
+        
+        category_views.append({
+            'category': category,
+            'label': f"{category.title()} Transformations",
+            'prompts': entries
+        })
+    
+    # Distribute categories between the two columns
+    all_categories = sorted(combiner.get_categories())
+    left_names = set(all_categories[:len(all_categories)//2 + len(all_categories)%2])
+    
+    return {
+        'basic_title': basic_prompt['title'] if basic_prompt else None,
+        'ai_prompts': ai_prompts,
+        'left_categories': [c for c in category_views if c['category'] in left_names],
+        'right_categories': [c for c in category_views if c['category'] not in left_names]
+    }
+
+def render_category_column(category_views, all_selected_ids):
+    """Render the category accordions of one column from the view model."""
+    for view in category_views:
+        with st.expander(view['label']):
+            if not view['prompts']:
+                st.info(f"No prompts available in {view['category']}.")
+                continue
+            
+            for entry in view['prompts']:
+                # Check if this prompt was previously selected
+                is_checked = entry['id'] in st.session_state.selected_prompt_ids
+                
+                # Display the checkbox with description
+                if st.checkbox(entry['title'], value=is_checked, key=entry['checkbox_key']):
+                    all_selected_ids.append(entry['id'])
+                    # Display selected indicator
+                    st.markdown(f"<div class='selected-prompt'>✓ {entry['title']} selected</div>", unsafe_allow_html=True)
+                
+                if entry['description']:
+                    st.markdown(f"<div class='prompt-description'>{entry['description']}</div>", unsafe_allow_html=True)
+
 def format_prompt_name(name):
     """Format prompt name to be more readable."""
     # Remove .md extension if present
@@ -147,20 +314,22 @@ def combine_prompts(combiner):
     if 'selected_prompt_ids' not in st.session_state:
         st.session_state.selected_prompt_ids = []
     
+    view_model = build_view_model(combiner.library_hash, combiner)
+    
     # Always include the basic cleanup prompt
-    basic_prompt = combiner.get_prompt_by_id("basic-cleanup")
-    if basic_prompt and "basic-cleanup" not in st.session_state.selected_prompt_ids:
+    basic_title = view_model['basic_title']
+    if basic_title and "basic-cleanup" not in st.session_state.selected_prompt_ids:
         st.session_state.selected_prompt_ids = ["basic-cleanup"] + [id for id in st.session_state.selected_prompt_ids if id != "basic-cleanup"]
     
     # Display the basic prompt (non-selectable)
-    if basic_prompt:
+    if basic_title:
         st.markdown("""
         <div class="basic-prompt-box">
             <h3>Basic Transformation (Always Applied)</h3>
             <p><b>{}</b></p>
             <p><i>This is the foundation for all transformations and is automatically included.</i></p>
         </div>
-        """.format(basic_prompt['title']), unsafe_allow_html=True)
+        """.format(basic_title), unsafe_allow_html=True)
     
     # Quick Selection Options
     st.markdown("""
@@ -201,9 +370,6 @@ def combine_prompts(combiner):
             if st.button("Detailed Report", key="quick_detailed_report", use_container_width=True):
                 st.session_state.selected_prompt_ids = ["basic-cleanup"] + quick_options["Detailed Report"]
     
-    # Get all categories
-    categories = sorted(combiner.get_categories())
-    
     st.markdown('<div class="prompt-section">', unsafe_allow_html=True)
     st.subheader("Select Additional Transformation Elements")
     st.write("Check the boxes for prompts you want to include in your transformation stack.")
@@ -221,48 +387,24 @@ def combine_prompts(combiner):
     ai_prompts_container = st.container()
     
     with ai_prompts_container:
-        # Get all AI-related prompts using a more direct approach
-        ai_prompt_ids = ['system-prompt', 'user-prompt']
-        ai_prompts = []
-        
-        # Get each AI prompt by ID
-        for prompt_id in ai_prompt_ids:
-            prompt = combiner.get_prompt_by_id(prompt_id)
-            if prompt:
-                ai_prompts.append(prompt)
-        
-        # Sort AI prompts alphabetically
-        ai_prompts = sorted(ai_prompts, key=lambda x: x['title'])
-        
         # Display AI prompts
-        for prompt in ai_prompts:
-            # Clean up the title - remove "Format" and "Prompt" if present
-            prompt_title = prompt['title']
-            if "Format" in prompt_title:
-                prompt_title = prompt_title.replace(" Format", "")
-            if "Prompt" in prompt_title:
-                prompt_title = prompt_title.replace(" Prompt", "")
-            
-            # Create a unique key for the checkbox
-            checkbox_key = f"checkbox_ai_{prompt['id']}"
-            
+        for entry in view_model['ai_prompts']:
             # Check if this prompt was previously selected
-            is_checked = prompt['id'] in st.session_state.selected_prompt_ids
+            is_checked = entry['id'] in st.session_state.selected_prompt_ids
             
             # Display the checkbox with description
-            if st.checkbox(prompt_title, value=is_checked, key=checkbox_key):
-                if prompt['id'] not in st.session_state.selected_prompt_ids:
-                    st.session_state.selected_prompt_ids.append(prompt['id'])
+            if st.checkbox(entry['title'], value=is_checked, key=entry['checkbox_key']):
+                if entry['id'] not in st.session_state.selected_prompt_ids:
+                    st.session_state.selected_prompt_ids.append(entry['id'])
                 # Display selected indicator
-                st.markdown(f"<div class='selected-prompt'>✓ {prompt_title} selected</div>", unsafe_allow_html=True)
+                st.markdown(f"<div class='selected-prompt'>✓ {entry['title']} selected</div>", unsafe_allow_html=True)
             else:
-                if prompt['id'] in st.session_state.selected_prompt_ids:
-                    st.session_state.selected_prompt_ids.remove(prompt['id'])
+                if entry['id'] in st.session_state.selected_prompt_ids:
+                    st.session_state.selected_prompt_ids.remove(entry['id'])
             
             # Add description below the checkbox if content exists
-            if prompt.get('content'):
-                description = "Reformats the text as " + prompt_title.lower() + " instructions."
-                st.markdown(f"<div class='prompt-description'>{description}</div>", unsafe_allow_html=True)
+            if entry['description']:
+                st.markdown(f"<div class='prompt-description'>{entry['description']}</div>", unsafe_allow_html=True)
     
     with prompt_selection:
         # Track all selected prompt IDs to update session state at the end
@@ -271,135 +413,25 @@ def combine_prompts(combiner):
         # Create two columns for the accordions
         col1, col2 = st.columns(2)
         
-        # Distribute categories between columns
-        left_categories = categories[:len(categories)//2 + len(categories)%2]
-        right_categories = categories[len(categories)//2 + len(categories)%2:]
-        
-        # Left column categories
         with col1:
-            for category in left_categories:
-                # Skip displaying AI prompts here since we have a separate section for them
-                if category == "ai-prompts":
-                    continue
-                    
-                with st.expander(f"{category.title()} Transformations"):
-                    # Get all prompts in this category
-                    prompts = combiner.get_prompts_by_category(category)
-                    
-                    # Skip the basic-cleanup prompt as it's automatically included
-                    # Also skip AI prompts as they're in their own section
-                    prompts = [p for p in prompts if p['id'] != "basic-cleanup" and p['id'] not in ['system-prompt', 'user-prompt']]
-                    
-                    # Sort prompts alphabetically by title
-                    prompts = sorted(prompts, key=lambda x: x['title'])
-                    
-                    if not prompts:
-                        st.info(f"No prompts available in {category}.")
-                        continue
-                    
-                    # Group prompts by subcategory for better organization
-                    subcategories = {}
-                    for prompt in prompts:
-                        subcategory = prompt.get('subcategory', 'Other')
-                        if subcategory not in subcategories:
-                            subcategories[subcategory] = []
-                        subcategories[subcategory].append(prompt)
-                    
-                    # Sort subcategories alphabetically
-                    for subcategory in sorted(subcategories.keys()):
-                        subprompts = subcategories[subcategory]
-                        
-                        # Display each prompt with a checkbox and description
-                        for prompt in sorted(subprompts, key=lambda x: x['title']):
-                            # Clean up the title - remove "Format" and "Prompt" if present
-                            prompt_title = prompt['title']
-                            if "Format" in prompt_title:
-                                prompt_title = prompt_title.replace(" Format", "")
-                            if "Prompt" in prompt_title:
-                                prompt_title = prompt_title.replace(" Prompt", "")
-                            
-                            # Create a unique key for the checkbox that includes category to avoid duplicates
-                            checkbox_key = f"checkbox_{category}_{prompt['id']}"
-                            
-                            # Check if this prompt was previously selected
-                            is_checked = prompt['id'] in st.session_state.selected_prompt_ids
-                            
-                            # Display the checkbox with description
-                            if st.checkbox(prompt_title, value=is_checked, key=checkbox_key):
-                                all_selected_ids.append(prompt['id'])
-                                # Display selected indicator
-                                st.markdown(f"<div class='selected-prompt'>✓ {prompt_title} selected</div>", unsafe_allow_html=True)
-                            
-                            # Add description below the checkbox if content exists
-                            if prompt.get('content'):
-                                if category == "format":
-                                    description = "Reformats the text " + (prompt['content'].split('\n')[0] if '\n' in prompt['content'] else prompt['content']).lower()
-                                else:
-                                    description = prompt['content'].split('\n')[0] if '\n' in prompt['content'] else prompt['content']
-                                st.markdown(f"<div class='prompt-description'>{description}</div>", unsafe_allow_html=True)
+            render_category_column(view_model['left_categories'], all_selected_ids)
         
-        # Right column categories
         with col2:
-            for category in right_categories:
-                # Skip displaying AI prompts here since we have a separate section for them
-                if category == "ai-prompts":
-                    continue
-                    
-                with st.expander(f"{category.title()} Transformations"):
-                    # Get all prompts in this category
-                    prompts = combiner.get_prompts_by_category(category)
-                    
-                    # Skip the basic-cleanup prompt as it's automatically included
-                    # Also skip AI prompts as they're in their own section
-                    prompts = [p for p in prompts if p['id'] != "basic-cleanup" and p['id'] not in ['system-prompt', 'user-prompt']]
-                    
-                    # Sort prompts alphabetically by title
-                    prompts = sorted(prompts, key=lambda x: x['title'])
-                    
-                    if not prompts:
-                        st.info(f"No prompts available in {category}.")
-                        continue
-                    
-                    # Group prompts by subcategory for better organization
-                    subcategories = {}
-                    for prompt in prompts:
-                        subcategory = prompt.get('subcategory', 'Other')
-                        if subcategory not in subcategories:
-                            subcategories[subcategory] = []
-                        subcategories[subcategory].append(prompt)
-                    
-                    # Sort subcategories alphabetically
-                    for subcategory in sorted(subcategories.keys()):
-                        subprompts = subcategories[subcategory]
-                        
-                        # Display each prompt with a checkbox and description
-                        for prompt in sorted(subprompts, key=lambda x: x['title']):
-                            # Clean up the title - remove "Format" and "Prompt" if present
-                            prompt_title = prompt['title']
-                            if "Format" in prompt_title:
-                                prompt_title = prompt_title.replace(" Format", "")
-                            if "Prompt" in prompt_title:
-                                prompt_title = prompt_title.replace(" Prompt", "")
-                            
-                            # Create a unique key for the checkbox that includes category to avoid duplicates
-                            checkbox_key = f"checkbox_{category}_{prompt['id']}"
-                            
-                            # Check if this prompt was previously selected
-                            is_checked = prompt['id'] in st.session_state.selected_prompt_ids
-                            
-                            # Display the checkbox with description
-                            if st.checkbox(prompt_title, value=is_checked, key=checkbox_key):
-                                all_selected_ids.append(prompt['id'])
-                                # Display selected indicator
-                                st.markdown(f"<div class='selected-prompt'>✓ {prompt_title} selected</div>", unsafe_allow_html=True)
-                            
-                            # Add description below the checkbox if content exists
-                            if prompt.get('content'):
-                                if category == "format":
-                                    description = "Reformats the text " + (prompt['content'].split('\n')[0] if '\n' in prompt['content'] else prompt['content']).lower()
-                                else:
-                                    description = prompt['content'].split('\n')[0] if '\n' in prompt['content'] else prompt['content']
-                                st.markdown(f"<div class='prompt-description'>{description}</div>", unsafe_allow_html=True)
+            render_category_column(view_model['right_categories'], all_selected_ids)
+        
+        # Search across all prompts
+        search_query = st.text_input("Search prompts", key="prompt_search", placeholder="e.g. formal email")
+        if search_query:
+            results = combiner.search(search_query, limit=10)
+            if not results:
+                st.info(f"No prompts found for '{search_query}'.")
+            
+            for prompt, _ in results:
+                title = prompt_title(prompt)
+                is_checked = prompt['id'] in st.session_state.selected_prompt_ids
+                
+                if st.checkbox(f"{title} ({prompt['category']})", value=is_checked, key=f"checkbox_search_{prompt['id']}"):
+                    all_selected_ids.append(prompt['id'])
         
         # Signature Transformations Section
         st.markdown("<h3>Signature Transformations</h3>", unsafe_allow_html=True)
@@ -438,6 +470,14 @@ def combine_prompts(combiner):
         # Update session state with all selected IDs
         st.session_state.selected_prompt_ids = list(set(all_selected_ids))
         
+        # Running size estimate from the cached per-prompt token counts
+        estimated_tokens = combiner.estimate_tokens(st.session_state.selected_prompt_ids)
+        st.caption(f"Estimated stack size: ~{estimated_tokens} tokens")
+        
+        # Option to drop boilerplate repeated across the selected prompts
+        dedupe = st.checkbox("Remove repeated boilerplate", key="dedupe_prompts",
+                             help="Keeps only the first copy of sentences, paragraphs and sections that appear in several prompts.")
+        
         # Combine button
         st.markdown("<br>", unsafe_allow_html=True)
         if st.button("Create Transformation Prompt Stack", key="combine", use_container_width=True):
@@ -445,7 +485,12 @@ def combine_prompts(combiner):
                 st.info("Please select additional prompts to combine with the basic prompt.")
             else:
                 try:
-                    combined_prompt = combiner.combine_prompts(st.session_state.selected_prompt_ids)
+                    combined_prompt = combiner.combine_prompts(st.session_state.selected_prompt_ids, dedupe=dedupe)
+                    
+                    if dedupe:
+                        report = combiner.dedupe_report(st.session_state.selected_prompt_ids)
+                        if report['bytes_saved']:
+                            st.caption(f"Removed {report['bytes_saved']} bytes (~{report['tokens_saved']} tokens) of repeated text.")
                     
                     # Add custom signature if selected
                     if use_signature and signature_type == "Custom" and "custom-signature" in st.session_state.selected_prompt_ids:
@@ -467,6 +512,7 @@ def combine_prompts(combiner):
         if st.session_state.get('show_combined', False):
             st.markdown("<hr>", unsafe_allow_html=True)
             st.subheader("Your Transformation System Prompt")
+            st.caption(f"~{combiner.token_estimator.count(st.session_state.combined_prompt)} tokens")
             
             col1, col2 = st.columns([0.95, 0.05])
             
@@ -490,14 +536,11 @@ def combine_prompts(combiner):
             
             # Text transformation area
             st.subheader("Test Your Transformation Stack")
-            st.write("Paste your dictated text below to see how it would be transformed:")
+            st.write("Paste your dictated text below to transform it:")
             
             user_text = st.text_area("Dictated Text:", height=200)
             if user_text and st.button("Transform Text"):
-                st.subheader("Transformed Text")
-                st.info("This is where the transformed text would appear if connected to an AI model.")
-                st.write("The combined prompt would be sent to an AI model along with the dictated text.")
-                st.write("The AI would then transform the text according to the instructions in the combined prompt.")
+                show_transformation(st.session_state.combined_prompt, user_text, "transformed_text")
 
 def about():
     """Display information about the application."""
@@ -757,14 +800,11 @@ Return only the JSON array, properly formatted and indented."""
     if 'structured_prompt' in st.session_state:
         st.text_area("Selected Structured Prompt", value=st.session_state.structured_prompt, height=300)
         
-        st.write("Paste your dictated text below to see how it would be transformed:")
+        st.write("Paste your dictated text below to transform it:")
         user_text = st.text_area("Dictated Text:", height=200, key="structured_text")
         
         if user_text and st.button("Transform to Structured Format"):
-            st.subheader("Transformed Text")
-            st.info("This is where the structured output would appear if connected to an AI model.")
-            st.write("The structured prompt would be sent to an AI model along with the dictated text.")
-            st.write("The AI would then transform the text according to the structured format specified.")
+            show_transformation(st.session_state.structured_prompt, user_text, "structured_output")
     else:
         st.info("Select a structured prompt above to test it.")
 
@@ -0,0 +1,946 @@
+#!/usr/bin/env python3
+"""
+Benchmarks for the Text Transformation Prompt Combiner.
+"""
+import os
+import re
+import sys
+import json
+import asyncio
+import argparse
+import shutil
+import subprocess
+import tempfile
+import time
+import random
+import threading
+import tracemalloc
+from urllib.parse import urlsplit
+from prompt_converter import convert_directory_to_json
+from prompt_combiner import PromptCombiner, Prompt
+from prompt_library import write_library
+from prompt_search import SearchIndex, tokenize
+from prompt_shared import SharedLibraryPublisher
+from prompt_transform import MockBackend, MockChatServer, OpenAIBackend, TransformExecutor
+from prompt_chunking import TextChunker
+from prompt_cache import ResponseCache
+from prompt_similarity import SimilarityIndex, minhash
+
+
+def generate_prompt_tree(directory_path, file_count, categories=20, subcategories=10):
+    """Write a synthetic system-prompts tree with the given number of files."""
+    for i in range(file_count):
+        category = f"category-{i % categories:02d}"
+        subcategory = f"subcategory-{(i // categories) % subcategories:02d}"
+        folder = os.path.join(directory_path, category, subcategory)
+        os.makedirs(folder, exist_ok=True)
+        
+        with open(os.path.join(folder, f"prompt-{i:06d}.md"), 'w', encoding='utf-8') as f:
+            f.write(f"# Synthetic Prompt {i}\n\n")
+            f.write("You are a helpful writing assistant. \n\n")
+            f.write("Your task is to take text which was captured by the user using speech to text. \n\n")
+            f.write(f"- Apply transformation number {i} to the text.\n- Return only the edited text.\n")
+
+
+def benchmark_convert(file_count, job_counts):
+    """Measure conversion throughput for each worker count."""
+    work_dir = tempfile.mkdtemp(prefix="prompt-bench-")
+    prompts_dir = os.path.join(work_dir, "system-prompts")
+    
+    try:
+        print(f"Generating {file_count} markdown files in {prompts_dir}...")
+        generate_prompt_tree(prompts_dir, file_count)
+        
+        print(f"{'jobs':>6} {'seconds':>10} {'files/s':>12} {'speedup':>8}")
+        baseline = None
+        for jobs in job_counts:
+            start = time.perf_counter()
+            prompts = convert_directory_to_json(prompts_dir, jobs=jobs)
+            elapsed = time.perf_counter() - start
+            
+            if len(prompts) != file_count:
+                print(f"Warning: converted {len(prompts)} of {file_count} files")
+                
+            baseline = baseline or elapsed
+            print(f"{jobs:>6} {elapsed:>10.2f} {file_count / elapsed:>12.0f} {baseline / elapsed:>7.2f}x")
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+def generate_prompts(prompt_count, vocabulary_size=5000, seed=0):
+    """Build a synthetic in-memory prompt library with a Zipf-like vocabulary."""
+    rng = random.Random(seed)
+    syllables = ["pro", "con", "tra", "sum", "for", "tex", "bri", "cal", "mat", "ten", "ief", "ary", "mal", "ton", "lis", "not"]
+    words = ["".join(rng.choice(syllables) for _ in range(rng.randint(1, 3))) for _ in range(vocabulary_size)]
+    weights = [1 / rank for rank in range(1, vocabulary_size + 1)]
+    
+    prompts = []
+    for i in range(prompt_count):
+        body = " ".join(rng.choices(words, weights, k=80))
+        title = " ".join(word.title() for word in rng.choices(words, weights, k=3))
+        prompts.append({
+            "id": f"prompt-{i:06d}",
+            "title": f"{title} Format",
+            "content": f"You are a helpful writing assistant. {body}",
+            "category": f"category-{i % 20:02d}",
+            "subcategory": f"subcategory-{i % 7}",
+            "file_path": f"system-prompts/category-{i % 20:02d}/prompt-{i:06d}.md"
+        })
+    return prompts
+
+
+def _brute_force_search(index, query, limit=10, max_expansions=32):
+    """Score every document for a query, as the reference for SearchIndex.search()."""
+    scores = {}
+    for token in set(tokenize(query)):
+        token_scores = {}
+        for term in index._expand(token, max_expansions):
+            postings = index.postings[term]
+            for doc, weight in zip(postings.docs, postings.weights):
+                if weight > token_scores.get(doc, 0.0):
+                    token_scores[doc] = weight
+        for doc, weight in token_scores.items():
+            scores[doc] = scores.get(doc, 0.0) + weight
+    return sorted(scores.values(), reverse=True)[:limit]
+
+
+def benchmark_search(prompt_count, query_count=1000):
+    """Measure search index build, save and load time, query latency, and exactness of the ranking."""
+    combiner = PromptCombiner(prompts_json=generate_prompts(prompt_count))
+    
+    start = time.perf_counter()
+    index = combiner.get_search_index()
+    print(f"Built search index for {prompt_count} prompts in {time.perf_counter() - start:.2f}s")
+    
+    work_dir = tempfile.mkdtemp(prefix="prompt-bench-")
+    try:
+        index_file = os.path.join(work_dir, "prompts.json.search.json")
+        start = time.perf_counter()
+        index.save(index_file)
+        save_time = time.perf_counter() - start
+        start = time.perf_counter()
+        SearchIndex.load(index_file, index.library_hash)
+        print(f"Saved in {save_time:.2f}s, loaded in {time.perf_counter() - start:.2f}s "
+              f"({os.path.getsize(index_file) / (1024 * 1024):.1f} MB)")
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+    
+    rng = random.Random(1)
+    queries = ["formal tone", "calendar", "bri", "summary list", "helpful writing", "protone notes", "mattra"]
+    latencies = []
+    for _ in range(query_count):
+        query = rng.choice(queries)
+        start = time.perf_counter()
+        combiner.search(query)
+        latencies.append(time.perf_counter() - start)
+    
+    latencies.sort()
+    print(f"{query_count} queries: p50 {latencies[len(latencies) // 2] * 1000:.3f} ms, "
+          f"p99 {latencies[int(len(latencies) * 0.99)] * 1000:.3f} ms")
+    
+    exact = sum(
+        1 for query in queries
+        if [round(score, 9) for _, score in index.search(query)] ==
+           [round(score, 9) for score in _brute_force_search(index, query)]
+    )
+    print(f"Rankings equal to scoring every document: {exact} of {len(queries)} queries")
+
+
+# Run in a fresh interpreter so each measurement starts cold
+LIBRARY_PROBE = """
+import sys, time
+start = time.perf_counter()
+from prompt_combiner import PromptCombiner
+combiner = PromptCombiner(json_file=sys.argv[1])
+combiner.get_categories()
+combiner.combine_prompts([sys.argv[2]])
+elapsed = time.perf_counter() - start
+with open('/proc/self/status') as f:
+    rss = {line.split(':')[0]: int(line.split()[1]) for line in f if line.startswith(('RssAnon', 'RssFile'))}
+print(elapsed, rss.get('RssAnon', 0), rss.get('RssFile', 0))
+"""
+
+
+def benchmark_library(prompt_counts):
+    """Compare cold start and memory of JSON and compiled libraries by size."""
+    work_dir = tempfile.mkdtemp(prefix="prompt-bench-")
+    probe_env = dict(os.environ, PYTHONPATH=os.path.dirname(os.path.abspath(__file__)))
+    
+    try:
+        print(f"{'prompts':>8} {'format':>6} {'seconds':>8} {'anon MB':>8} {'file MB':>8}")
+        for prompt_count in prompt_counts:
+            prompts = generate_prompts(prompt_count)
+            json_file = os.path.join(work_dir, f"prompts-{prompt_count}.json")
+            with open(json_file, 'w', encoding='utf-8') as f:
+                json.dump(prompts, f)
+            bin_file = os.path.join(work_dir, f"prompts-{prompt_count}.bin")
+            write_library(prompts, bin_file)
+            del prompts
+            
+            for library_format, library_file in (("json", json_file), ("bin", bin_file)):
+                result = subprocess.run(
+                    [sys.executable, "-c", LIBRARY_PROBE, library_file, f"prompt-{prompt_count // 2:06d}"],
+                    capture_output=True, text=True, env=probe_env, check=True
+                )
+                elapsed, anon_kb, file_kb = result.stdout.split()
+                print(f"{prompt_count:>8} {library_format:>6} {float(elapsed):>8.3f} "
+                      f"{int(anon_kb) / 1024:>8.1f} {int(file_kb) / 1024:>8.1f}")
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+def _traced_size(build):
+    """Return what build() returns and the bytes still allocated for it."""
+    tracemalloc.start()
+    result = build()
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return result, size
+
+
+def benchmark_memory(prompt_count):
+    """Compare the memory used by prompt dicts and Prompt records."""
+    data = json.dumps(generate_prompts(prompt_count))
+    
+    # Decode from JSON, as the combiner does, so strings are not shared
+    prompts, dict_size = _traced_size(lambda: json.loads(data))
+    content_size = sum(sys.getsizeof(prompt['content']) for prompt in prompts)
+    del prompts
+    
+    records, record_size = _traced_size(lambda: [Prompt.from_dict(prompt) for prompt in json.loads(data)])
+    del records
+    
+    print(f"{prompt_count} prompts, {content_size / prompt_count:.0f} bytes of content per prompt")
+    print(f"{'storage':>8} {'total MB':>9} {'bytes/prompt':>13} {'overhead/prompt':>16}")
+    for name, size in (("dict", dict_size), ("Prompt", record_size)):
+        print(f"{name:>8} {size / 1024 / 1024:>9.1f} {size / prompt_count:>13.0f} "
+              f"{(size - content_size) / prompt_count:>16.0f}")
+
+
+# Load a library, read every prompt once, then wait to be measured
+SHARED_PROBE = """
+import sys
+from prompt_combiner import PromptCombiner
+if sys.argv[1] == 'shared':
+    combiner = PromptCombiner(shared_library=sys.argv[2])
+else:
+    combiner = PromptCombiner(json_file=sys.argv[2])
+for prompt in combiner.prompts:
+    prompt['content']
+print('ready', flush=True)
+sys.stdin.readline()
+"""
+
+
+def _proportional_set_size(pid):
+    """Get a process's proportional set size in kB, splitting shared pages between their users."""
+    with open(f'/proc/{pid}/smaps_rollup') as f:
+        for line in f:
+            if line.startswith('Pss:'):
+                return int(line.split()[1])
+    return 0
+
+
+def benchmark_shared(prompt_count, worker_counts):
+    """Compare host memory of workers loading the JSON file and attaching to shared memory."""
+    work_dir = tempfile.mkdtemp(prefix="prompt-bench-")
+    probe_env = dict(os.environ, PYTHONPATH=os.path.dirname(os.path.abspath(__file__)))
+    json_file = os.path.join(work_dir, "prompts.json")
+    with open(json_file, 'w', encoding='utf-8') as f:
+        json.dump(generate_prompts(prompt_count), f)
+    
+    publisher = SharedLibraryPublisher(json_file, f"prompt-bench-{os.getpid()}")
+    publisher.publish()
+    
+    try:
+        print(f"{prompt_count} prompts, {os.path.getsize(json_file) / 1024 / 1024:.1f} MB of JSON")
+        print(f"{'workers':>8} {'mode':>7} {'total PSS MB':>13} {'per worker MB':>14}")
+        for worker_count in worker_counts:
+            for mode, source in (("json", json_file), ("shared", publisher.name)):
+                workers = [
+                    subprocess.Popen(
+                        [sys.executable, "-c", SHARED_PROBE, mode, source],
+                        stdin=subprocess.PIPE, stdout=subprocess.PIPE, env=probe_env
+                    )
+                    for _ in range(worker_count)
+                ]
+                try:
+                    for worker in workers:
+                        worker.stdout.readline()
+                    total = sum(_proportional_set_size(worker.pid) for worker in workers) / 1024
+                finally:
+                    for worker in workers:
+                        worker.stdin.close()
+                        worker.wait()
+                print(f"{worker_count:>8} {mode:>7} {total:>13.1f} {total / worker_count:>14.1f}")
+    finally:
+        publisher.close()
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+CONTENT_LENGTH_PATTERN = re.compile(rb"content-length:\s*(\d+)", re.IGNORECASE)
+
+
+async def _http_client(host, port, paths, request_count, latencies):
+    """Send requests one after another over a single keep-alive connection."""
+    reader, writer = await asyncio.open_connection(host, port)
+    try:
+        for path in paths[:request_count]:
+            start = time.perf_counter()
+            writer.write(f"GET {path} HTTP/1.1\r\nHost: {host}\r\n\r\n".encode('latin-1'))
+            head = await reader.readuntil(b"\r\n\r\n")
+            await reader.readexactly(int(CONTENT_LENGTH_PATTERN.search(head).group(1)))
+            latencies.append(time.perf_counter() - start)
+    finally:
+        writer.close()
+
+
+async def _http_load(host, port, paths, concurrency, request_count):
+    """Run concurrent clients and return their latencies and the elapsed time."""
+    latencies = []
+    per_client = max(1, request_count // concurrency)
+    start = time.perf_counter()
+    await asyncio.gather(*(
+        _http_client(host, port, paths[i:] + paths[:i], per_client, latencies)
+        for i in range(concurrency)
+    ))
+    return latencies, time.perf_counter() - start
+
+
+def benchmark_http(url, concurrency_levels, request_count, prompt_count):
+    """
+    Measure HTTP service latency and throughput at increasing concurrency.
+    
+    Without a URL, a server is started on a synthetic library for the run.
+    """
+    work_dir = None
+    server = None
+    
+    try:
+        if url is None:
+            work_dir = tempfile.mkdtemp(prefix="prompt-bench-")
+            json_file = os.path.join(work_dir, "prompts.json")
+            with open(json_file, 'w', encoding='utf-8') as f:
+                json.dump(generate_prompts(prompt_count), f)
+            
+            cli_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "cli.py")
+            server = subprocess.Popen(
+                [sys.executable, cli_path, "serve-http", "-j", json_file, "--port", "0"],
+                stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True
+            )
+            announcement = server.stdout.readline()
+            url = announcement.split()[-1] if announcement.strip() else None
+            if not url:
+                print("Error: The HTTP server did not start.")
+                return
+        
+        address = urlsplit(url)
+        host, port = address.hostname, address.port or 80
+        
+        # A mix of cacheable combines, lookups and searches
+        rng = random.Random(2)
+        ids = [f"prompt-{i:06d}" for i in range(prompt_count)]
+        paths = []
+        for i in range(200):
+            kind = i % 4
+            if kind < 2:
+                paths.append(f"/combine?ids={','.join(rng.sample(ids, 3))}")
+            elif kind == 2:
+                paths.append(f"/prompts/{rng.choice(ids)}")
+            else:
+                paths.append(f"/search?q={rng.choice(['formal', 'summary', 'tone', 'bri'])}")
+        paths *= max(1, request_count // len(paths) + 1)
+        
+        print(f"Load testing {url} with {request_count} requests per level")
+        print(f"{'clients':>8} {'req/s':>10} {'p50 ms':>8} {'p99 ms':>8}")
+        for concurrency in concurrency_levels:
+            latencies, elapsed = asyncio.run(_http_load(host, port, paths, concurrency, request_count))
+            latencies.sort()
+            print(f"{concurrency:>8} {len(latencies) / elapsed:>10.0f} "
+                  f"{latencies[len(latencies) // 2] * 1000:>8.2f} "
+                  f"{latencies[int(len(latencies) * 0.99)] * 1000:>8.2f}")
+    finally:
+        if server:
+            server.terminate()
+            server.wait()
+        if work_dir:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+
+def benchmark_snapshots(reader_count, duration, prompt_count):
+    """
+    Stress snapshot swaps with concurrent readers while the library reloads.
+    
+    The library file alternates between two versions whose prompts are
+    marked with their version. Readers combine, search and look up prompts
+    and fail if any result mixes prompts from both versions.
+    """
+    work_dir = tempfile.mkdtemp(prefix="prompt-bench-")
+    json_file = os.path.join(work_dir, "prompts.json")
+    
+    try:
+        versions = {}
+        for version in ("alpha", "omega"):
+            prompts = generate_prompts(prompt_count)
+            for prompt in prompts:
+                prompt['content'] = f"[{version}] {prompt['content']}"
+            versions[version] = os.path.join(work_dir, f"{version}.json")
+            with open(versions[version], 'w', encoding='utf-8') as f:
+                json.dump(prompts, f)
+        shutil.copyfile(versions["alpha"], json_file)
+        
+        combiner = PromptCombiner(json_file=json_file)
+        stop = threading.Event()
+        operations = [0] * reader_count
+        errors = []
+        rng = random.Random(2)
+        selections = [
+            [f"prompt-{rng.randrange(prompt_count):06d}" for _ in range(rng.randint(2, 6))]
+            for _ in range(200)
+        ]
+        
+        def check(text, what):
+            if ("[alpha]" in text) == ("[omega]" in text):
+                errors.append(f"{what} mixed or missing versions")
+        
+        def reader(number):
+            local_rng = random.Random(number)
+            while not stop.is_set():
+                try:
+                    selection = local_rng.choice(selections)
+                    check(combiner.combine_prompts(selection), "combine")
+                    check("".join(combiner.iter_combined_prompt(selection, dedupe=True)), "stream")
+                    # Each new snapshot rebuilds its search index on first use
+                    if operations[number] % 16 == 0:
+                        check(" ".join(p['content'] for p, _ in combiner.search("helpful writing", 5)), "search")
+                    check(combiner.get_prompt_by_id(selection[0])['content'], "lookup")
+                    combiner.estimate_tokens(selection)
+                except Exception as e:
+                    errors.append(f"{type(e).__name__}: {e}")
+                operations[number] += 1
+        
+        threads = [threading.Thread(target=reader, args=(number,)) for number in range(reader_count)]
+        for thread in threads:
+            thread.start()
+        
+        # Reload in a loop, alternating the file between the two versions
+        reloads = 0
+        reload_times = []
+        deadline = time.perf_counter() + duration
+        while time.perf_counter() < deadline:
+            version = "omega" if reloads % 2 == 0 else "alpha"
+            shutil.copyfile(versions[version], f"{json_file}.tmp")
+            os.replace(f"{json_file}.tmp", json_file)
+            start = time.perf_counter()
+            combiner.reload()
+            reload_times.append(time.perf_counter() - start)
+            reloads += 1
+        
+        stop.set()
+        for thread in threads:
+            thread.join()
+        
+        total = sum(operations)
+        print(f"{reader_count} readers, {prompt_count} prompts, {duration:.0f}s")
+        print(f"{reloads} reloads, mean {sum(reload_times) / len(reload_times) * 1000:.1f} ms")
+        print(f"{total} reader operations, {total / duration:.0f}/s")
+        print(f"Retired snapshots still referenced: {combiner.retired_snapshots()}")
+        print(f"Errors: {len(errors)}")
+        for error in errors[:10]:
+            print(f"  {error}")
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+def generate_transcripts(transcript_count, seed=0):
+    """Build synthetic dictated texts of a few sentences each."""
+    rng = random.Random(seed)
+    words = ["so", "um", "the", "meeting", "tomorrow", "email", "send", "report", "draft", "project",
+             "client", "budget", "please", "remind", "team", "about", "deadline", "friday", "notes", "update"]
+    return [
+        " ".join(rng.choice(words) for _ in range(rng.randint(40, 200)))
+        for _ in range(transcript_count)
+    ]
+
+
+def benchmark_transform(transcript_count, concurrency_levels, latency):
+    """
+    Measure transformation throughput against a local mock chat completions server.
+    
+    Every request waits the same simulated model latency, so throughput
+    shows how well the executor overlaps requests, and the connection
+    count shows how well the pool reuses them.
+    """
+    server = MockChatServer(latency=latency)
+    address = {}
+    started = threading.Event()
+    
+    def run_server():
+        def ready(bound):
+            address['url'] = f"http://{bound[0]}:{bound[1]}/v1"
+            started.set()
+        asyncio.run(server.serve(ready=ready))
+    
+    threading.Thread(target=run_server, daemon=True).start()
+    started.wait()
+    
+    system_prompt = "\n\n".join(p['content'] for p in generate_prompts(3))
+    transcripts = generate_transcripts(transcript_count)
+    
+    async def run(executor):
+        try:
+            return await executor.transform_all(system_prompt, transcripts)
+        finally:
+            await executor.close()
+    
+    print(f"{transcript_count} transcripts against {address['url']} with {latency * 1000:.0f} ms simulated latency")
+    print(f"{'in flight':>10} {'seconds':>8} {'texts/s':>10} {'conns':>6} {'speedup':>8}")
+    baseline = None
+    for concurrency in concurrency_levels:
+        connections_before = server.connections
+        executor = TransformExecutor(OpenAIBackend(base_url=address['url'], api_key="benchmark", pool_size=concurrency),
+                                     concurrency=concurrency)
+        start = time.perf_counter()
+        results = asyncio.run(run(executor))
+        elapsed = time.perf_counter() - start
+        
+        failed = sum(1 for result in results if "error" in result)
+        rate = len(results) / elapsed
+        baseline = baseline or rate
+        print(f"{concurrency:>10} {elapsed:>8.2f} {rate:>10.1f} "
+              f"{server.connections - connections_before:>6} {rate / baseline:>7.1f}x")
+        if failed:
+            print(f"Warning: {failed} transformations failed")
+
+
+def _cache_worker(cache_file, stack, transcripts, number):
+    """Store and look up responses from one of several processes sharing a cache."""
+    cache = ResponseCache(cache_file)
+    errors = 0
+    for i, text in enumerate(transcripts):
+        keys = (stack, f"{number}-{i}")
+        cache.put(*keys, text)
+        if cache.get(*keys) != text:
+            errors += 1
+    cache.close()
+    return errors
+
+
+def benchmark_cache(entry_count, worker_count):
+    """
+    Measure response cache latency and check concurrent use from several processes.
+    
+    Lookups are timed against a cache holding entry_count responses, then
+    worker processes write and read back their own responses in one file.
+    """
+    from concurrent.futures import ProcessPoolExecutor
+    
+    work_dir = tempfile.mkdtemp(prefix="prompt-bench-")
+    cache_file = os.path.join(work_dir, "responses.sqlite3")
+    
+    try:
+        cache = ResponseCache(cache_file)
+        transcripts = generate_transcripts(1000)
+        stack = cache.keys("system prompt", {"model": "benchmark"}, "")[0]
+        keys = [cache.keys("system prompt", {"model": "benchmark"}, f"{i} {transcripts[i % 1000]}")[1]
+                for i in range(entry_count)]
+        
+        start = time.perf_counter()
+        for i, key in enumerate(keys):
+            cache.put(stack, key, transcripts[i % 1000])
+        put_time = (time.perf_counter() - start) / entry_count
+        
+        lookups = random.Random(3).choices(keys, k=20000)
+        start = time.perf_counter()
+        for key in lookups:
+            cache.get(stack, key)
+        hit_time = (time.perf_counter() - start) / len(lookups)
+        
+        start = time.perf_counter()
+        for i in range(len(lookups)):
+            cache.get(stack, f"missing-{i}")
+        miss_time = (time.perf_counter() - start) / len(lookups)
+        
+        stats = cache.stats()
+        cache.close()
+        
+        print(f"{entry_count} responses, {stats['bytes'] / (1024 * 1024):.1f} MB")
+        print(f"put  {put_time * 1e6:>8.1f} us")
+        print(f"hit  {hit_time * 1e6:>8.1f} us")
+        print(f"miss {miss_time * 1e6:>8.1f} us")
+        
+        per_worker = 500
+        start = time.perf_counter()
+        with ProcessPoolExecutor(max_workers=worker_count) as executor:
+            errors = sum(executor.map(
+                _cache_worker, [cache_file] * worker_count, [stack] * worker_count,
+                [transcripts[:per_worker]] * worker_count, range(worker_count)
+            ))
+        elapsed = time.perf_counter() - start
+        
+        cache = ResponseCache(cache_file)
+        entries = cache.stats()['entries']
+        cache.close()
+        print(f"{worker_count} processes wrote and read back {worker_count * per_worker} responses "
+              f"in {elapsed:.2f}s, {errors} mismatches, {entries - entry_count} new entries")
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+def benchmark_similarity(entry_counts, threshold):
+    """
+    Measure near-duplicate lookup latency as the similarity index grows.
+    
+    The index is filled with random signatures, which share buckets with
+    nothing, plus signatures of real transcripts. Queries are reworded
+    copies of those transcripts, so every lookup should find its original.
+    """
+    work_dir = tempfile.mkdtemp(prefix="prompt-bench-")
+    
+    try:
+        cache = ResponseCache(os.path.join(work_dir, "responses.sqlite3"))
+        index = SimilarityIndex(cache, threshold)
+        stack = cache.keys("system prompt", {"model": "benchmark"}, "")[0]
+        rng = random.Random(4)
+        
+        transcripts = generate_transcripts(200, seed=4)
+        originals = []
+        for i, text in enumerate(transcripts):
+            text_hash = f"original-{i}"
+            cache.put(stack, text_hash, text)
+            index.add(stack, text_hash, minhash(text))
+            originals.append(text_hash)
+        
+        # Drop one word from each transcript
+        queries = []
+        for text in transcripts:
+            words = text.split()
+            del words[rng.randrange(len(words))]
+            queries.append(minhash(" ".join(words)))
+        
+        print(f"Threshold {threshold}, {index.bands} bands of {index.rows} rows")
+        print(f"{'entries':>10} {'lookup us':>10} {'found':>7}")
+        stored = 0
+        for entry_count in entry_counts:
+            while stored < entry_count:
+                text_hash = f"random-{stored}"
+                cache.put(stack, text_hash, "")
+                index.add(stack, text_hash, [rng.getrandbits(32) for _ in range(64)])
+                stored += 1
+            
+            start = time.perf_counter()
+            matches = [index.find(stack, signature) for signature in queries]
+            elapsed = (time.perf_counter() - start) / len(queries)
+            found = sum(1 for match, original in zip(matches, originals) if match and match[0] == original)
+            print(f"{entry_count:>10} {elapsed * 1e6:>10.1f} {found:>3}/{len(queries)}")
+        
+        cache.close()
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+def default_job_counts():
+    """Powers of two up to the number of CPUs, plus the CPU count itself."""
+    cpu_count = os.cpu_count() or 1
+    job_counts = []
+    jobs = 1
+    while jobs < cpu_count:
+        job_counts.append(jobs)
+        jobs *= 2
+    job_counts.append(cpu_count)
+    return job_counts
+
+
+def generate_dictation(word_count, seed=0):
+    """Build one long synthetic dictation of sentences and paragraphs."""
+    rng = random.Random(seed)
+    words = " ".join(generate_transcripts(word_count // 40 + 1, seed)).split()[:word_count]
+    paragraphs = []
+    position = 0
+    while position < len(words):
+        sentences = []
+        for _ in range(rng.randint(3, 8)):
+            length = rng.randint(8, 30)
+            if position < len(words):
+                sentences.append(" ".join(words[position:position + length]).capitalize() + ".")
+            position += length
+        paragraphs.append(" ".join(sentences))
+    return "\n\n".join(paragraphs)
+
+
+def benchmark_chunking(word_counts, chunk_tokens, overlap_tokens, concurrency, latency, word_latency):
+    """
+    Compare transforming long dictations in one request and in concurrent chunks.
+    
+    The mock backend takes longer the more words it is sent, like a model
+    generating its output, so a single request grows with the dictation
+    while chunks run side by side.
+    """
+    system_prompt = "\n\n".join(p['content'] for p in generate_prompts(3))
+    chunker = TextChunker(chunk_tokens, overlap_tokens)
+    
+    def run(executor, text):
+        start = time.perf_counter()
+        result = asyncio.run(executor.transform_result(system_prompt, text))
+        return result, time.perf_counter() - start
+    
+    print(f"Chunks of {chunk_tokens} tokens with {overlap_tokens} overlap, {concurrency} in flight, "
+          f"{latency * 1000:.0f} ms + {word_latency * 1000:.1f} ms per word simulated latency")
+    print(f"{'words':>8} {'chunks':>7} {'single s':>9} {'chunked s':>10} {'speedup':>8} {'split ms':>9}")
+    for word_count in word_counts:
+        text = generate_dictation(word_count)
+        backend = MockBackend(latency=latency, word_latency=word_latency)
+        
+        _, single_time = run(TransformExecutor(backend, concurrency=concurrency), text)
+        result, chunked_time = run(TransformExecutor(backend, concurrency=concurrency, chunker=chunker), text)
+        
+        start = time.perf_counter()
+        chunker.split(text)
+        split_time = time.perf_counter() - start
+        
+        print(f"{word_count:>8} {result.get('chunks', 1):>7} {single_time:>9.2f} {chunked_time:>10.2f} "
+              f"{single_time / chunked_time:>7.1f}x {split_time * 1000:>9.1f}")
+
+
+def setup_argparse():
+    """Set up command-line argument parsing."""
+    parser = argparse.ArgumentParser(description="Text Transformation Prompt Combiner benchmarks")
+    subparsers = parser.add_subparsers(dest="benchmark", help="Benchmark to run")
+    
+    # Convert benchmark
+    convert_parser = subparsers.add_parser("convert", help="Markdown conversion throughput by worker count")
+    convert_parser.add_argument(
+        "-n", "--files",
+        type=int,
+        default=100000,
+        help="Number of synthetic markdown files to generate"
+    )
+    convert_parser.add_argument(
+        "--jobs",
+        help="Comma-separated worker counts to measure (default: powers of two up to the CPU count)"
+    )
+    
+    # Search benchmark
+    search_parser = subparsers.add_parser("search", help="Search index build time and query latency")
+    search_parser.add_argument(
+        "-n", "--prompts",
+        type=int,
+        default=50000,
+        help="Number of synthetic prompts to index"
+    )
+    
+    # Library format benchmark
+    library_parser = subparsers.add_parser("library", help="Cold start and memory of JSON and compiled libraries")
+    library_parser.add_argument(
+        "-n", "--prompts",
+        default="1000,10000,100000",
+        help="Comma-separated library sizes to measure"
+    )
+    
+    # Prompt record memory benchmark
+    memory_parser = subparsers.add_parser("memory", help="Per-prompt memory of dicts and Prompt records")
+    memory_parser.add_argument(
+        "-n", "--prompts",
+        type=int,
+        default=100000,
+        help="Number of synthetic prompts to load"
+    )
+    
+    # Shared memory library across worker processes
+    shared_parser = subparsers.add_parser("shared", help="Host memory of workers loading JSON versus shared memory")
+    shared_parser.add_argument(
+        "-n", "--prompts",
+        type=int,
+        default=20000,
+        help="Number of synthetic prompts"
+    )
+    shared_parser.add_argument(
+        "-w", "--workers",
+        default="1,4,8",
+        help="Comma-separated numbers of worker processes"
+    )
+    
+    # HTTP service load generator
+    http_parser = subparsers.add_parser("http", help="HTTP service latency and throughput by concurrency")
+    http_parser.add_argument(
+        "--url",
+        help="Base URL of a running 'cli.py serve-http' (default: start one on a synthetic library)"
+    )
+    http_parser.add_argument(
+        "-c", "--concurrency",
+        default="1,4,16,64",
+        help="Comma-separated numbers of concurrent keep-alive clients"
+    )
+    http_parser.add_argument(
+        "-r", "--requests",
+        type=int,
+        default=5000,
+        help="Number of requests per concurrency level"
+    )
+    http_parser.add_argument(
+        "-n", "--prompts",
+        type=int,
+        default=1000,
+        help="Number of synthetic prompts when starting a server"
+    )
+    
+    # Concurrent readers during reloads
+    snapshots_parser = subparsers.add_parser("snapshots", help="Reader consistency while the library reloads")
+    snapshots_parser.add_argument(
+        "-t", "--threads",
+        type=int,
+        default=16,
+        help="Number of reader threads"
+    )
+    snapshots_parser.add_argument(
+        "-d", "--duration",
+        type=float,
+        default=10.0,
+        help="Seconds to keep reloading"
+    )
+    snapshots_parser.add_argument(
+        "-n", "--prompts",
+        type=int,
+        default=1000,
+        help="Number of synthetic prompts"
+    )
+    
+    # Transformation executor against a mock model server
+    transform_parser = subparsers.add_parser("transform", help="Transformation throughput against a mock model server")
+    transform_parser.add_argument(
+        "-n", "--transcripts",
+        type=int,
+        default=500,
+        help="Number of synthetic transcripts per concurrency level"
+    )
+    transform_parser.add_argument(
+        "-c", "--concurrency",
+        default="1,8,32,128",
+        help="Comma-separated numbers of requests in flight"
+    )
+    transform_parser.add_argument(
+        "--latency",
+        type=float,
+        default=0.05,
+        help="Simulated model latency in seconds"
+    )
+    
+    # Response cache
+    cache_parser = subparsers.add_parser("cache", help="Response cache latency and multi-process use")
+    cache_parser.add_argument(
+        "-n", "--entries",
+        type=int,
+        default=100000,
+        help="Number of cached responses"
+    )
+    cache_parser.add_argument(
+        "-w", "--workers",
+        type=int,
+        default=4,
+        help="Number of processes sharing the cache"
+    )
+    
+    # Near-duplicate index
+    similarity_parser = subparsers.add_parser("similarity", help="Near-duplicate lookup latency by index size")
+    similarity_parser.add_argument(
+        "-n", "--entries",
+        default="1000,10000,100000",
+        help="Comma-separated index sizes"
+    )
+    similarity_parser.add_argument(
+        "-t", "--threshold",
+        type=float,
+        default=0.85,
+        help="Similarity threshold"
+    )
+    
+    # Chunked transformation of long dictations
+    chunking_parser = subparsers.add_parser("chunking", help="Long dictations in one request versus concurrent chunks")
+    chunking_parser.add_argument(
+        "-w", "--words",
+        default="1000,4000,16000",
+        help="Comma-separated dictation lengths in words"
+    )
+    chunking_parser.add_argument(
+        "--chunk-tokens",
+        type=int,
+        default=500,
+        help="Maximum tokens per chunk"
+    )
+    chunking_parser.add_argument(
+        "--overlap-tokens",
+        type=int,
+        default=50,
+        help="Tokens repeated between consecutive chunks"
+    )
+    chunking_parser.add_argument(
+        "-c", "--concurrency",
+        type=int,
+        default=16,
+        help="Number of chunks in flight"
+    )
+    chunking_parser.add_argument(
+        "--latency",
+        type=float,
+        default=0.05,
+        help="Simulated model latency per request in seconds"
+    )
+    chunking_parser.add_argument(
+        "--word-latency",
+        type=float,
+        default=0.0005,
+        help="Additional simulated latency per word in seconds"
+    )
+    
+    return parser
+
+
+def main():
+    """Main entry point for the benchmarks."""
+    parser = setup_argparse()
+    args = parser.parse_args()
+    
+    if not args.benchmark:
+        parser.print_help()
+        return
+        
+    if args.benchmark == "convert":
+        job_counts = [int(j) for j in args.jobs.split(',')] if args.jobs else default_job_counts()
+        benchmark_convert(args.files, job_counts)
+    
+    elif args.benchmark == "search":
+        benchmark_search(args.prompts)
+    
+    elif args.benchmark == "library":
+        benchmark_library([int(n) for n in args.prompts.split(',')])
+    
+    elif args.benchmark == "memory":
+        benchmark_memory(args.prompts)
+    
+    elif args.benchmark == "shared":
+        benchmark_shared(args.prompts, [int(w) for w in args.workers.split(',')])
+    
+    elif args.benchmark == "http":
+        concurrency_levels = [int(c) for c in args.concurrency.split(',')]
+        benchmark_http(args.url, concurrency_levels, args.requests, args.prompts)
+    
+    elif args.benchmark == "snapshots":
+        benchmark_snapshots(args.threads, args.duration, args.prompts)
+    
+    elif args.benchmark == "transform":
+        concurrency_levels = [int(c) for c in args.concurrency.split(',')]
+        benchmark_transform(args.transcripts, concurrency_levels, args.latency)
+    
+    elif args.benchmark == "cache":
+        benchmark_cache(args.entries, args.workers)
+    
+    elif args.benchmark == "similarity":
+        benchmark_similarity([int(n) for n in args.entries.split(',')], args.threshold)
+    
+    elif args.benchmark == "chunking":
+        benchmark_chunking([int(w) for w in args.words.split(',')], args.chunk_tokens, args.overlap_tokens,
+                           args.concurrency, args.latency, args.word_latency)
+
+
+if __name__ == "__main__":
+    main()
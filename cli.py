@@ -3,9 +3,95 @@
 Command-line interface for the Text Transformation Prompt Combiner.
 """
 import os
+import sys
+from prompt_daemon import FORWARDED_COMMANDS, SOCKET_ENV, forward_command, get_socket_path, serve
+
+# Hand the command to a running daemon before paying for the imports below
+if __name__ == "__main__":
+    forwarded_exit_code = forward_command(sys.argv[1:])
+    if forwarded_exit_code is not None:
+        sys.exit(forwarded_exit_code)
+
+import csv
+import json
+import time
 import argparse
+from collections import deque
+from itertools import islice
+from concurrent.futures import ProcessPoolExecutor
 from prompt_converter import convert_directory_to_json
-from prompt_combiner import PromptCombiner
+from prompt_combiner import PromptCombiner, TokenBudgetExceeded
+from prompt_shared import SHARED_ENV
+
+
+def add_transform_arguments(parser):
+    """Add the backend and executor options shared by commands that transform text."""
+    parser.add_argument(
+        "--backend", 
+        choices=["openai", "mock"],
+        help="Transformation backend (default: $PROMPT_COMBINER_BACKEND, or openai)"
+    )
+    parser.add_argument(
+        "--model", 
+        help="Model name (default: $PROMPT_COMBINER_MODEL, or gpt-4o-mini)"
+    )
+    parser.add_argument(
+        "--base-url", 
+        help="Base URL of an OpenAI-compatible API (default: $OPENAI_BASE_URL, or the OpenAI API)"
+    )
+    parser.add_argument(
+        "-c", "--concurrency", 
+        type=int,
+        default=8,
+        help="Maximum number of requests in flight"
+    )
+    parser.add_argument(
+        "--retries", 
+        type=int,
+        default=3,
+        help="Retries for rate-limited, failed or dropped requests"
+    )
+    parser.add_argument(
+        "--rate-limit", 
+        type=float,
+        help="Maximum number of requests started per second"
+    )
+    parser.add_argument(
+        "--cache-file", 
+        help="Response cache to reuse earlier outputs from (default: $PROMPT_COMBINER_CACHE, or a per-user cache)"
+    )
+    parser.add_argument(
+        "--no-cache", 
+        action="store_true",
+        help="Always send requests, without reading or storing cached responses"
+    )
+    parser.add_argument(
+        "--near-duplicates", 
+        choices=["reuse", "flag"],
+        help="Look up inputs similar to earlier ones with the same stack, and reuse their output or flag them"
+    )
+    parser.add_argument(
+        "--similarity-threshold", 
+        type=float,
+        default=0.85,
+        help="With --near-duplicates, the minimum estimated word-shingle similarity (0-1)"
+    )
+    parser.add_argument(
+        "--chunk-tokens", 
+        type=int,
+        help="Split texts longer than this many tokens into chunks transformed concurrently"
+    )
+    parser.add_argument(
+        "--chunk-overlap", 
+        type=int,
+        default=200,
+        help="With --chunk-tokens, tokens of trailing sentences repeated at the start of the next chunk"
+    )
+    parser.add_argument(
+        "--merge", 
+        action="store_true",
+        help="With --chunk-tokens, merge the joined chunk outputs with a final request if they fit in four chunks"
+    )
 
 
 def setup_argparse():
@@ -26,8 +112,34 @@ def setup_argparse():
     )
     convert_parser.add_argument(
         "-o", "--output", 
-        default="system_prompts.json",
-        help="Output JSON file path"
+        help="Output file path (default: system_prompts.json, or system_prompts.bin with --format bin)"
+    )
+    convert_parser.add_argument(
+        "--format", 
+        choices=["json", "bin"],
+        default="json",
+        help="Output format; 'bin' writes a compiled library that loads without parsing"
+    )
+    convert_parser.add_argument(
+        "-i", "--incremental", 
+        action="store_true",
+        help="Only reparse files that changed since the last incremental conversion"
+    )
+    convert_parser.add_argument(
+        "--jobs", 
+        type=int,
+        default=1,
+        help="Number of worker processes to parse files with (0 = one per CPU)"
+    )
+    convert_parser.add_argument(
+        "--minify", 
+        action="store_true",
+        help="Also store a compact content_min variant of each prompt"
+    )
+    convert_parser.add_argument(
+        "--strip-emphasis", 
+        action="store_true",
+        help="With --minify, remove bold and italic markers from content_min"
     )
     
     # List command
@@ -45,6 +157,30 @@ def setup_argparse():
         "-s", "--subcategory", 
         help="Filter by subcategory"
     )
+    list_parser.add_argument(
+        "--tokenizer", 
+        choices=["heuristic", "tiktoken", "auto"],
+        default="heuristic",
+        help="Token estimator (tiktoken must be installed for exact counts)"
+    )
+    
+    # Search command
+    search_parser = subparsers.add_parser("search", help="Search prompts by text")
+    search_parser.add_argument(
+        "query",
+        help="Words to search for in prompt titles, content and categories"
+    )
+    search_parser.add_argument(
+        "-j", "--json-file", 
+        default="system_prompts.json",
+        help="JSON file containing prompts"
+    )
+    search_parser.add_argument(
+        "-n", "--limit", 
+        type=int,
+        default=10,
+        help="Maximum number of results"
+    )
     
     # Combine command
     combine_parser = subparsers.add_parser("combine", help="Combine prompts")
@@ -67,6 +203,60 @@ def setup_argparse():
         "-t", "--title", 
         help="Custom title for the combined prompt"
     )
+    combine_parser.add_argument(
+        "--max-tokens", 
+        type=int,
+        help="Reject the stack if the combined prompt would exceed this many tokens"
+    )
+    combine_parser.add_argument(
+        "--trim", 
+        action="store_true",
+        help="With --max-tokens, drop additional prompts from the end to fit the budget"
+    )
+    combine_parser.add_argument(
+        "--dedupe", 
+        action="store_true",
+        help="Remove sentences, paragraphs and sections repeated across the selected prompts"
+    )
+    combine_parser.add_argument(
+        "--minified", 
+        action="store_true",
+        help="Combine the minified variant of each prompt"
+    )
+    combine_parser.add_argument(
+        "--tokenizer", 
+        choices=["heuristic", "tiktoken", "auto"],
+        default="heuristic",
+        help="Token estimator (tiktoken must be installed for exact counts)"
+    )
+    
+    # Batch combine command
+    batch_parser = subparsers.add_parser("combine-batch", help="Combine many prompt selections in one run")
+    batch_parser.add_argument(
+        "-j", "--json-file", 
+        default="system_prompts.json",
+        help="JSON file containing prompts"
+    )
+    batch_parser.add_argument(
+        "-i", "--input", 
+        default="-",
+        help="JSONL or CSV file of jobs with prompts, title and output fields ('-' for stdin)"
+    )
+    batch_parser.add_argument(
+        "-f", "--format", 
+        choices=["jsonl", "csv"],
+        help="Input format (default: from the file extension, JSONL for stdin)"
+    )
+    batch_parser.add_argument(
+        "-d", "--output-dir", 
+        help="Directory to write combined prompts to (default: JSONL on stdout)"
+    )
+    batch_parser.add_argument(
+        "-w", "--workers", 
+        type=int,
+        default=1,
+        help="Number of worker processes (0 = one per CPU)"
+    )
     
     # Interactive mode
     interactive_parser = subparsers.add_parser("interactive", help="Interactive prompt selection")
@@ -76,9 +266,652 @@ def setup_argparse():
         help="JSON file containing prompts"
     )
     
+    # Daemon command
+    serve_parser = subparsers.add_parser(
+        "serve",
+        help="Keep libraries loaded in a background daemon that list, search and combine forward to"
+    )
+    serve_parser.add_argument(
+        "--socket", 
+        default=get_socket_path(),
+        help="Unix socket to listen on. Clients use $PROMPT_COMBINER_SOCKET, or this default when it is unset."
+    )
+    serve_parser.add_argument(
+        "-j", "--json-file", 
+        default="system_prompts.json",
+        help="Library to load before accepting commands"
+    )
+    
+    # HTTP service command
+    http_parser = subparsers.add_parser("serve-http", help="Serve list, search and combine endpoints over HTTP")
+    http_parser.add_argument(
+        "-j", "--json-file", 
+        default="system_prompts.json",
+        help="JSON file or compiled library containing prompts"
+    )
+    http_parser.add_argument(
+        "--host", 
+        default="127.0.0.1",
+        help="Interface to listen on"
+    )
+    http_parser.add_argument(
+        "--port", 
+        type=int,
+        default=8000,
+        help="Port to listen on (0 = any free port)"
+    )
+    http_parser.add_argument(
+        "--shared", 
+        default=os.environ.get(SHARED_ENV),
+        help=f"Attach to a library published by 'publish' instead of loading the file (default: ${SHARED_ENV})"
+    )
+    
+    # Shared memory publisher command
+    publish_parser = subparsers.add_parser(
+        "publish",
+        help="Publish a library in shared memory for app.py and serve-http workers to attach to"
+    )
+    publish_parser.add_argument(
+        "-j", "--json-file", 
+        default="system_prompts.json",
+        help="JSON file or compiled library to publish"
+    )
+    publish_parser.add_argument(
+        "--name", 
+        help="Shared memory name (default: derived from the library path)"
+    )
+    publish_parser.add_argument(
+        "-d", "--directory", 
+        help="Also reconvert this Markdown directory into the library when it changes"
+    )
+    publish_parser.add_argument(
+        "--poll", 
+        action="store_true",
+        help="Poll for changes instead of using inotify"
+    )
+    
+    # Transform command
+    transform_parser = subparsers.add_parser("transform", help="Transform dictated text with a prompt stack")
+    transform_parser.add_argument(
+        "inputs", 
+        nargs="*",
+        help="Text files, directories, glob patterns, tar archives or JSONL files of transcripts (default: stdin)"
+    )
+    transform_parser.add_argument(
+        "-j", "--json-file", 
+        default="system_prompts.json",
+        help="JSON file containing prompts"
+    )
+    stack_group = transform_parser.add_mutually_exclusive_group(required=True)
+    stack_group.add_argument(
+        "-p", "--prompts", 
+        help="Comma-separated list of prompt IDs to combine into the stack"
+    )
+    stack_group.add_argument(
+        "-s", "--stack", 
+        help="File containing a saved combined prompt"
+    )
+    transform_parser.add_argument(
+        "--dedupe", 
+        action="store_true",
+        help="With --prompts, remove text repeated across the selected prompts"
+    )
+    transform_parser.add_argument(
+        "-f", "--format", 
+        choices=["text", "jsonl"],
+        default="text",
+        help="Read stdin as one text, or as JSONL records with 'id' and 'text' (.jsonl files are always JSONL)"
+    )
+    transform_parser.add_argument(
+        "--extensions", 
+        default=".txt,.md",
+        help="Comma-separated extensions of the files read from directories and tar archives (empty for all)"
+    )
+    output_group = transform_parser.add_mutually_exclusive_group()
+    output_group.add_argument(
+        "-o", "--output-dir", 
+        help="Directory to write transformed files to (default: stdout, as JSONL unless there is a single text)"
+    )
+    output_group.add_argument(
+        "--output-file", 
+        help="JSONL file to write results to"
+    )
+    transform_parser.add_argument(
+        "--journal", 
+        help="Progress journal for resuming an interrupted run (default: inside --output-dir, or next to --output-file)"
+    )
+    transform_parser.add_argument(
+        "--restart", 
+        action="store_true",
+        help="Ignore the journal of an interrupted run and start over"
+    )
+    transform_parser.add_argument(
+        "--window", 
+        type=int,
+        help="Maximum number of transcripts read ahead of their results (default: 4 x --concurrency)"
+    )
+    transform_parser.add_argument(
+        "--progress", 
+        type=float,
+        default=10.0,
+        help="Seconds between throughput reports on stderr (0 = final summary only)"
+    )
+    add_transform_arguments(transform_parser)
+    
+    # Response cache command
+    cache_parser = subparsers.add_parser("cache", help="Show statistics for or prune the transformation response cache")
+    cache_parser.add_argument(
+        "action", 
+        choices=["stats", "prune", "clear"],
+        help="'stats' shows usage, 'prune' removes expired and excess responses, 'clear' removes all"
+    )
+    cache_parser.add_argument(
+        "--cache-file", 
+        help="Response cache file (default: $PROMPT_COMBINER_CACHE, or a per-user cache)"
+    )
+    cache_parser.add_argument(
+        "--ttl-days", 
+        type=float,
+        help="With prune, remove responses older than this many days (default: 30)"
+    )
+    cache_parser.add_argument(
+        "--max-mb", 
+        type=float,
+        help="With prune, evict least recently used responses above this size (default: 256)"
+    )
+    
+    # Watch command
+    watch_parser = subparsers.add_parser("watch", help="Reconvert the Markdown prompts whenever they change")
+    watch_parser.add_argument(
+        "-d", "--directory", 
+        default="system-prompts",
+        help="Directory containing Markdown system prompts"
+    )
+    watch_parser.add_argument(
+        "-o", "--output", 
+        default="system_prompts.json",
+        help="Library to keep up to date (a .bin path writes a compiled library)"
+    )
+    watch_parser.add_argument(
+        "--jobs", 
+        type=int,
+        default=1,
+        help="Number of worker processes for parsing (0 = one per CPU)"
+    )
+    watch_parser.add_argument(
+        "--minify", 
+        action="store_true",
+        help="Also store a compact content_min variant of each prompt"
+    )
+    watch_parser.add_argument(
+        "--strip-emphasis", 
+        action="store_true",
+        help="With --minify, remove bold and italic markers from content_min"
+    )
+    watch_parser.add_argument(
+        "--poll", 
+        action="store_true",
+        help="Poll for changes instead of using inotify"
+    )
+    watch_parser.add_argument(
+        "--interval", 
+        type=float,
+        default=0.5,
+        help="Seconds between scans when polling"
+    )
+    
     return parser
 
 
+_batch_combiner = None
+
+# Combiners kept warm by the daemon, keyed by library path and options
+_daemon_combiners = None
+
+
+def get_combiner(json_file, token_estimator="heuristic", minified=False):
+    """
+    Get a combiner for a library file.
+    
+    Inside the daemon, combiners are kept between commands and reloaded when
+    the library file's modification time or size changes.
+    """
+    if _daemon_combiners is None:
+        return PromptCombiner(json_file=json_file, token_estimator=token_estimator, minified=minified)
+    
+    stat = os.stat(json_file)
+    signature = (stat.st_mtime_ns, stat.st_size)
+    key = (os.path.abspath(json_file), token_estimator, minified)
+    
+    entry = _daemon_combiners.get(key)
+    if entry is None:
+        combiner = PromptCombiner(json_file=json_file, token_estimator=token_estimator, minified=minified)
+        entry = _daemon_combiners[key] = (signature, combiner)
+    elif entry[0] != signature:
+        entry[1].reload()
+        entry = _daemon_combiners[key] = (signature, entry[1])
+    return entry[1]
+
+
+def run_forwarded_command(argv):
+    """Run a command forwarded to the daemon and return its exit code."""
+    if not argv or argv[0] not in FORWARDED_COMMANDS:
+        print(f"Error: The daemon only runs these commands: {', '.join(FORWARDED_COMMANDS)}.", file=sys.stderr)
+        return 2
+    
+    main(argv)
+    return 0
+
+
+def serve_daemon(socket_path, json_file):
+    """Run the daemon, with the default library loaded up front."""
+    global _daemon_combiners
+    _daemon_combiners = {}
+    
+    if os.path.exists(json_file):
+        get_combiner(json_file)
+    
+    print(f"Serving prompt commands on '{socket_path}'. Press Ctrl+C to stop.")
+    if socket_path != get_socket_path():
+        print(f"Set {SOCKET_ENV}={socket_path} for commands to use it.")
+    sys.stdout.flush()
+    
+    try:
+        serve(socket_path, run_forwarded_command)
+    except RuntimeError as e:
+        print(f"Error: {e}")
+        sys.exit(1)
+
+
+def publish_library(json_file, name=None, directory=None, polling=False):
+    """Publish a library in shared memory and republish it whenever it changes."""
+    import signal
+    from prompt_shared import SharedLibraryPublisher
+    from prompt_watcher import LibraryWatcher
+    
+    try:
+        publisher = SharedLibraryPublisher(json_file, name)
+    except RuntimeError as e:
+        print(f"Error: {e}")
+        sys.exit(1)
+    
+    def republish():
+        try:
+            print(f"Published generation {publisher.publish()}")
+        except Exception as e:
+            print(f"Error publishing '{json_file}': {e}")
+        sys.stdout.flush()
+    
+    watcher = LibraryWatcher(json_file, directory, polling=polling)
+    watcher.add_listener(republish)
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    
+    try:
+        generation = publisher.publish()
+        print(f"Published '{json_file}' as '{publisher.name}' (generation {generation}). Press Ctrl+C to stop.")
+        print(f"Set {SHARED_ENV}={publisher.name} for app.py and serve-http workers to attach to it.")
+        sys.stdout.flush()
+        watcher.run()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        watcher.stop()
+        publisher.close()
+
+
+def create_transform_executor(args):
+    """
+    Create a transformation executor from the options of add_transform_arguments().
+    
+    Raises:
+        ValueError: If the backend is not configured
+    """
+    from prompt_cache import ResponseCache
+    from prompt_chunking import TextChunker
+    from prompt_similarity import SimilarityIndex
+    from prompt_transform import TransformExecutor, get_backend
+    
+    if args.near_duplicates and args.no_cache:
+        raise ValueError("--near-duplicates needs the response cache.")
+    if args.merge and not args.chunk_tokens:
+        raise ValueError("--merge needs --chunk-tokens.")
+    
+    chunker = TextChunker(args.chunk_tokens, args.chunk_overlap, args.merge) if args.chunk_tokens else None
+    backend = get_backend(args.backend, model=args.model, base_url=args.base_url)
+    cache = None if args.no_cache else ResponseCache(args.cache_file)
+    similarity = SimilarityIndex(cache, args.similarity_threshold) if args.near_duplicates else None
+    return TransformExecutor(
+        backend, concurrency=args.concurrency, retries=args.retries, rate_limit=args.rate_limit, cache=cache,
+        similarity=similarity, similarity_mode=args.near_duplicates or "reuse", chunker=chunker
+    )
+
+
+def manage_cache(action, cache_file=None, ttl_days=None, max_mb=None):
+    """Print statistics for, prune or clear the response cache."""
+    from prompt_cache import ResponseCache
+    from prompt_similarity import SimilarityIndex
+    
+    cache = ResponseCache(cache_file)
+    index = SimilarityIndex(cache)
+    try:
+        if action == "prune":
+            ttl = ttl_days * 24 * 3600 if ttl_days is not None else None
+            max_bytes = int(max_mb * 1024 * 1024) if max_mb is not None else None
+            removed = cache.prune(ttl, max_bytes)
+            print(f"Removed {removed['expired']} expired and evicted {removed['evicted']} least recently used responses.")
+        elif action == "clear":
+            cache.clear()
+            print(f"Cleared '{cache.path}'.")
+        
+        stats = cache.stats()
+        print(f"Cache: {stats['path']}")
+        print(f"Entries: {stats['entries']} ({stats['bytes'] / (1024 * 1024):.1f} MB)")
+        if stats['entries']:
+            print(f"Oldest: {time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(stats['oldest']))}")
+            print(f"Newest: {time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(stats['newest']))}")
+        print(f"Hits: {stats['hits']}, misses: {stats['misses']} (hit rate {stats['hit_rate']:.1%})")
+        print(f"Evictions: {stats['evictions']}, expirations: {stats['expirations']}")
+        print(f"Near-duplicate index: {index.count()} inputs")
+    finally:
+        cache.close()
+
+
+def transform_stream(system_prompt, inputs, executor, input_format="text", extensions=None,
+                     output_dir=None, output_file=None, journal_file=None, restart=False,
+                     window=None, progress_interval=10.0):
+    """
+    Stream transcripts through a prompt stack, writing results as they complete.
+    
+    Results are written to output_dir, to output_file as JSONL, or to
+    stdout: as plain text for a single text and as JSONL otherwise. Runs
+    writing to a directory or file keep a progress journal, so rerunning an
+    interrupted command resumes it. Throughput reports and a summary go to
+    stderr.
+    
+    Returns:
+        The number of failed transcripts
+    
+    Raises:
+        ValueError: If the journal does not match this run or the inputs changed
+    """
+    import asyncio
+    import hashlib
+    from prompt_stream import (
+        DEFAULT_EXTENSIONS, DirectoryWriter, JsonlWriter, ProgressJournal, TextWriter,
+        input_kind, iter_transcripts, stream_transform
+    )
+    
+    inputs = inputs or ["-"]
+    extensions = DEFAULT_EXTENSIONS if extensions is None else extensions
+    
+    if journal_file is None and output_dir:
+        journal_file = os.path.join(output_dir, ".transform-journal.json")
+    elif journal_file is None and output_file:
+        journal_file = f"{output_file}.journal"
+    
+    journal = None
+    if journal_file:
+        run = {
+            "stack": hashlib.sha256(system_prompt.encode('utf-8')).hexdigest(),
+            "inputs": [source if source == "-" else os.path.abspath(source) for source in inputs],
+            "format": input_format,
+            "extensions": list(extensions),
+            "output": os.path.abspath(output_dir or output_file) if output_dir or output_file else None
+        }
+        journal = ProgressJournal(journal_file, run)
+        if restart:
+            journal.remove()
+        elif journal.load():
+            print(
+                f"Resuming from '{journal_file}': {journal.completed} transcripts already done "
+                f"({journal.failed} failed).",
+                file=sys.stderr
+            )
+    resuming = journal is not None and journal.completed > 0
+    
+    # Set up the writer
+    if output_dir:
+        writer = DirectoryWriter(output_dir)
+    elif output_file:
+        writer = JsonlWriter(output_file, journal.output_bytes if resuming else None)
+    elif len(inputs) == 1 and input_kind(inputs[0], input_format) in ("stdin", "file"):
+        writer = TextWriter()
+    else:
+        writer = JsonlWriter()
+    
+    async def run():
+        try:
+            return await stream_transform(
+                executor, system_prompt, iter_transcripts(inputs, input_format, extensions), writer,
+                journal=journal, window=window, progress_interval=progress_interval
+            )
+        finally:
+            await executor.close()
+    
+    try:
+        summary = asyncio.run(run())
+    finally:
+        writer.close()
+    
+    # A complete run needs no journal, and a stale one would skip new inputs
+    if journal is not None:
+        journal.remove()
+    
+    elapsed = summary["seconds"]
+    rate = summary["completed"] / elapsed if elapsed > 0 else 0.0
+    throughput = summary["input_bytes"] / elapsed / 1024 if elapsed > 0 else 0.0
+    stats = executor.stats
+    print(
+        f"Transformed {summary['completed'] - summary['failed']} of {summary['completed']} texts "
+        f"in {elapsed:.2f}s ({rate:.1f} texts/s, {throughput:.1f} KB/s), {summary['failed']} failed, "
+        f"{summary['cached']} from cache, {stats['retries']} retries.",
+        file=sys.stderr
+    )
+    if summary["skipped"]:
+        print(f"Skipped {summary['skipped']} texts finished by the interrupted run.", file=sys.stderr)
+    if executor.similarity is not None:
+        print(
+            f"Near-duplicates: {stats['near_duplicates_reused']} reused, {stats['near_duplicates_flagged']} flagged, "
+            f"{stats['near_duplicates_evicted']} no longer cached.",
+            file=sys.stderr
+        )
+    if executor.chunker is not None:
+        print(
+            f"Chunking: {stats['chunked']} texts split into {stats['chunks']} chunks, {stats['merges']} merged.",
+            file=sys.stderr
+        )
+    
+    # Failures of the interrupted run count too
+    return journal.failed if journal is not None else summary["failed"]
+
+
+# Jobs sent to a worker process at once, and chunks read ahead per worker
+BATCH_CHUNK_SIZE = 64
+BATCH_CHUNKS_PER_WORKER = 4
+
+
+def _init_batch_worker(json_file):
+    """Load the prompt library once per batch worker process."""
+    global _batch_combiner
+    _batch_combiner = PromptCombiner(json_file=json_file)
+
+
+def _read_batch_jobs(input_path, input_format=None):
+    """
+    Read combine jobs from a JSONL or CSV file, or from stdin.
+    
+    Yields:
+        Tuples of (job number, job dictionary or error message)
+    """
+    if not input_format:
+        input_format = "csv" if input_path.lower().endswith(".csv") else "jsonl"
+    
+    stream = sys.stdin if input_path == "-" else open(input_path, 'r', encoding='utf-8', newline='')
+    try:
+        if input_format == "csv":
+            for number, row in enumerate(csv.DictReader(stream), 1):
+                yield number, row
+        else:
+            number = 0
+            for line in stream:
+                if not line.strip():
+                    continue
+                number += 1
+                try:
+                    yield number, json.loads(line)
+                except ValueError as e:
+                    yield number, f"Invalid JSON: {e}"
+    finally:
+        if stream is not sys.stdin:
+            stream.close()
+
+
+def _run_batch_job(job_item, output_dir=None):
+    """
+    Combine the prompts for a single batch job.
+    
+    Returns:
+        A result dictionary with the job number and either the combined
+        prompt (or the file it was written to) or an error message
+    """
+    number, job = job_item
+    result = {"job": number}
+    
+    if not isinstance(job, dict):
+        result["error"] = job if isinstance(job, str) else "Job must be an object"
+        return result
+    
+    prompt_ids = job.get("prompts")
+    if isinstance(prompt_ids, str):
+        prompt_ids = [p.strip() for p in prompt_ids.split(',') if p.strip()]
+    elif prompt_ids is not None and (not isinstance(prompt_ids, list)
+                                     or not all(isinstance(p, str) for p in prompt_ids)):
+        result["error"] = "Prompts must be a comma-separated string or a list of strings"
+        return result
+    if not prompt_ids:
+        result["error"] = "No prompts given"
+        return result
+    
+    for field in ("title", "output"):
+        if job.get(field) is not None and not isinstance(job[field], str):
+            result["error"] = f"{field.title()} must be a string"
+            return result
+    
+    unknown_ids = [p for p in prompt_ids if _batch_combiner.get_prompt_by_id(p) is None]
+    if unknown_ids:
+        result["error"] = f"Unknown prompt IDs: {', '.join(unknown_ids)}"
+        return result
+    
+    title = job.get("title") or None
+    if title:
+        result["title"] = title
+    
+    try:
+        if output_dir:
+            output_file = os.path.join(output_dir, job.get("output") or f"combined_prompt_{number}.md")
+            # Job files must not write outside the output directory
+            root = os.path.realpath(output_dir)
+            if os.path.isabs(job.get("output") or "") or os.path.commonpath(
+                    [root, os.path.realpath(output_file)]) != root:
+                result["error"] = f"Output '{job['output']}' is outside the output directory"
+                return result
+            parent = os.path.dirname(output_file)
+            if parent:
+                os.makedirs(parent, exist_ok=True)
+            _batch_combiner.save_combined_prompt(prompt_ids, output_file, title)
+            result["output"] = output_file
+        else:
+            if job.get("output"):
+                result["output"] = job["output"]
+            result["prompt"] = _batch_combiner.combine_prompts(prompt_ids, title)
+    except OSError as e:
+        result["error"] = str(e)
+    
+    return result
+
+
+def _run_batch_chunk(job_items, output_dir=None):
+    """Run a chunk of batch jobs in a worker process."""
+    return [_run_batch_job(job_item, output_dir) for job_item in job_items]
+
+
+def _map_batch_jobs(executor, jobs, output_dir, workers):
+    """
+    Run batch jobs in worker processes, reading only a few chunks ahead.
+    
+    At most BATCH_CHUNKS_PER_WORKER chunks of BATCH_CHUNK_SIZE jobs per
+    worker are read and in flight at once, so memory does not grow with the
+    size of the input.
+    
+    Yields:
+        Result dictionaries in job order
+    """
+    pending = deque()
+    window = workers * BATCH_CHUNKS_PER_WORKER
+    while True:
+        while len(pending) < window:
+            chunk = list(islice(jobs, BATCH_CHUNK_SIZE))
+            if not chunk:
+                break
+            pending.append(executor.submit(_run_batch_chunk, chunk, output_dir))
+        if not pending:
+            return
+        yield from pending.popleft().result()
+
+
+def combine_batch(json_file, input_path="-", input_format=None, output_dir=None, workers=1):
+    """
+    Combine many prompt selections while loading the library only once.
+    
+    Results are written to output_dir, or as JSONL on stdout. A summary of
+    throughput and failures goes to stderr.
+    
+    Returns:
+        The number of failed jobs
+    """
+    jobs = _read_batch_jobs(input_path, input_format)
+    if not workers:
+        workers = os.cpu_count() or 1
+    
+    start = time.perf_counter()
+    total = 0
+    failed = 0
+    
+    if workers == 1:
+        _init_batch_worker(json_file)
+        results = (_run_batch_job(job, output_dir) for job in jobs)
+        executor = None
+    else:
+        executor = ProcessPoolExecutor(
+            max_workers=workers,
+            initializer=_init_batch_worker,
+            initargs=(json_file,)
+        )
+        results = _map_batch_jobs(executor, jobs, output_dir, workers)
+    
+    try:
+        for result in results:
+            total += 1
+            if "error" in result:
+                failed += 1
+                print(f"Job {result['job']} failed: {result['error']}", file=sys.stderr)
+            if not output_dir:
+                sys.stdout.write(json.dumps(result) + "\n")
+    finally:
+        if executor:
+            executor.shutdown()
+    
+    elapsed = time.perf_counter() - start
+    rate = total / elapsed if elapsed > 0 else 0.0
+    print(
+        f"Combined {total - failed} of {total} prompt stacks in {elapsed:.2f}s "
+        f"({rate:.0f} stacks/s), {failed} failed.",
+        file=sys.stderr
+    )
+    
+    return failed
+
+
 def interactive_mode(json_file):
     """Run the interactive prompt selection mode."""
     if not os.path.exists(json_file):
@@ -199,10 +1032,15 @@ def interactive_mode(json_file):
         print("\n" + "=" * 50)
 
 
-def main():
-    """Main entry point for the CLI."""
+def main(argv=None):
+    """
+    Main entry point for the CLI.
+    
+    Args:
+        argv: Command-line arguments, by default those of the process
+    """
     parser = setup_argparse()
-    args = parser.parse_args()
+    args = parser.parse_args(argv)
     
     if not args.command:
         parser.print_help()
@@ -213,7 +1051,15 @@ def main():
             print(f"Error: Directory '{args.directory}' not found.")
             return
         
-        convert_directory_to_json(args.directory, args.output)
+        output = args.output or f"system_prompts.{args.format}"
+        convert_directory_to_json(
+            args.directory, output,
+            incremental=args.incremental,
+            jobs=args.jobs,
+            minify=args.minify,
+            strip_emphasis=args.strip_emphasis,
+            output_format=args.format
+        )
     
     elif args.command == "list":
         if not os.path.exists(args.json_file):
@@ -221,7 +1067,7 @@ def main():
             print("Run 'python cli.py convert' first to generate the JSON file.")
             return
         
-        combiner = PromptCombiner(json_file=args.json_file)
+        combiner = get_combiner(args.json_file, token_estimator=args.tokenizer)
         
         if args.category:
             if args.subcategory:
@@ -232,13 +1078,30 @@ def main():
                 print(f"Prompts in category '{args.category}':")
             
             for prompt in prompts:
-                print(f"- {prompt['title']} (ID: {prompt['id']})")
+                print(f"- {prompt['title']} (ID: {prompt['id']}, ~{combiner.get_prompt_tokens(prompt['id'])} tokens)")
         else:
             categories = combiner.get_categories()
             print("Available categories:")
             for category in categories:
                 print(f"- {category}")
     
+    elif args.command == "search":
+        if not os.path.exists(args.json_file):
+            print(f"Error: JSON file '{args.json_file}' not found.")
+            print("Run 'python cli.py convert' first to generate the JSON file.")
+            return
+        
+        combiner = get_combiner(args.json_file)
+        results = combiner.search(args.query, args.limit)
+        
+        if not results:
+            print(f"No prompts found for '{args.query}'.")
+            return
+        
+        print(f"Prompts matching '{args.query}':")
+        for prompt, score in results:
+            print(f"- {prompt['title']} (ID: {prompt['id']}, category: {prompt['category']}, score: {score:.2f})")
+    
     elif args.command == "combine":
         if not os.path.exists(args.json_file):
             print(f"Error: JSON file '{args.json_file}' not found.")
@@ -246,17 +1109,152 @@ def main():
             return
         
         prompt_ids = args.prompts.split(',')
-        combiner = PromptCombiner(json_file=args.json_file)
-        combiner.save_combined_prompt(
-            prompt_ids, 
-            args.output, 
-            args.title
-        )
+        combiner = get_combiner(args.json_file, token_estimator=args.tokenizer, minified=args.minified)
+        estimated_tokens = combiner.estimate_tokens(prompt_ids)
+        
+        try:
+            combiner.save_combined_prompt(
+                prompt_ids, 
+                args.output, 
+                args.title,
+                max_tokens=args.max_tokens,
+                trim=args.trim,
+                dedupe=args.dedupe
+            )
+        except TokenBudgetExceeded as e:
+            print(f"Error: {e}")
+            return
         
         print(f"Combined prompt saved to '{args.output}'.")
+        
+        if args.max_tokens is not None and args.trim:
+            trimmed_tokens = combiner.estimate_tokens(
+                combiner.trim_to_budget(prompt_ids, args.max_tokens)
+            )
+            if trimmed_tokens < estimated_tokens:
+                print(f"Trimmed from ~{estimated_tokens} to ~{trimmed_tokens} tokens to fit the budget of {args.max_tokens}.")
+                estimated_tokens = trimmed_tokens
+        
+        if args.dedupe:
+            report = combiner.dedupe_report(prompt_ids, args.max_tokens, args.trim)
+            print(
+                f"Deduplication removed {report['bytes_saved']} bytes (~{report['tokens_saved']} tokens): "
+                f"{report['blocks_removed']} sections, {report['paragraphs_removed']} paragraphs, "
+                f"{report['sentences_removed']} sentences."
+            )
+            estimated_tokens -= report['tokens_saved']
+        
+        print(f"Estimated size: ~{estimated_tokens} tokens ({combiner.token_estimator.name}).")
+    
+    elif args.command == "combine-batch":
+        if not os.path.exists(args.json_file):
+            print(f"Error: JSON file '{args.json_file}' not found.")
+            print("Run 'python cli.py convert' first to generate the JSON file.")
+            return
+        
+        if args.input != "-" and not os.path.exists(args.input):
+            print(f"Error: Input file '{args.input}' not found.")
+            return
+        
+        failed = combine_batch(args.json_file, args.input, args.format, args.output_dir, args.workers)
+        if failed:
+            sys.exit(1)
     
     elif args.command == "interactive":
         interactive_mode(args.json_file)
+    
+    elif args.command == "serve":
+        serve_daemon(args.socket, args.json_file)
+    
+    elif args.command == "serve-http":
+        if not args.shared and not os.path.exists(args.json_file):
+            print(f"Error: JSON file '{args.json_file}' not found.")
+            print("Run 'python cli.py convert' first to generate the JSON file.")
+            return
+        
+        # Imported here so other commands do not pay for asyncio
+        from prompt_server import run_server
+        run_server(args.json_file, args.host, args.port, args.shared)
+    
+    elif args.command == "publish":
+        if not os.path.exists(args.json_file):
+            print(f"Error: JSON file '{args.json_file}' not found.")
+            print("Run 'python cli.py convert' first to generate the JSON file.")
+            return
+        
+        publish_library(args.json_file, args.name, args.directory, args.poll)
+    
+    elif args.command == "transform":
+        if args.stack:
+            if not os.path.exists(args.stack):
+                print(f"Error: Stack file '{args.stack}' not found.")
+                return
+            with open(args.stack, 'r', encoding='utf-8') as f:
+                system_prompt = f.read()
+        else:
+            if not os.path.exists(args.json_file):
+                print(f"Error: JSON file '{args.json_file}' not found.")
+                print("Run 'python cli.py convert' first to generate the JSON file.")
+                return
+            combiner = get_combiner(args.json_file)
+            system_prompt = combiner.combine_prompts(args.prompts.split(','), dedupe=args.dedupe)
+        
+        from prompt_stream import input_kind
+        missing = [
+            path for path in args.inputs
+            if input_kind(path, args.format) != "glob" and path != "-" and not os.path.exists(path)
+        ]
+        if missing:
+            print(f"Error: Input '{missing[0]}' not found.")
+            return
+        
+        try:
+            executor = create_transform_executor(args)
+        except ValueError as e:
+            print(f"Error: {e}")
+            return
+        
+        extensions = tuple(extension.strip() for extension in args.extensions.split(',') if extension.strip())
+        try:
+            failed = transform_stream(
+                system_prompt, args.inputs, executor, args.format, extensions, args.output_dir,
+                args.output_file, args.journal, args.restart, args.window, args.progress
+            )
+        except ValueError as e:
+            print(f"Error: {e}")
+            print("Pass --restart to transform every input again.")
+            sys.exit(1)
+        except OSError as e:
+            print(f"Error: {e}")
+            sys.exit(1)
+        except KeyboardInterrupt:
+            print("Interrupted. Run the same command again to resume.", file=sys.stderr)
+            sys.exit(130)
+        if failed:
+            sys.exit(1)
+    
+    elif args.command == "cache":
+        manage_cache(args.action, args.cache_file, args.ttl_days, args.max_mb)
+    
+    elif args.command == "watch":
+        if not os.path.exists(args.directory):
+            print(f"Error: Directory '{args.directory}' not found.")
+            return
+        
+        from prompt_watcher import LibraryWatcher
+        watcher = LibraryWatcher(
+            args.output, args.directory, minify=args.minify, strip_emphasis=args.strip_emphasis,
+            jobs=args.jobs, poll_interval=args.interval, polling=args.poll
+        )
+        print(f"Watching '{args.directory}' and keeping '{args.output}' up to date. Press Ctrl+C to stop.")
+        sys.stdout.flush()
+        
+        try:
+            watcher.run()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            watcher.stop()
 
 
 if __name__ == "__main__":
@@ -6,6 +6,7 @@ import os
 import PySimpleGUI as sg
 from prompt_converter import convert_directory_to_json
 from prompt_combiner import PromptCombiner
+from prompt_watcher import LibraryWatcher
 
 
 def create_main_window():
@@ -76,6 +77,21 @@ def create_convert_window():
     return sg.Window('Convert Prompts', layout, modal=True, finalize=True)
 
 
+def start_library_watcher(json_file, combiner, window, source_directory='system-prompts'):
+    """
+    Keep a combiner current with its library file and the Markdown prompts.
+    
+    The watcher runs in a background thread, so it reports reloads to the
+    event loop instead of touching the window itself.
+    """
+    if not os.path.isdir(source_directory):
+        source_directory = None
+    watcher = LibraryWatcher(json_file, source_directory)
+    watcher.add_combiner(combiner)
+    watcher.add_listener(lambda: window.write_event_value('-LIBRARY-RELOADED-', None))
+    return watcher.start()
+
+
 def main():
     """Main entry point for the GUI application."""
     # Check if JSON file exists, if not, prompt to convert
@@ -121,6 +137,7 @@ def main():
     # Create the main window
     window = create_main_window()
     window['-CATEGORIES-'].update(values=categories)
+    watcher = start_library_watcher(json_file, combiner, window)
     
     # Store selected prompts
     selected_prompts = []
@@ -151,15 +168,23 @@ def main():
                         sg.popup_ok(f"Successfully converted prompts to '{json_path}'.")
                         json_file = json_path
                         # Reload prompts
+                        watcher.stop()
                         combiner = PromptCombiner(json_file=json_file)
                         categories = combiner.get_categories()
                         window['-CATEGORIES-'].update(values=categories)
+                        watcher = start_library_watcher(json_file, combiner, window, dir_path)
                         break
                     except Exception as e:
                         sg.popup_error(f"Error converting prompts: {e}")
             
             convert_window.close()
         
+        elif event == '-LIBRARY-RELOADED-':
+            # The combiner already holds the new library; refresh the lists
+            categories = combiner.get_categories()
+            window['-CATEGORIES-'].update(values=categories)
+            window['-PROMPTS-'].update(values=[])
+        
         elif event == 'About':
             sg.popup_ok(
                 'Text Transformation Prompt Combiner\n\n'
@@ -259,6 +284,7 @@ def main():
             except Exception as e:
                 sg.popup_error(f"Error generating preview: {e}")
     
+    watcher.stop()
     window.close()
 
 
@@ -0,0 +1,327 @@
+#!/usr/bin/env python3
+"""
+Persistent cache of transformation responses.
+
+Responses are stored in SQLite, addressed by the hash of the prompt stack
+together with the backend parameters, and by the hash of the normalized
+input text. Any number of processes can share one cache file: the database
+runs in WAL mode, so lookups never wait for writers, and writers wait for
+each other for up to a few seconds.
+
+Lookups are plain indexed reads. Hit and miss counters and access times are
+batched in memory and written together with the next response or flush,
+so a cache hit costs microseconds rather than a disk write.
+"""
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+import unicodedata
+from functools import lru_cache
+from contextlib import contextmanager
+
+
+CACHE_ENV = "PROMPT_COMBINER_CACHE"
+
+# Responses older than this are misses and removed by prune()
+DEFAULT_TTL = 30 * 24 * 3600
+
+# Least recently used responses are evicted above this total size
+DEFAULT_MAX_BYTES = 256 * 1024 * 1024
+
+# Pending access times and counters are written after this many lookups or seconds
+FLUSH_OPERATIONS = 256
+FLUSH_INTERVAL = 1.0
+
+# Access times are only rewritten when they are older than this many seconds
+ACCESS_RESOLUTION = 60.0
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS responses (
+    stack_hash TEXT NOT NULL,
+    input_hash TEXT NOT NULL,
+    output TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    created REAL NOT NULL,
+    accessed REAL NOT NULL,
+    PRIMARY KEY (stack_hash, input_hash)
+);
+CREATE INDEX IF NOT EXISTS responses_accessed ON responses (accessed);
+CREATE INDEX IF NOT EXISTS responses_created ON responses (created);
+CREATE TABLE IF NOT EXISTS counters (
+    name TEXT PRIMARY KEY,
+    value INTEGER NOT NULL
+);
+INSERT OR IGNORE INTO counters (name, value) VALUES
+    ('bytes', 0), ('hits', 0), ('misses', 0), ('evictions', 0), ('expirations', 0);
+CREATE TRIGGER IF NOT EXISTS responses_insert AFTER INSERT ON responses BEGIN
+    UPDATE counters SET value = value + NEW.size WHERE name = 'bytes';
+END;
+CREATE TRIGGER IF NOT EXISTS responses_update AFTER UPDATE OF size ON responses BEGIN
+    UPDATE counters SET value = value + NEW.size - OLD.size WHERE name = 'bytes';
+END;
+CREATE TRIGGER IF NOT EXISTS responses_delete AFTER DELETE ON responses BEGIN
+    UPDATE counters SET value = value - OLD.size WHERE name = 'bytes';
+END;
+"""
+
+
+def get_cache_path():
+    """Get the cache file from $PROMPT_COMBINER_CACHE, or a per-user default."""
+    path = os.environ.get(CACHE_ENV)
+    if path:
+        return path
+    cache_home = os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache')
+    return os.path.join(cache_home, 'prompt-combiner', 'responses.sqlite3')
+
+
+def normalize_text(text):
+    """
+    Normalize an input text so trivially different copies share a cache entry.
+    
+    Unicode is composed (NFC), line endings become \\n, runs of spaces and
+    tabs collapse to one space, and spaces at line ends and blank lines at
+    either end are dropped. Paragraph breaks are kept.
+    """
+    text = unicodedata.normalize('NFC', text).replace('\r\n', '\n').replace('\r', '\n')
+    return '\n'.join(' '.join(line.split()) for line in text.split('\n')).strip('\n')
+
+
+@lru_cache(maxsize=64)
+def _stack_hash(system_prompt, parameters):
+    """Hash a prompt stack with serialized backend parameters."""
+    digest = hashlib.sha256(parameters.encode('utf-8'))
+    digest.update(b'\0')
+    digest.update(system_prompt.encode('utf-8'))
+    return digest.hexdigest()
+
+
+def stack_hash(system_prompt, parameters):
+    """
+    Hash a prompt stack together with the backend parameters that shape its output.
+    
+    Args:
+        system_prompt: The combined system prompt
+        parameters: Dictionary of backend settings, such as the model
+    """
+    return _stack_hash(system_prompt, json.dumps(parameters, sort_keys=True))
+
+
+def input_hash(text):
+    """Hash the normalized form of an input text."""
+    return hashlib.sha256(normalize_text(text).encode('utf-8')).hexdigest()
+
+
+class ResponseCache:
+    """SQLite-backed, content-addressed store of transformation outputs."""
+    
+    def __init__(self, path=None, ttl=DEFAULT_TTL, max_bytes=DEFAULT_MAX_BYTES):
+        """
+        Open or create a cache file.
+        
+        Args:
+            path: SQLite file, by default from get_cache_path()
+            ttl: Seconds a response stays valid, or None to keep it until evicted
+            max_bytes: Total size above which least recently used responses
+                are evicted, or None for no limit
+        """
+        self.path = path or get_cache_path()
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        
+        parent = os.path.dirname(os.path.abspath(self.path))
+        os.makedirs(parent, exist_ok=True)
+        
+        # Transactions are explicit; the connection is used by whichever
+        # thread runs the transformations, under the lock
+        self._connection = sqlite3.connect(self.path, timeout=10.0, isolation_level=None, check_same_thread=False)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute("PRAGMA synchronous=NORMAL")
+        self._connection.executescript(f"BEGIN IMMEDIATE;{SCHEMA}COMMIT;")
+        
+        self._lock = threading.RLock()
+        self._accessed = {}
+        self._counts = {"hits": 0, "misses": 0}
+        self._pending = 0
+        self._last_flush = time.monotonic()
+    
+    @contextmanager
+    def _transaction(self):
+        """Run a write transaction, waiting for writers in other processes."""
+        self._connection.execute("BEGIN IMMEDIATE")
+        try:
+            yield
+        except BaseException:
+            self._connection.execute("ROLLBACK")
+            raise
+        self._connection.execute("COMMIT")
+    
+    def keys(self, system_prompt, parameters, text):
+        """Get the (stack hash, input hash) pair addressing a response."""
+        return stack_hash(system_prompt, parameters), input_hash(text)
+    
+    def get(self, stack, text_hash):
+        """
+        Look up a response.
+        
+        Returns:
+            The cached output, or None if it is missing or expired
+        """
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT output, created, accessed FROM responses WHERE stack_hash = ? AND input_hash = ?",
+                (stack, text_hash)
+            ).fetchone()
+            
+            now = time.time()
+            if row is None or (self.ttl is not None and row[1] < now - self.ttl):
+                self._counts["misses"] += 1
+                output = None
+            else:
+                self._counts["hits"] += 1
+                if now - row[2] > ACCESS_RESOLUTION:
+                    self._accessed[(stack, text_hash)] = now
+                output = row[0]
+            
+            self._pending += 1
+            if self._pending >= FLUSH_OPERATIONS or time.monotonic() - self._last_flush >= FLUSH_INTERVAL:
+                self.flush()
+            return output
+    
+    def put(self, stack, text_hash, output):
+        """Store a response, evicting old ones if the cache grows past max_bytes."""
+        now = time.time()
+        size = len(output.encode('utf-8')) + len(stack) + len(text_hash)
+        with self._lock, self._transaction():
+            self._connection.execute(
+                "INSERT INTO responses (stack_hash, input_hash, output, size, created, accessed) "
+                "VALUES (?, ?, ?, ?, ?, ?) "
+                "ON CONFLICT (stack_hash, input_hash) DO UPDATE SET "
+                "output = excluded.output, size = excluded.size, "
+                "created = excluded.created, accessed = excluded.accessed",
+                (stack, text_hash, output, size, now, now)
+            )
+            self._write_pending()
+            if self.max_bytes is not None and self._counter("bytes") > self.max_bytes:
+                # Evict down to 90% so a full cache does not evict on every put
+                self._evict(int(self.max_bytes * 0.9))
+    
+    def _counter(self, name):
+        """Read a counter."""
+        return self._connection.execute("SELECT value FROM counters WHERE name = ?", (name,)).fetchone()[0]
+    
+    def _add_counter(self, name, amount):
+        """Add to a counter inside a transaction."""
+        if amount:
+            self._connection.execute("UPDATE counters SET value = value + ? WHERE name = ?", (amount, name))
+    
+    def _write_pending(self):
+        """Write batched access times and counters inside a transaction."""
+        if self._accessed:
+            self._connection.executemany(
+                "UPDATE responses SET accessed = ? WHERE stack_hash = ? AND input_hash = ? AND accessed < ?",
+                [(accessed, stack, text_hash, accessed) for (stack, text_hash), accessed in self._accessed.items()]
+            )
+        for name, amount in self._counts.items():
+            self._add_counter(name, amount)
+        
+        self._accessed = {}
+        self._counts = {"hits": 0, "misses": 0}
+        self._pending = 0
+        self._last_flush = time.monotonic()
+    
+    def _evict(self, target_bytes):
+        """Delete least recently used responses until the total size is at most target_bytes."""
+        evicted = 0
+        while self._counter("bytes") > target_bytes:
+            deleted = self._connection.execute(
+                "DELETE FROM responses WHERE rowid IN "
+                "(SELECT rowid FROM responses ORDER BY accessed LIMIT 256)"
+            ).rowcount
+            if not deleted:
+                break
+            evicted += deleted
+        self._add_counter("evictions", evicted)
+        return evicted
+    
+    def flush(self):
+        """Write batched access times and hit and miss counts."""
+        with self._lock:
+            if not self._pending and not self._accessed:
+                return
+            with self._transaction():
+                self._write_pending()
+    
+    def prune(self, ttl=None, max_bytes=None):
+        """
+        Remove expired responses, then evict least recently used ones over the size limit.
+        
+        Args:
+            ttl: Maximum age in seconds, by default the cache's ttl
+            max_bytes: Size limit, by default the cache's max_bytes
+        
+        Returns:
+            A dictionary with the numbers of expired and evicted responses
+        """
+        ttl = self.ttl if ttl is None else ttl
+        max_bytes = self.max_bytes if max_bytes is None else max_bytes
+        
+        with self._lock, self._transaction():
+            self._write_pending()
+            expired = 0
+            if ttl is not None:
+                expired = self._connection.execute(
+                    "DELETE FROM responses WHERE created < ?", (time.time() - ttl,)
+                ).rowcount
+                self._add_counter("expirations", expired)
+            evicted = self._evict(max_bytes) if max_bytes is not None else 0
+        
+        return {"expired": expired, "evicted": evicted}
+    
+    def clear(self):
+        """Remove every response and reset the counters."""
+        with self._lock, self._transaction():
+            self._connection.execute("DELETE FROM responses")
+            self._connection.execute("UPDATE counters SET value = 0")
+            self._accessed = {}
+            self._counts = {"hits": 0, "misses": 0}
+            self._pending = 0
+    
+    def stats(self):
+        """
+        Get statistics shared by every process using the cache file.
+        
+        Returns:
+            A dictionary with the number of entries, their total size, the
+            oldest and newest creation times, and hit, miss, eviction and
+            expiration counts with the hit rate
+        """
+        self.flush()
+        with self._lock:
+            counters = dict(self._connection.execute("SELECT name, value FROM counters"))
+            entries, oldest, newest = self._connection.execute(
+                "SELECT COUNT(*), MIN(created), MAX(created) FROM responses"
+            ).fetchone()
+        
+        lookups = counters['hits'] + counters['misses']
+        return {
+            "path": self.path,
+            "entries": entries,
+            "bytes": counters['bytes'],
+            "oldest": oldest,
+            "newest": newest,
+            "hits": counters['hits'],
+            "misses": counters['misses'],
+            "hit_rate": counters['hits'] / lookups if lookups else 0.0,
+            "evictions": counters['evictions'],
+            "expirations": counters['expirations']
+        }
+    
+    def close(self):
+        """Flush pending statistics and close the database."""
+        self.flush()
+        with self._lock:
+            self._connection.close()
+
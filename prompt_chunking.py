@@ -0,0 +1,217 @@
+#!/usr/bin/env python3
+"""
+Split long transcripts into token-bounded chunks and stitch their outputs.
+
+A transcript longer than the chunk size is cut on paragraph and sentence
+boundaries into windows of at most max_tokens, each repeating the last
+sentences of the previous one up to overlap_tokens, so the model sees every
+sentence with some of its context. Sentences longer than a chunk, as in
+unpunctuated dictation, are cut between words.
+
+The chunks are transformed independently and concurrently, so the time for
+an hour-long dictation depends on how many chunks run at once rather than on
+its length. The outputs are joined in order, dropping the sentences at the
+start of each output that repeat the end of the previous one, and can
+optionally be merged into one coherent text by a final request.
+"""
+import re
+import difflib
+from token_estimator import HeuristicTokenEstimator
+
+
+PARAGRAPH_BREAK = re.compile(r"\n\s*\n")
+SENTENCE_BREAK = re.compile(r"(?<=[.!?])\s+")
+WORD_PATTERN = re.compile(r"\w+")
+
+# Sentence and line breaks in outputs, which may be lists rather than prose
+OUTPUT_BREAK = re.compile(r"(?<=[.!?])\s+|\s*\n\s*")
+
+# Chunk size and overlap of the Streamlit app and 'cli.py transform --chunk-tokens'
+DEFAULT_MAX_TOKENS = 4000
+DEFAULT_OVERLAP_TOKENS = 200
+
+# Minimum similarity of the word sequences of an output sentence that repeats a previous one
+REPEAT_SIMILARITY = 0.75
+
+MERGE_INSTRUCTIONS = """## Merging Sections
+
+The text to transform was already transformed in consecutive sections, which
+are joined below. Merge them into one coherent result: remove content
+repeated where sections meet, make headings, lists and formatting
+consistent, and keep everything else. Do not add new content."""
+
+
+def _similar(sentence, other):
+    """Whether two sentences have mostly the same words in the same order."""
+    words, other_words = WORD_PATTERN.findall(sentence.lower()), WORD_PATTERN.findall(other.lower())
+    if not words or not other_words:
+        return False
+    return difflib.SequenceMatcher(None, words, other_words, autojunk=False).ratio() >= REPEAT_SIMILARITY
+
+
+def _drop_repeated_start(previous, output, expected, slack=2):
+    """
+    Remove the sentences at the start of an output that repeat the end of the previous output.
+    
+    Args:
+        previous: Output of the previous chunk
+        output: Output of the current chunk
+        expected: Number of sentences the two chunks shared
+        slack: How many more or fewer sentences the model may have made of them
+    """
+    limit = expected + slack
+    tail = [sentence for sentence in OUTPUT_BREAK.split(previous) if sentence.strip()][-limit:]
+    # End offsets of the leading sentences of the output
+    ends = []
+    start = 0
+    for match in OUTPUT_BREAK.finditer(output):
+        if output[start:match.start()].strip():
+            ends.append((output[start:match.start()], match.end()))
+        start = match.end()
+        if len(ends) == limit:
+            break
+    if len(ends) < limit and output[start:].strip():
+        ends.append((output[start:], len(output)))
+    
+    # Counts closest to the shared sentences first
+    counts = sorted(range(1, min(len(tail), len(ends)) + 1), key=lambda count: (abs(count - expected), -count))
+    for count in counts:
+        if all(_similar(tail[-count + i], ends[i][0]) for i in range(count)):
+            return output[ends[count - 1][1]:]
+    return output
+
+
+class TextChunker:
+    """Splits texts into overlapping token-bounded chunks and joins their outputs."""
+    
+    def __init__(self, max_tokens=DEFAULT_MAX_TOKENS, overlap_tokens=DEFAULT_OVERLAP_TOKENS, merge=False, merge_max_tokens=None,
+                 token_estimator=None):
+        """
+        Args:
+            max_tokens: Largest chunk; texts up to this size are not split
+            overlap_tokens: Most tokens of trailing sentences repeated at
+                the start of the next chunk
+            merge: Send the joined outputs through a final merge request
+            merge_max_tokens: Largest joined output that is merged, by
+                default four chunks; longer outputs are returned unmerged
+            token_estimator: Object with a count(text) method, by default
+                the heuristic estimator
+        
+        Raises:
+            ValueError: If the overlap does not leave room for new text
+        """
+        if max_tokens < 1:
+            raise ValueError("The chunk size must be at least one token.")
+        if not 0 <= overlap_tokens <= max_tokens // 2:
+            raise ValueError("The chunk overlap must be between 0 and half the chunk size.")
+        
+        self.max_tokens = max_tokens
+        self.overlap_tokens = overlap_tokens
+        self.merge = merge
+        self.merge_max_tokens = merge_max_tokens or max_tokens * 4
+        self.token_estimator = token_estimator or HeuristicTokenEstimator()
+    
+    def _units(self, text):
+        """
+        Cut a text into sentences no longer than a chunk.
+        
+        Returns:
+            A list of (sentence, tokens, starts a paragraph) tuples
+        """
+        count = self.token_estimator.count
+        units = []
+        for paragraph in PARAGRAPH_BREAK.split(text.strip()):
+            paragraph_start = True
+            for sentence in SENTENCE_BREAK.split(paragraph.strip()):
+                if not sentence:
+                    continue
+                tokens = count(sentence)
+                if tokens <= self.max_tokens:
+                    units.append((sentence, tokens, paragraph_start))
+                    paragraph_start = False
+                    continue
+                
+                # Cut an overlong sentence between words
+                piece, piece_tokens = [], 0
+                for word in sentence.split():
+                    word_tokens = count(word) + 1
+                    if piece and piece_tokens + word_tokens > self.max_tokens:
+                        units.append((" ".join(piece), piece_tokens, paragraph_start))
+                        paragraph_start = False
+                        piece, piece_tokens = [], 0
+                    piece.append(word)
+                    piece_tokens += word_tokens
+                if piece:
+                    units.append((" ".join(piece), piece_tokens, paragraph_start))
+                    paragraph_start = False
+        return units
+    
+    def split(self, text):
+        """
+        Split a text into chunks.
+        
+        Returns:
+            A list of chunk dictionaries with the chunk text, the number of
+            leading sentences repeated from the previous chunk ('overlap'),
+            and whether the first new sentence starts a paragraph. A text
+            that fits in one chunk is returned whole.
+        """
+        if self.token_estimator.count(text) <= self.max_tokens:
+            return [{"text": text, "overlap": 0, "paragraph_start": True}]
+        
+        units = self._units(text)
+        chunks = []
+        start = 0
+        overlap = 0
+        while start < len(units):
+            end = start
+            tokens = 0
+            while end < len(units) and (end == start or tokens + units[end][1] <= self.max_tokens):
+                tokens += units[end][1]
+                end += 1
+            
+            parts = []
+            for i in range(start, end):
+                if parts:
+                    parts.append("\n\n" if units[i][2] else " ")
+                parts.append(units[i][0])
+            chunks.append({
+                "text": "".join(parts),
+                "overlap": overlap,
+                "paragraph_start": units[start + overlap][2]
+            })
+            if end == len(units):
+                break
+            
+            # Back up over trailing sentences that fit in the overlap and
+            # leave room for the next new sentence
+            next_start = end
+            overlap_tokens = 0
+            while next_start - 1 > start:
+                tokens = overlap_tokens + units[next_start - 1][1]
+                if tokens > self.overlap_tokens or tokens + units[end][1] > self.max_tokens:
+                    break
+                next_start -= 1
+                overlap_tokens = tokens
+            overlap = end - next_start
+            start = next_start
+        return chunks
+    
+    def stitch(self, chunks, outputs):
+        """Join the outputs of chunks in order, without the repeated overlaps."""
+        text = outputs[0].strip()
+        for chunk, previous, output in zip(chunks[1:], outputs, outputs[1:]):
+            output = output.strip()
+            if chunk["overlap"]:
+                output = _drop_repeated_start(previous, output, chunk["overlap"]).strip()
+            if output:
+                text += ("\n\n" if chunk["paragraph_start"] else " ") + output
+        return text
+    
+    def merge_prompt(self, system_prompt):
+        """The system prompt of the final merge request."""
+        return f"{system_prompt.rstrip()}\n\n{MERGE_INSTRUCTIONS}"
+    
+    def should_merge(self, text):
+        """Whether joined outputs are merged by a final request."""
+        return self.merge and self.token_estimator.count(text) <= self.merge_max_tokens
@@ -2,150 +2,989 @@
 """
 Core module for combining system prompts.
 """
+import io
 import json
 import os
+import sys
+import threading
+import warnings
+import weakref
+from collections import OrderedDict
+from collections.abc import Mapping
+from prompt_search import SearchIndex, get_index_path
+from token_estimator import get_token_estimator
+from prompt_dedup import deduplicate_contents
+from prompt_converter import minify_content
+from prompt_library import PromptLibrary, compute_library_hash, load_prompts
+
+
+BASIC_CLEANUP_ID = "basic-cleanup"
+
+# Section headers for the additional prompts, keyed by lowercase category.
+# Categories without an entry get "## <Category> Instructions".
+SECTION_HEADERS = {
+    'tone': "## Tone Instructions",
+    'format': "## Formatting Instructions",
+    'length': "## Length Instructions",
+    'style': "## Style Instructions",
+    'ai-prompts': "## AI Instructions"
+}
+
+# Order and headers of the sections that group several prompts together
+GROUPED_SECTIONS = (
+    ('workflow', "## Workflow\n\n"),
+    ('basic', "## Basic Instructions\n\n")
+)
+
+
+# Marks a field the prompt was loaded without
+_MISSING = object()
+
+
+class Prompt(Mapping):
+    """
+    Compact, read-only prompt record with a dictionary interface.
+    
+    Prompts are stored in slots rather than a per-prompt dict, category and
+    subcategory strings are interned so prompts in the same category share
+    them, and fields the combiner does not use at runtime, such as
+    file_path, can be left out. Indexing, get(), 'in', iteration and dict()
+    behave as they do for the dictionaries loaded from the JSON file.
+    """
+    
+    __slots__ = ('id', 'title', 'content', 'category', 'subcategory', 'file_path', 'extra')
+    
+    FIELDS = ('id', 'title', 'content', 'category', 'subcategory', 'file_path')
+    
+    def __init__(self, id, title, content, category, subcategory=_MISSING, file_path=_MISSING, extra=None):
+        self.id = id
+        self.title = title
+        self.content = content
+        self.category = sys.intern(category) if isinstance(category, str) else category
+        self.subcategory = sys.intern(subcategory) if isinstance(subcategory, str) else subcategory
+        self.file_path = file_path
+        self.extra = extra or None
+    
+    @classmethod
+    def from_dict(cls, prompt, keep_file_path=False):
+        """
+        Create a record from a prompt dictionary.
+        
+        Args:
+            prompt: Prompt dictionary as written by the converter
+            keep_file_path: Keep the source file path, which is only needed
+                by tools that work on the Markdown files
+        """
+        extra = {key: value for key, value in prompt.items() if key not in cls.FIELDS}
+        return cls(
+            prompt['id'],
+            prompt.get('title', _MISSING),
+            prompt.get('content', _MISSING),
+            prompt['category'],
+            prompt.get('subcategory', _MISSING),
+            prompt.get('file_path', _MISSING) if keep_file_path else _MISSING,
+            extra
+        )
+    
+    def __getitem__(self, key):
+        if key in self.FIELDS:
+            value = getattr(self, key)
+            if value is not _MISSING:
+                return value
+        elif self.extra and key in self.extra:
+            return self.extra[key]
+        raise KeyError(key)
+    
+    def __contains__(self, key):
+        if key in self.FIELDS:
+            return getattr(self, key) is not _MISSING
+        return bool(self.extra) and key in self.extra
+    
+    def __iter__(self):
+        for key in self.FIELDS:
+            if getattr(self, key) is not _MISSING:
+                yield key
+        if self.extra:
+            yield from self.extra
+    
+    def __len__(self):
+        return sum(1 for _ in self)
+    
+    def __repr__(self):
+        return f"Prompt({dict(self)!r})"
+
+
+class TokenBudgetExceeded(ValueError):
+    """Raised when a combined prompt would exceed the requested token budget."""
+    
+    def __init__(self, estimated_tokens, max_tokens):
+        super().__init__(
+            f"Combined prompt needs about {estimated_tokens} tokens, "
+            f"which exceeds the budget of {max_tokens}."
+        )
+        self.estimated_tokens = estimated_tokens
+        self.max_tokens = max_tokens
+
+
+class CombinedPromptCache:
+    """Bounded, thread-safe LRU cache for combined prompt strings."""
+    
+    def __init__(self, max_entries=256, max_bytes=16 * 1024 * 1024):
+        """
+        Create an empty cache.
+        
+        Args:
+            max_entries: Maximum number of cached prompts (0 disables caching)
+            max_bytes: Maximum total UTF-8 size of the cached prompts
+        """
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+    
+    def get(self, key):
+        """Return the cached value for a key, or None on a miss."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+    
+    def put(self, key, value):
+        """Store a value, evicting the least recently used entries as needed."""
+        size = len(value.encode('utf-8'))
+        if self.max_entries <= 0 or size > self.max_bytes:
+            return
+        
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self.total_bytes -= previous[1]
+            
+            self._entries[key] = (value, size)
+            self.total_bytes += size
+            
+            while len(self._entries) > self.max_entries or self.total_bytes > self.max_bytes:
+                _, (_, evicted_size) = self._entries.popitem(last=False)
+                self.total_bytes -= evicted_size
+                self.evictions += 1
+    
+    def clear(self):
+        """Drop all cached entries. The counters are kept."""
+        with self._lock:
+            self._entries.clear()
+            self.total_bytes = 0
+    
+    def stats(self):
+        """Return the cache counters as a dictionary."""
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "bytes": self.total_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions
+            }
+
+
+class LibrarySnapshot:
+    """
+    One immutable version of a prompt library.
+    
+    A snapshot bundles the prompts, the lookup indexes and caches of values
+    derived from them: the version hash, rendered sections, per-prompt token
+    counts and the search index. Nothing in a snapshot changes after it is
+    built except those caches, and they only ever gain entries that any
+    thread would compute identically, so readers need no locks.
+    """
+    
+    def __init__(self, prompts, library_hash, render_section, version=0):
+        """
+        Build the indexes for a library version.
+        
+        Args:
+            prompts: Tuple of Prompt records, or a PromptLibrary
+            library_hash: Content hash of the library, or None to compute it
+                from the prompts on first use
+            render_section: Function rendering the section of one prompt
+            version: Number of the snapshot within its combiner
+        """
+        self.prompts = prompts
+        self._library_hash = library_hash
+        self.version = version
+        self.sections = {}
+        self.section_tokens = {}
+        self.search_index = None
+        self._render_section = render_section
+        self._search_lock = threading.Lock()
+        
+        # Compiled libraries carry their own tables
+        if isinstance(prompts, PromptLibrary):
+            self.by_id = prompts.by_id
+            self.by_category = prompts.by_category
+            self.by_subcategory = prompts.by_subcategory
+            self.duplicate_ids = list(prompts.duplicate_ids)
+        else:
+            self._build_indexes()
+        
+        self._build_category_lists()
+    
+    def _build_indexes(self):
+        """Build the id, category and subcategory lookup tables."""
+        self.by_id = {}
+        self.by_category = {}
+        self.by_subcategory = {}
+        self.duplicate_ids = []
+        
+        for prompt in self.prompts:
+            prompt_id = prompt['id']
+            category = prompt['category']
+            subcategory = prompt.get('subcategory')
+            
+            # Keep the first prompt for an ID, as the linear scan used to
+            if prompt_id in self.by_id:
+                if prompt_id not in self.duplicate_ids:
+                    self.duplicate_ids.append(prompt_id)
+            else:
+                self.by_id[prompt_id] = prompt
+            
+            self.by_category.setdefault(category, []).append(prompt)
+            self.by_subcategory.setdefault((category, subcategory), []).append(prompt)
+    
+    def _build_category_lists(self):
+        """Build the sorted category and subcategory name lists."""
+        subcategories = {}
+        for category, subcategory in self.by_subcategory:
+            if subcategory:
+                subcategories.setdefault(category, set()).add(subcategory)
+        
+        self.categories = sorted(self.by_category)
+        self.subcategories = {
+            category: sorted(names)
+            for category, names in subcategories.items()
+        }
+    
+    @property
+    def library_hash(self):
+        """Content hash of the library, computed once on first use."""
+        if self._library_hash is None:
+            self._library_hash = compute_library_hash(self.prompts)
+        return self._library_hash
+    
+    def get_section(self, prompt_id):
+        """
+        Get the pre-rendered section for a prompt ID, rendering it on first use.
+        
+        Returns:
+            The tuple from PromptCombiner._render_section, or None for
+            unknown IDs
+        """
+        section = self.sections.get(prompt_id)
+        if section is None:
+            prompt = self.by_id.get(prompt_id)
+            if prompt is None:
+                return None
+            section = self.sections[prompt_id] = self._render_section(prompt)
+        return section
+    
+    def get_search_index(self, index_file=None):
+        """
+        Get the search index, building it once on first use.
+        
+        Args:
+            index_file: Where to load the index from, and save it to after
+                building it
+        """
+        if self.search_index is not None:
+            return self.search_index
+        
+        # Only the first caller builds the index; the rest wait for it
+        with self._search_lock:
+            if self.search_index is None:
+                search_index = SearchIndex.load(index_file, self.library_hash) if index_file else None
+                
+                if search_index is None:
+                    search_index = SearchIndex.build(self.prompts, self.library_hash)
+                    if index_file:
+                        try:
+                            search_index.save(index_file)
+                        except OSError:
+                            pass
+                
+                self.search_index = search_index
+        
+        return self.search_index
 
 
 class PromptCombiner:
-    """Class to manage and combine system prompts."""
+    """
+    Class to manage and combine system prompts.
     
-    def __init__(self, prompts_json=None, json_file=None):
-        """Initialize with either a JSON array or a file path."""
-        self.prompts = []
+    The loaded library is held as an immutable LibrarySnapshot. Reloading or
+    editing the library builds a new snapshot and swaps it in with a single
+    assignment, and every read works from the one snapshot it started with,
+    so a combiner can be shared between threads without locking readers.
+    Readers pin a snapshot simply by referencing it: a retired snapshot is
+    freed by reference counting once the last reader using it finishes.
+    """
+    
+    def __init__(self, prompts_json=None, json_file=None, cache_size=256, cache_max_bytes=16 * 1024 * 1024,
+                 section_headers=None, token_estimator="heuristic", minified=False, keep_file_paths=False,
+                 shared_library=None):
+        """
+        Initialize with either a JSON array or a file path.
+        
+        Args:
+            prompts_json: List of prompt dictionaries
+            json_file: Path to a JSON file containing the prompts, or to a
+                compiled library written by 'convert --format bin'. Compiled
+                libraries are memory-mapped and prompts are decoded on use.
+            cache_size: Maximum number of combined prompts to cache
+            cache_max_bytes: Maximum total size of the cached prompts
+            section_headers: Extra or replacement section headers by category,
+                as a dictionary or the path of a JSON file containing one
+            token_estimator: Name of a token estimator ('heuristic',
+                'tiktoken' or 'auto') or an estimator instance
+            minified: Render prompts from their content_min variant, which
+                is computed on load for libraries converted without --minify
+            keep_file_paths: Keep each prompt's source file path, which is
+                left out by default for JSON and compiled libraries alike
+            shared_library: Name of a library published in shared memory by
+                'cli.py publish'. Prompts are read from the shared segment
+                without copying, and reloading follows new generations.
+        """
+        self.json_file = json_file
+        self.minified = minified
+        self.keep_file_paths = keep_file_paths
+        self.token_estimator = get_token_estimator(token_estimator)
+        self._header_tokens = {}
+        self.section_headers = load_section_headers(section_headers)
+        self.cache = CombinedPromptCache(cache_size, cache_max_bytes)
+        self._write_lock = threading.Lock()
+        self._retired = weakref.WeakSet()
+        self._snapshot = None
+        self._shared_reader = None
+        self._file_signature = None
         
+        # Publish the first snapshot only once the library is loaded
+        prompts = []
         if prompts_json:
-            self.prompts = prompts_json
+            prompts = prompts_json
+        elif shared_library:
+            from prompt_shared import SharedLibraryReader
+            self._shared_reader = SharedLibraryReader(shared_library, keep_file_paths)
+            prompts = self._shared_reader.attach()
         elif json_file and os.path.exists(json_file):
-            with open(json_file, 'r', encoding='utf-8') as f:
-                self.prompts = json.load(f)
+            self._file_signature = _file_signature(json_file)
+            prompts = load_prompts(json_file, keep_file_paths)
+        self.prompts = prompts
+    
+    @property
+    def snapshot(self):
+        """The current library snapshot."""
+        return self._snapshot
+    
+    @property
+    def prompts(self):
+        """The loaded prompts, as a tuple of Prompt records or a PromptLibrary."""
+        return self._snapshot.prompts
+    
+    @prompts.setter
+    def prompts(self, prompts):
+        """Replace the loaded prompts with a new snapshot."""
+        with self._write_lock:
+            self._publish(prompts)
+    
+    @property
+    def library_hash(self):
+        """Content hash of the current library version."""
+        return self._snapshot.library_hash
+    
+    @property
+    def duplicate_ids(self):
+        """Prompt IDs that appear more than once in the current library."""
+        return list(self._snapshot.duplicate_ids)
+    
+    def _publish(self, prompts):
+        """
+        Build a snapshot for a library and swap it in. Needs the write lock.
+        
+        Duplicate IDs in a loaded library are reported once by the converter
+        that wrote it, not on every load; see the duplicate_ids property.
+        """
+        # Compiled libraries store the hash of the prompts they were built
+        # from. Other libraries are hashed when the hash is first needed, so
+        # editing a large library does not serialize all of it every time.
+        library_hash = None
+        if isinstance(prompts, PromptLibrary):
+            library_hash = prompts.library_hash
+        else:
+            prompts = tuple(
+                prompt if isinstance(prompt, Prompt) else Prompt.from_dict(prompt, self.keep_file_paths)
+                for prompt in prompts
+            )
+        
+        version = self._snapshot.version + 1 if self._snapshot else 0
+        snapshot = LibrarySnapshot(prompts, library_hash, self._render_section, version)
+        
+        retired = self._snapshot
+        self._snapshot = snapshot
+        if retired is not None:
+            self._retired.add(retired)
+        self.cache.clear()
+    
+    def retired_snapshots(self):
+        """
+        Count the replaced snapshots that readers are still using.
+        
+        Each is released as soon as the last reader holding it finishes.
+        """
+        return len(self._retired)
+    
+    def _render_section(self, prompt):
+        """
+        Pre-render the section a prompt contributes to combined prompts.
+        
+        Returns:
+            A tuple of (section bucket, rendered fragment, label prefix). The
+            bucket is 'workflow', 'basic' or 'additional', and the prefix is
+            the part of the fragment before the prompt content.
+        """
+        category = prompt.get('category', '').lower()
+        
+        # Identify basic cleanup prompt (should be in the basic section)
+        if prompt['id'] == BASIC_CLEANUP_ID:
+            bucket, prefix = 'basic', ""
+        # Workflow prompts share a single section at the top
+        elif category == 'workflow':
+            bucket, prefix = 'workflow', ""
+        # Everything else gets its own section with a category header
+        else:
+            section_label = self.section_headers.get(category, f"## {category.title()} Instructions")
+            bucket, prefix = 'additional', f"{section_label}\n"
+        
+        return bucket, f"{prefix}{self._prompt_content(prompt)}\n\n", prefix
+    
+    def _prompt_content(self, prompt):
+        """Get the content a prompt contributes, minified if requested."""
+        if not self.minified:
+            return prompt['content']
+        if 'content_min' not in prompt:
+            return minify_content(prompt['content'])
+        return prompt['content_min']
+    
+    def _prompt_list(self):
+        """Get the loaded prompts as a list that can be edited."""
+        prompts = self._snapshot.prompts
+        if isinstance(prompts, PromptLibrary):
+            return prompts.to_list()
+        return list(prompts)
+    
+    def reload(self):
+        """Reload the prompts from the file or shared library the combiner was created with."""
+        if self._shared_reader is not None:
+            self.prompts = self._shared_reader.attach()
+            return
+        
+        if not self.json_file:
+            raise ValueError("No JSON file to reload prompts from.")
+        
+        self._file_signature = _file_signature(self.json_file)
+        self.prompts = load_prompts(self.json_file, self.keep_file_paths)
+    
+    def refresh(self):
+        """
+        Reload the prompts if a newer version of the library is available.
+        
+        Shared libraries are reloaded when a new generation is published, and
+        files when their modification time or size changes. The check is cheap
+        enough to run before every request.
+        
+        Returns:
+            True if the prompts were reloaded
+        """
+        if self._shared_reader is not None:
+            generation = self._shared_reader.generation()
+            if generation is None or generation == getattr(self._snapshot.prompts, 'generation', None):
+                return False
+        elif not self.json_file or _file_signature(self.json_file) == self._file_signature:
+            return False
+        
+        self.reload()
+        return True
+    
+    def add_prompt(self, prompt):
+        """Add a prompt to the library and update the indexes."""
+        with self._write_lock:
+            if prompt['id'] in self._snapshot.by_id:
+                warnings.warn(
+                    f"Duplicate prompt ID '{prompt['id']}'. Only the first prompt with this ID can be selected.",
+                    stacklevel=2
+                )
+            self._publish(self._prompt_list() + [prompt])
+    
+    def remove_prompt(self, prompt_id):
+        """Remove all prompts with the given ID from the library."""
+        with self._write_lock:
+            self._publish([p for p in self._prompt_list() if p['id'] != prompt_id])
     
     def get_categories(self):
         """Get a list of all available categories."""
-        return sorted(list(set(prompt['category'] for prompt in self.prompts)))
+        return list(self._snapshot.categories)
     
     def get_prompts_by_category(self, category):
         """Get all prompts in a specific category."""
-        return [p for p in self.prompts if p['category'] == category]
+        return list(self._snapshot.by_category.get(category, []))
     
     def get_subcategories(self, category):
         """Get all subcategories for a specific category."""
-        subcategories = set()
-        for prompt in self.prompts:
-            if prompt['category'] == category and prompt.get('subcategory'):
-                subcategories.add(prompt['subcategory'])
-        return sorted(list(subcategories))
+        return list(self._snapshot.subcategories.get(category, []))
     
     def get_prompts_by_subcategory(self, category, subcategory):
         """Get all prompts in a specific subcategory."""
-        return [p for p in self.prompts if p['category'] == category and p.get('subcategory') == subcategory]
+        return list(self._snapshot.by_subcategory.get((category, subcategory), []))
     
     def get_prompt_by_id(self, prompt_id):
         """Get a specific prompt by its ID."""
-        for prompt in self.prompts:
-            if prompt['id'] == prompt_id:
-                return prompt
-        return None
+        return self._snapshot.by_id.get(prompt_id)
+    
+    def get_search_index(self):
+        """
+        Get the full-text search index, building it on first use.
+        
+        When the prompts come from a JSON file, the index is stored next to
+        it and reused until the library hash changes.
+        """
+        index_file = get_index_path(self.json_file) if self.json_file else None
+        return self._snapshot.get_search_index(index_file)
+    
+    def search(self, query, limit=10):
+        """
+        Search prompts by title, content, category and subcategory.
+        
+        Args:
+            query: Free-text query; each word also matches as a prefix
+            limit: Maximum number of results
+        
+        Returns:
+            A list of (prompt, score) tuples, best match first
+        """
+        snapshot = self._snapshot
+        index_file = get_index_path(self.json_file) if self.json_file else None
+        results = snapshot.get_search_index(index_file).search(query, limit)
+        return [(snapshot.prompts[doc], score) for doc, score in results]
+    
+    def _group_prompts(self, snapshot, prompt_ids):
+        """
+        Resolve prompt IDs and sort them into the combined prompt sections.
+        
+        Returns:
+            A tuple of (workflow_sections, basic_sections, additional_sections),
+            each a list of (prompt ID, pre-rendered fragment) tuples
+        """
+        groups = {'workflow': [], 'basic': [], 'additional': []}
+        
+        # Always start with the basic cleanup prompt if available and not explicitly included
+        basic_cleanup = snapshot.get_section(BASIC_CLEANUP_ID)
+        if BASIC_CLEANUP_ID not in prompt_ids and basic_cleanup:
+            groups['basic'].append((BASIC_CLEANUP_ID, basic_cleanup[1]))
+        
+        # Add all selected prompts
+        for prompt_id in prompt_ids:
+            section = snapshot.get_section(prompt_id)
+            if section:
+                groups[section[0]].append((prompt_id, section[1]))
+        
+        return groups['workflow'], groups['basic'], groups['additional']
+    
+    def _cache_key(self, snapshot, workflow_sections, basic_sections, additional_sections, custom_header,
+                   dedupe=False):
+        """
+        Build the result cache key for a grouped selection.
+        
+        The key only keeps what affects the output: the order of prompts within
+        the workflow and additional sections, and how often the basic cleanup
+        prompt appears. Where basic-cleanup sits in the selection and any
+        unknown IDs do not matter.
+        """
+        return (
+            snapshot.library_hash,
+            tuple(prompt_id for prompt_id, _ in workflow_sections),
+            len(basic_sections),
+            tuple(prompt_id for prompt_id, _ in additional_sections),
+            custom_header,
+            dedupe
+        )
+    
+    def get_prompt_tokens(self, prompt_id):
+        """
+        Estimate the tokens a prompt adds to a combined prompt.
+        
+        Counts are computed once per prompt, including its section label, and
+        cached until the library changes.
+        
+        Returns:
+            The token estimate, or None if there is no prompt with this ID
+        """
+        return self._prompt_tokens(self._snapshot, prompt_id)
+    
+    def _prompt_tokens(self, snapshot, prompt_id):
+        """Get the cached token estimate of a prompt's section in a snapshot."""
+        tokens = snapshot.section_tokens.get(prompt_id)
+        if tokens is None:
+            section = snapshot.get_section(prompt_id)
+            if section is None:
+                return None
+            tokens = snapshot.section_tokens[prompt_id] = self.token_estimator.count(section[1])
+        return tokens
+    
+    def _estimate_sections(self, snapshot, workflow_sections, basic_sections, additional_sections):
+        """Estimate the tokens of grouped sections from the cached counts."""
+        total = 0
+        
+        grouped = {'workflow': workflow_sections, 'basic': basic_sections}
+        for bucket, header in GROUPED_SECTIONS:
+            if grouped[bucket]:
+                if header not in self._header_tokens:
+                    self._header_tokens[header] = self.token_estimator.count(header)
+                total += self._header_tokens[header]
+        
+        for sections in (workflow_sections, basic_sections, additional_sections):
+            for prompt_id, _ in sections:
+                total += self._prompt_tokens(snapshot, prompt_id)
+        
+        return total
+    
+    def estimate_tokens(self, prompt_ids):
+        """
+        Estimate the size of the combined prompt for a selection in tokens.
+        
+        This only adds up cached per-prompt counts, so it is cheap enough to
+        run on every selection change.
+        """
+        snapshot = self._snapshot
+        return self._estimate_sections(snapshot, *self._group_prompts(snapshot, prompt_ids))
+    
+    def _select_sections(self, snapshot, prompt_ids, max_tokens=None, trim=False):
+        """
+        Group the selected prompts and apply the token budget, if any.
+        
+        When trimming, additional sections are dropped from the end of the
+        selection until the stack fits. Workflow and basic instructions are
+        never dropped.
+        
+        Raises:
+            TokenBudgetExceeded: If the stack does not fit the budget
+        """
+        workflow_sections, basic_sections, additional_sections = self._group_prompts(snapshot, prompt_ids)
+        if max_tokens is None:
+            return workflow_sections, basic_sections, additional_sections
+        
+        estimated_tokens = self._estimate_sections(snapshot, workflow_sections, basic_sections, additional_sections)
+        
+        while trim and estimated_tokens > max_tokens and additional_sections:
+            prompt_id, _ = additional_sections.pop()
+            estimated_tokens -= self._prompt_tokens(snapshot, prompt_id)
+        
+        if estimated_tokens > max_tokens:
+            raise TokenBudgetExceeded(estimated_tokens, max_tokens)
+        
+        return workflow_sections, basic_sections, additional_sections
+    
+    def _dedupe_sections(self, snapshot, workflow_sections, basic_sections, additional_sections):
+        """
+        Remove boilerplate repeated across grouped sections.
+        
+        Sections are deduplicated in output order, so the first occurrence
+        of a repeated sentence, paragraph or heading block is kept. Sections
+        left without content are dropped.
+        
+        Returns:
+            A tuple of (workflow_sections, basic_sections, additional_sections,
+            removal counts)
+        """
+        groups = (workflow_sections, basic_sections, additional_sections)
+        contents = [self._prompt_content(snapshot.by_id[prompt_id]) for group in groups for prompt_id, _ in group]
+        deduped_contents, stats = deduplicate_contents(contents)
+        
+        deduped_groups = []
+        position = 0
+        for group in groups:
+            deduped_group = []
+            for prompt_id, fragment in group:
+                content = deduped_contents[position]
+                position += 1
+                if content == contents[position - 1]:
+                    deduped_group.append((prompt_id, fragment))
+                elif content.strip():
+                    deduped_group.append((prompt_id, f"{snapshot.get_section(prompt_id)[2]}{content}\n\n"))
+            deduped_groups.append(deduped_group)
+        
+        return deduped_groups[0], deduped_groups[1], deduped_groups[2], stats
+    
+    def dedupe_report(self, prompt_ids, max_tokens=None, trim=False):
+        """
+        Measure how much deduplication shrinks a combined prompt.
+        
+        Returns:
+            A dictionary with the size of the combined prompt before and
+            after deduplication in bytes and tokens, the savings, and how
+            many blocks, paragraphs and sentences were removed
+        """
+        snapshot = self._snapshot
+        sections = self._select_sections(snapshot, prompt_ids, max_tokens, trim)
+        *deduped_sections, stats = self._dedupe_sections(snapshot, *sections)
+        original = "".join(self._iter_fragments(*sections))
+        deduped = "".join(self._iter_fragments(*deduped_sections))
+        
+        bytes_before = len(original.encode('utf-8'))
+        bytes_after = len(deduped.encode('utf-8'))
+        tokens_before = self.token_estimator.count(original)
+        tokens_after = self.token_estimator.count(deduped)
+        
+        report = {
+            "bytes_before": bytes_before,
+            "bytes_after": bytes_after,
+            "bytes_saved": bytes_before - bytes_after,
+            "tokens_before": tokens_before,
+            "tokens_after": tokens_after,
+            "tokens_saved": tokens_before - tokens_after
+        }
+        report.update(stats)
+        return report
     
-    def combine_prompts(self, prompt_ids, custom_header=None):
+    def trim_to_budget(self, prompt_ids, max_tokens):
+        """
+        Get the selection that remains after trimming a stack to a token budget.
+        
+        Returns:
+            The prompt IDs in output order, including basic-cleanup
+        
+        Raises:
+            TokenBudgetExceeded: If even the required sections do not fit
+        """
+        sections = self._select_sections(self._snapshot, prompt_ids, max_tokens, trim=True)
+        return [prompt_id for group in sections for prompt_id, _ in group]
+    
+    def combine_prompts(self, prompt_ids, custom_header=None, max_tokens=None, trim=False, dedupe=False):
         """
         Combine multiple prompts into a single system prompt.
         
         Args:
             prompt_ids: List of prompt IDs to combine
             custom_header: Optional custom header for the combined prompt
+            max_tokens: Optional token budget for the combined prompt
+            trim: Drop additional sections from the end of the selection
+                to fit max_tokens instead of rejecting the stack
+            dedupe: Remove sentences, paragraphs and heading blocks that
+                repeat text from earlier sections
             
         Returns:
             A combined system prompt string
+        
+        Raises:
+            TokenBudgetExceeded: If the stack does not fit max_tokens
         """
-        selected_prompts = []
+        snapshot = self._snapshot
+        workflow_sections, basic_sections, additional_sections = self._select_sections(
+            snapshot, prompt_ids, max_tokens, trim
+        )
         
-        # Always start with the basic cleanup prompt if available and not explicitly included
-        basic_cleanup_id = "basic-cleanup"
-        basic_cleanup_included = basic_cleanup_id in prompt_ids
+        # Create the combined prompt
+        if not (workflow_sections or basic_sections or additional_sections):
+            return "No valid prompts selected."
         
-        if not basic_cleanup_included:
-            basic_prompt = self.get_prompt_by_id(basic_cleanup_id)
-            if basic_prompt:
-                selected_prompts.append(basic_prompt)
+        cache_key = self._cache_key(
+            snapshot, workflow_sections, basic_sections, additional_sections, custom_header, dedupe
+        )
+        combined_text = self.cache.get(cache_key)
+        if combined_text is not None:
+            return combined_text
         
-        # Add all selected prompts
-        for prompt_id in prompt_ids:
-            prompt = self.get_prompt_by_id(prompt_id)
-            if prompt:
-                selected_prompts.append(prompt)
+        if dedupe:
+            workflow_sections, basic_sections, additional_sections, _ = self._dedupe_sections(
+                snapshot, workflow_sections, basic_sections, additional_sections
+            )
         
-        # Create the combined prompt
-        if not selected_prompts:
-            return "No valid prompts selected."
+        combined_text = "".join(self._iter_fragments(workflow_sections, basic_sections, additional_sections))
+        self.cache.put(cache_key, combined_text)
+        
+        return combined_text
+    
+    def iter_combined_prompt(self, prompt_ids, custom_header=None, max_tokens=None, trim=False, dedupe=False):
+        """
+        Generate the combined system prompt as a sequence of text fragments.
         
-        # Initialize the combined text
-        combined_text = ""
+        Joining the fragments gives exactly the string combine_prompts
+        returns, without building it in memory first.
+        """
+        return self._iter_combined_prompt(self._snapshot, prompt_ids, custom_header, max_tokens, trim, dedupe)
+    
+    def _iter_combined_prompt(self, snapshot, prompt_ids, custom_header=None, max_tokens=None, trim=False,
+                              dedupe=False):
+        """Generate the combined system prompt from one snapshot."""
+        workflow_sections, basic_sections, additional_sections = self._select_sections(
+            snapshot, prompt_ids, max_tokens, trim
+        )
         
-        # Organize prompts by category
-        workflow_prompts = []
-        basic_prompts = []
-        additional_prompts = []
+        if not (workflow_sections or basic_sections or additional_sections):
+            yield "No valid prompts selected."
+            return
         
-        for prompt in selected_prompts:
-            category = prompt.get('category', '').lower()
-            
-            # Identify basic cleanup prompt (should be in basic_prompts)
-            if prompt['id'] == basic_cleanup_id:
-                basic_prompts.append(prompt)
-            # Add workflow related prompts first
-            elif category == 'workflow':
-                workflow_prompts.append(prompt)
-            # Everything else goes to additional prompts
-            else:
-                additional_prompts.append(prompt)
-        
-        # 1. Add workflow section if available
-        if workflow_prompts:
-            combined_text += "## Workflow\n\n"
-            for prompt in workflow_prompts:
-                combined_text += f"{prompt['content']}\n\n"
-        
-        # 2. Add basic instructions section
-        if basic_prompts:
-            combined_text += "## Basic Instructions\n\n"
-            for prompt in basic_prompts:
-                combined_text += f"{prompt['content']}\n\n"
-        
-        # 3. Add additional sections with appropriate headers
-        for prompt in additional_prompts:
-            category = prompt.get('category', '').lower()
-            
-            # Create appropriate section label based on category
-            if category == 'tone':
-                section_label = "## Tone Instructions"
-            elif category == 'format':
-                section_label = "## Formatting Instructions"
-            elif category == 'length':
-                section_label = "## Length Instructions"
-            elif category == 'style':
-                section_label = "## Style Instructions"
-            elif category == 'ai-prompts':
-                section_label = "## AI Instructions"
-            else:
-                section_label = f"## {category.title()} Instructions"
-            
-            # Add the section label and content
-            combined_text += f"{section_label}\n{prompt['content']}\n\n"
+        cache_key = self._cache_key(
+            snapshot, workflow_sections, basic_sections, additional_sections, custom_header, dedupe
+        )
+        combined_text = self.cache.get(cache_key)
+        if combined_text is not None:
+            yield combined_text
+            return
+        
+        if dedupe:
+            workflow_sections, basic_sections, additional_sections, _ = self._dedupe_sections(
+                snapshot, workflow_sections, basic_sections, additional_sections
+            )
         
-        return combined_text.strip()
+        yield from self._iter_fragments(workflow_sections, basic_sections, additional_sections)
+    
+    def _iter_fragments(self, workflow_sections, basic_sections, additional_sections):
+        """Concatenate pre-rendered sections, stripped like a single string."""
+        return _strip_fragments(self._iter_sections(workflow_sections, basic_sections, additional_sections))
+    
+    def _iter_sections(self, workflow_sections, basic_sections, additional_sections):
+        """Yield the section headers and pre-rendered fragments in output order."""
+        # Workflow and basic instructions share one header per section
+        grouped = {'workflow': workflow_sections, 'basic': basic_sections}
+        for bucket, header in GROUPED_SECTIONS:
+            if grouped[bucket]:
+                yield header
+                for _, fragment in grouped[bucket]:
+                    yield fragment
+        
+        # Additional prompts carry their own section label
+        for _, fragment in additional_sections:
+            yield fragment
     
     def get_combined_prompt(self, prompt_ids, custom_header=None):
         """Alias for combine_prompts for backward compatibility."""
         return self.combine_prompts(prompt_ids, custom_header)
     
-    def save_combined_prompt(self, prompt_ids, output_file, custom_header=None):
-        """Save a combined prompt to a file."""
-        combined_prompt = self.combine_prompts(prompt_ids, custom_header)
+    def write_combined_prompt(self, prompt_ids, fileobj, custom_header=None, max_tokens=None, trim=False,
+                              dedupe=False):
+        """
+        Stream a combined prompt to a file-like object.
+        
+        Args:
+            prompt_ids: List of prompt IDs to combine
+            fileobj: Object with a write() method. Text streams receive str
+                fragments, anything else (binary files, socket.makefile('wb'))
+                receives UTF-8 encoded bytes.
+            custom_header: Optional custom header for the combined prompt
+            max_tokens: Optional token budget, as for combine_prompts
+            trim: Trim the stack to the budget instead of rejecting it
+            dedupe: Remove text repeated across sections
+            
+        Returns:
+            The number of characters written. Earlier versions returned the
+            combined prompt; use combine_prompts() for the text.
+        """
+        return self._write_combined_prompt(
+            self._snapshot, prompt_ids, fileobj, custom_header, max_tokens, trim, dedupe
+        )
+    
+    def _write_combined_prompt(self, snapshot, prompt_ids, fileobj, custom_header=None, max_tokens=None,
+                               trim=False, dedupe=False):
+        """Stream a combined prompt from one snapshot to a file-like object."""
+        is_text = isinstance(fileobj, io.TextIOBase)
+        written = 0
+        
+        for fragment in self._iter_combined_prompt(snapshot, prompt_ids, custom_header, max_tokens, trim, dedupe):
+            fileobj.write(fragment if is_text else fragment.encode('utf-8'))
+            written += len(fragment)
+        
+        return written
+    
+    def save_combined_prompt(self, prompt_ids, output_file, custom_header=None, max_tokens=None, trim=False,
+                             dedupe=False):
+        """
+        Save a combined prompt to a file.
+        
+        Returns:
+            The number of characters written. Earlier versions returned the
+            combined prompt; use combine_prompts() for the text.
+        """
+        snapshot = self._snapshot
+        
+        # Check the budget before creating the file
+        if max_tokens is not None:
+            sections = self._select_sections(snapshot, prompt_ids, max_tokens, trim)
+            prompt_ids = [prompt_id for group in sections for prompt_id, _ in group]
         
         with open(output_file, 'w', encoding='utf-8') as f:
-            f.write(combined_prompt)
+            return self._write_combined_prompt(snapshot, prompt_ids, f, custom_header, dedupe=dedupe)
+
+
+def _file_signature(path):
+    """Get the modification time and size of a file, or None if it is missing."""
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return stat.st_mtime_ns, stat.st_size
+
+
+def load_section_headers(section_headers=None):
+    """
+    Build the section header table from the defaults and optional overrides.
+    
+    Args:
+        section_headers: Dictionary of headers by category, or the path of a
+            JSON file containing one
+    """
+    headers = dict(SECTION_HEADERS)
+    
+    if isinstance(section_headers, str):
+        with open(section_headers, 'r', encoding='utf-8') as f:
+            section_headers = json.load(f)
+    
+    if section_headers:
+        headers.update({category.lower(): header for category, header in section_headers.items()})
+    
+    return headers
+
+
+def _strip_fragments(fragments):
+    """
+    Strip leading and trailing whitespace from a stream of text fragments.
+    
+    The joined output equals "".join(fragments).strip(), but only trailing
+    whitespace that might end the text is ever held back.
+    """
+    pending = ""
+    started = False
+    
+    for fragment in fragments:
+        if not started:
+            fragment = fragment.lstrip()
+            if not fragment:
+                continue
+            started = True
+        
+        body = fragment.rstrip()
+        if not body:
+            pending += fragment
+            continue
         
-        return combined_prompt
+        if pending:
+            yield pending
+        yield body
+        pending = fragment[len(body):]
 
 
 if __name__ == "__main__":
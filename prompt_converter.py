@@ -5,6 +5,18 @@ Utility module to convert Markdown system prompts to JSON format.
 import os
 import json
 import re
+import hashlib
+from concurrent.futures import ProcessPoolExecutor
+from token_estimator import HeuristicTokenEstimator
+from prompt_library import PromptLibrary, is_library_file, load_prompts, write_library
+
+
+MANIFEST_VERSION = 2
+
+BULLET_PATTERN = re.compile(r'^(\s*)(?:[-*+•])\s+')
+INNER_WHITESPACE_PATTERN = re.compile(r'(?<=\S)[ \t]{2,}')
+STRONG_PATTERN = re.compile(r'(\*\*|__)(?=\S)(.+?)(?<=\S)\1')
+EMPHASIS_PATTERN = re.compile(r'(?<![\w*])([*_])(?=\S)(.+?)(?<=\S)\1(?![\w*])')
 
 
 def extract_title_and_content(markdown_content):
@@ -45,8 +57,9 @@ def get_subcategory_from_path(file_path):
     parts = file_path.split(os.sep)
     try:
         base_index = parts.index('system-prompts')
-        # Check if there's a subcategory (directory after category)
-        if len(parts) > base_index + 2:
+        # Check if there's a subcategory (directory after category). Files
+        # directly inside the category directory have none.
+        if len(parts) > base_index + 3:
             return parts[base_index + 2]
     except ValueError:
         pass
@@ -54,11 +67,118 @@ def get_subcategory_from_path(file_path):
     return None
 
 
+def get_display_title(title):
+    """Clean up a prompt title for display - remove "Format" and "Prompt" if present."""
+    return title.replace(" Format", "").replace(" Prompt", "")
+
+
+def describe_content(content, category):
+    """Build the short description shown below a prompt, or None if it has no content."""
+    if not content:
+        return None
+    
+    first_line = content.split('\n')[0]
+    if category == "format":
+        return "Reformats the text " + first_line.lower()
+    return first_line
+
+
+def add_derived_fields(prompt_json, token_estimator=None):
+    """
+    Add the display and size fields consumers would otherwise derive per request.
+    
+    Adds display_title, description, content_bytes, token_estimate and
+    content_sha256, all computed from the prompt's title and content.
+    """
+    token_estimator = token_estimator or HeuristicTokenEstimator()
+    content = prompt_json['content']
+    encoded = content.encode('utf-8')
+    
+    prompt_json['display_title'] = get_display_title(prompt_json['title'])
+    prompt_json['description'] = describe_content(content, prompt_json['category'])
+    prompt_json['content_bytes'] = len(encoded)
+    prompt_json['token_estimate'] = token_estimator.count(content)
+    prompt_json['content_sha256'] = hashlib.sha256(encoded).hexdigest()
+    return prompt_json
+
+
 def convert_markdown_to_json(markdown_path):
     """Convert a single markdown file to JSON object."""
     with open(markdown_path, 'r', encoding='utf-8') as file:
         content = file.read()
     
+    return markdown_text_to_json(markdown_path, content)
+
+
+def minify_content(content, strip_emphasis=False):
+    """
+    Produce a compact variant of a prompt's markdown body.
+    
+    Trailing whitespace is trimmed, runs of spaces inside lines are collapsed,
+    bullets are normalized to "- ", runs of blank lines become one, and blank
+    lines between list items are removed. Fenced code blocks are left as is.
+    
+    Args:
+        content: The prompt's markdown content
+        strip_emphasis: Also remove **bold**, __bold__, *italic* and _italic_
+            markers, keeping the text
+    """
+    lines = []
+    in_fence = []
+    fenced = False
+    for line in content.split('\n'):
+        # Code blocks are kept exactly as written
+        if line.lstrip().startswith('```'):
+            fenced = not fenced
+            line = line.rstrip()
+        elif not fenced:
+            line = INNER_WHITESPACE_PATTERN.sub(' ', line.rstrip())
+            line = BULLET_PATTERN.sub(r'\1- ', line)
+            if strip_emphasis:
+                line = EMPHASIS_PATTERN.sub(r'\2', STRONG_PATTERN.sub(r'\2', line))
+        in_fence.append(fenced)
+        lines.append(line)
+    
+    compact = []
+    for i, line in enumerate(lines):
+        if not line and not in_fence[i]:
+            # Collapse blank runs and tighten lists
+            if not compact or not compact[-1]:
+                continue
+            next_line = next((l for l in lines[i + 1:] if l), '')
+            if BULLET_PATTERN.match(compact[-1]) and BULLET_PATTERN.match(next_line):
+                continue
+        compact.append(line)
+    
+    return '\n'.join(compact).strip()
+
+
+def add_minified_content(prompt_json, strip_emphasis=False, token_estimator=None):
+    """Add content_min to a prompt along with the bytes and tokens it saves."""
+    token_estimator = token_estimator or HeuristicTokenEstimator()
+    content = prompt_json['content']
+    content_min = minify_content(content, strip_emphasis)
+    
+    prompt_json['content_min'] = content_min
+    prompt_json['min_bytes_saved'] = len(content.encode('utf-8')) - len(content_min.encode('utf-8'))
+    prompt_json['min_tokens_saved'] = token_estimator.count(content) - token_estimator.count(content_min)
+    return prompt_json
+
+
+def markdown_text_to_json(markdown_path, content, options=None):
+    """
+    Build the JSON object for a markdown file whose text is already loaded.
+    
+    Args:
+        markdown_path: Path of the markdown file
+        content: Text of the markdown file
+        options: Conversion options. 'minify' adds a compact content_min
+            variant and 'strip_emphasis' removes emphasis markers from it.
+    
+    The display title, description, content size, token estimate and
+    content hash are always added, see add_derived_fields().
+    """
+    options = options or {}
     title, prompt_content = extract_title_and_content(content)
     category = get_category_from_path(markdown_path)
     subcategory = get_subcategory_from_path(markdown_path)
@@ -76,30 +196,337 @@ def convert_markdown_to_json(markdown_path):
         "file_path": markdown_path
     }
     
+    token_estimator = HeuristicTokenEstimator()
+    add_derived_fields(prompt_json, token_estimator)
+    
+    if options.get('minify'):
+        add_minified_content(prompt_json, options.get('strip_emphasis', False), token_estimator)
+    
     return prompt_json
 
 
-def convert_directory_to_json(directory_path, output_file=None):
-    """Convert all markdown files in a directory to a JSON array."""
+def decode_markdown(data):
+    """Decode raw file bytes the same way text-mode open() would."""
+    return data.decode('utf-8').replace('\r\n', '\n').replace('\r', '\n')
+
+
+def get_manifest_path(output_file):
+    """Get the path of the incremental conversion manifest for an output file."""
+    return f"{output_file}.manifest.json"
+
+
+def _find_markdown_files(directory_path):
+    """
+    List the markdown files in a directory tree.
+    
+    Files come out in the same order as os.walk would yield them: each
+    directory's files first, then its subdirectories depth-first. Symlinked
+    directories are not followed.
+    """
+    markdown_files = []
+    pending = [directory_path]
+    
+    while pending:
+        current = pending.pop()
+        try:
+            with os.scandir(current) as entries:
+                entries = list(entries)
+        except OSError:
+            continue
+        
+        subdirectories = []
+        for entry in entries:
+            try:
+                is_dir = entry.is_dir()
+            except OSError:
+                is_dir = False
+            
+            if not is_dir:
+                if entry.name.endswith('.md'):
+                    markdown_files.append(entry.path)
+            elif not entry.is_symlink():
+                subdirectories.append(entry.path)
+        
+        # Push in reverse so subdirectories are visited in listing order
+        pending.extend(reversed(subdirectories))
+    
+    return markdown_files
+
+
+def _read_and_convert(file_path, with_hash=False, options=None):
+    """
+    Read and convert one markdown file.
+    
+    Returns:
+        A tuple of (prompt, file info), where file info holds the size and
+        SHA-256 of the file when with_hash is set and is None otherwise
+    """
+    with open(file_path, 'rb') as file:
+        data = file.read()
+    
+    prompt_json = markdown_text_to_json(file_path, decode_markdown(data), options)
+    if not with_hash:
+        return prompt_json, None
+    
+    return prompt_json, {"size": len(data), "sha256": hashlib.sha256(data).hexdigest()}
+
+
+def _convert_batch(file_paths, with_hash=False, options=None):
+    """Convert a batch of files, capturing errors instead of raising them."""
+    results = []
+    for file_path in file_paths:
+        try:
+            results.append((_read_and_convert(file_path, with_hash, options), None))
+        except Exception as e:
+            results.append((None, str(e)))
+    return results
+
+
+def _convert_files(file_paths, jobs=1, with_hash=False, options=None):
+    """
+    Convert markdown files, optionally across several worker processes.
+    
+    Args:
+        file_paths: Paths of the markdown files to convert
+        jobs: Number of worker processes. 1 converts in this process and
+            0 or None uses one worker per CPU.
+        with_hash: Also return the size and SHA-256 of each file
+        options: Conversion options passed to markdown_text_to_json
+        
+    Returns:
+        A list of ((prompt, file info), error message) tuples in the same
+        order as file_paths. Exactly one of the two is None.
+    """
+    if not jobs:
+        jobs = os.cpu_count() or 1
+    
+    if jobs == 1 or len(file_paths) < 2:
+        return _convert_batch(file_paths, with_hash, options)
+    
+    # Hand out batches so that each worker round trip carries real work
+    batch_size = max(1, min(512, len(file_paths) // (jobs * 4)))
+    batches = [file_paths[i:i + batch_size] for i in range(0, len(file_paths), batch_size)]
+    
+    results = []
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        for batch_results in executor.map(_convert_batch, batches, [with_hash] * len(batches), [options] * len(batches)):
+            results.extend(batch_results)
+    return results
+
+
+def _load_previous_conversion(directory_path, output_file, manifest_file, options=None):
+    """
+    Load the manifest and output library of a previous incremental run.
+    
+    Returns:
+        A tuple of (manifest entries by path, previous prompts by path). Both
+        are empty if there is nothing usable to build on.
+    """
+    if not (os.path.exists(manifest_file) and os.path.exists(output_file)):
+        return {}, {}
+    
+    try:
+        with open(manifest_file, 'r', encoding='utf-8') as f:
+            manifest = json.load(f)
+        previous_prompts = load_prompts(output_file)
+    except (OSError, ValueError) as e:
+        print(f"Ignoring previous conversion state: {e}")
+        return {}, {}
+    
+    if (manifest.get('version') != MANIFEST_VERSION
+            or manifest.get('directory') != directory_path
+            or manifest.get('options', {}) != (options or {})):
+        return {}, {}
+    
+    # Copy the prompts so none refer to a compiled library about to be replaced
+    if isinstance(previous_prompts, PromptLibrary):
+        previous_prompts = previous_prompts.to_list()
+    return manifest.get('files', {}), {p['file_path']: p for p in previous_prompts}
+
+
+def _convert_incrementally(directory_path, output_file, manifest_file, jobs=1, options=None):
+    """
+    Convert a directory, reparsing only files that changed since the last run.
+    
+    A file is reused from the previous output when its mtime and size match
+    the manifest, or when its content hash does. Returns the prompts in
+    discovery order together with the new manifest entries and change counts.
+    """
+    manifest_files, previous_prompts = _load_previous_conversion(directory_path, output_file, manifest_file, options)
+    
+    file_paths = _find_markdown_files(directory_path)
+    stats = {}
+    to_convert = []
+    
+    for file_path in file_paths:
+        try:
+            stat = os.stat(file_path)
+        except OSError as e:
+            stats[file_path] = e
+            continue
+        
+        stats[file_path] = stat
+        entry = manifest_files.get(file_path)
+        
+        # Unchanged metadata means unchanged content
+        if not (entry and file_path in previous_prompts
+                and entry['mtime_ns'] == stat.st_mtime_ns
+                and entry['size'] == stat.st_size):
+            to_convert.append(file_path)
+    
+    converted = dict(zip(to_convert, _convert_files(to_convert, jobs, with_hash=True, options=options)))
+    
     prompts = []
+    new_manifest_files = {}
+    counts = {"added": 0, "changed": 0, "unchanged": 0, "deleted": 0}
+    
+    for file_path in file_paths:
+        stat = stats[file_path]
+        if isinstance(stat, OSError):
+            print(f"Error processing {file_path}: {stat}")
+            continue
+        
+        entry = manifest_files.get(file_path)
+        
+        if file_path not in converted:
+            prompts.append(previous_prompts[file_path])
+            new_manifest_files[file_path] = entry
+            counts["unchanged"] += 1
+            continue
+        
+        result, error = converted[file_path]
+        if error is not None:
+            print(f"Error processing {file_path}: {error}")
+            continue
+        
+        prompt_json, file_info = result
+        new_manifest_files[file_path] = {
+            "mtime_ns": stat.st_mtime_ns,
+            "size": file_info['size'],
+            "sha256": file_info['sha256']
+        }
+        
+        # Touched but identical content keeps the previous entry
+        if entry and file_path in previous_prompts and entry['sha256'] == file_info['sha256']:
+            prompts.append(previous_prompts[file_path])
+            counts["unchanged"] += 1
+        else:
+            prompts.append(prompt_json)
+            counts["changed" if entry else "added"] += 1
+    
+    counts["deleted"] = len(set(manifest_files) - set(new_manifest_files))
+    
+    return prompts, new_manifest_files, counts
+
+
+def _write_json_atomically(path, data, indent=None):
+    """
+    Write JSON to a file, replacing it in one step.
+    
+    Readers watching the file never see it half written. Encoding to a
+    string first also lets the C encoder handle output without indentation.
+    """
+    temp_file = f"{path}.tmp{os.getpid()}"
+    with open(temp_file, 'w', encoding='utf-8') as f:
+        f.write(json.dumps(data, indent=indent))
+    os.replace(temp_file, path)
+
+
+def _report_duplicate_ids(prompts):
+    """Print a warning for each prompt ID shared by several files."""
+    files_by_id = {}
+    for prompt in prompts:
+        files_by_id.setdefault(prompt['id'], []).append(prompt.get('file_path', prompt['title']))
     
-    for root, _, files in os.walk(directory_path):
-        for file in files:
-            if file.endswith('.md'):
-                file_path = os.path.join(root, file)
-                try:
-                    prompt_json = convert_markdown_to_json(file_path)
-                    prompts.append(prompt_json)
-                except Exception as e:
-                    print(f"Error processing {file_path}: {e}")
-    
-    # Sort prompts by category and title
-    prompts.sort(key=lambda x: (x['category'], x.get('subcategory', ''), x['title']))
-    
-    if output_file:
-        with open(output_file, 'w', encoding='utf-8') as f:
-            json.dump(prompts, f, indent=2)
+    for prompt_id, files in files_by_id.items():
+        if len(files) > 1:
+            print(f"Warning: Prompt ID '{prompt_id}' is used by {', '.join(files)}. "
+                  "Only the first can be selected; rename the others to make them selectable.")
+
+
+def convert_directory_to_json(directory_path, output_file=None, incremental=False, manifest_file=None, jobs=1,
+                              minify=False, strip_emphasis=False, output_format="json"):
+    """
+    Convert all markdown files in a directory to a JSON array.
+    
+    Args:
+        directory_path: Directory containing the markdown system prompts
+        output_file: Optional path to write the JSON array to
+        incremental: Only reparse files that changed since the last
+            incremental run and patch the existing output file. The result
+            is identical to a full conversion.
+        manifest_file: Where incremental mode keeps file hashes and
+            timestamps. Defaults to a sidecar next to the output file.
+        jobs: Number of worker processes used to read and parse files.
+            0 or None uses one worker per CPU.
+        minify: Add a compact content_min variant of each prompt, with the
+            bytes and tokens it saves
+        strip_emphasis: Remove emphasis markers from content_min
+        output_format: 'json', or 'bin' for a compiled library that
+            PromptCombiner memory-maps instead of parsing
+    """
+    options = {}
+    if minify:
+        options = {"minify": True, "strip_emphasis": strip_emphasis}
+    
+    if incremental and not output_file:
+        raise ValueError("Incremental conversion requires an output file.")
+    
+    if incremental:
+        manifest_file = manifest_file or get_manifest_path(output_file)
+        prompts, manifest_files, counts = _convert_incrementally(directory_path, output_file, manifest_file, jobs, options)
+    else:
+        prompts = []
+        file_paths = _find_markdown_files(directory_path)
+        
+        for file_path, (result, error) in zip(file_paths, _convert_files(file_paths, jobs, options=options)):
+            if error is not None:
+                print(f"Error processing {file_path}: {error}")
+            else:
+                prompts.append(result[0])
+    
+    # Sort prompts by category, subcategory and title. Prompts directly in a
+    # category sort by their file name among the subcategories, where they
+    # were when the file name was stored as their subcategory.
+    prompts.sort(key=lambda x: (
+        x['category'],
+        x.get('subcategory') or os.path.basename(x.get('file_path', '')),
+        x['title']
+    ))
+    
+    # An incremental run that found nothing to change leaves the output
+    # alone, so watchers and processes reading it are not disturbed
+    up_to_date = (incremental and os.path.exists(output_file)
+                  and is_library_file(output_file) == (output_format == "bin")
+                  and not (counts["added"] or counts["changed"] or counts["deleted"]))
+    
+    if output_file and up_to_date:
+        print(f"{output_file} is up to date with {len(prompts)} prompts")
+    elif output_file:
+        if output_format == "bin":
+            write_library(prompts, output_file)
+        else:
+            _write_json_atomically(output_file, prompts, indent=2)
         print(f"Converted {len(prompts)} prompts to {output_file}")
+        _report_duplicate_ids(prompts)
+        
+        if minify:
+            bytes_saved = sum(p['min_bytes_saved'] for p in prompts)
+            tokens_saved = sum(p['min_tokens_saved'] for p in prompts)
+            print(f"Minified content saves {bytes_saved} bytes (~{tokens_saved} tokens) across the library")
+    
+    if incremental:
+        manifest = {
+            "version": MANIFEST_VERSION,
+            "directory": directory_path,
+            "options": options,
+            "files": manifest_files
+        }
+        _write_json_atomically(manifest_file, manifest)
+        print(
+            f"Incremental update: {counts['added']} added, {counts['changed']} changed, "
+            f"{counts['deleted']} deleted, {counts['unchanged']} unchanged"
+        )
     
     return prompts
 
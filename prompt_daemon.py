@@ -0,0 +1,255 @@
+#!/usr/bin/env python3
+"""
+Background daemon that keeps prompt libraries loaded for the CLI.
+
+A client connects to the daemon's Unix domain socket and sends one line of
+JSON, {"argv": [...], "cwd": "...", "env": {...}, "version": "..."}. The
+daemon runs the command in the client's working directory, with the
+client's PROMPT_COMBINER_* environment variables in place of its own, and
+replies with {"exit_code": ..., "stdout": ..., "stderr": ...} before
+closing the connection.
+
+The version identifies the checkout and the state of its code. The default
+socket is shared by every checkout of a user, so a daemon started from a
+different checkout, or before the code changed, declines the request with
+{"version": "..."} and the client runs the command itself.
+
+This module only imports what the client side needs, so forwarding a
+command costs little more than starting the interpreter.
+"""
+import os
+import sys
+import json
+import socket
+import hashlib
+
+
+SOCKET_ENV = "PROMPT_COMBINER_SOCKET"
+
+# Environment variables configuring commands, which travel with a request
+ENV_PREFIX = "PROMPT_COMBINER_"
+
+# Commands that only read the library and write their own output files
+FORWARDED_COMMANDS = ("list", "search", "combine")
+
+
+def get_socket_path():
+    """
+    Get the daemon socket path.
+    
+    Uses $PROMPT_COMBINER_SOCKET when it is set, where an empty value turns
+    forwarding off, and a per-user path in the temp directory otherwise.
+    """
+    path = os.environ.get(SOCKET_ENV)
+    if path is not None:
+        return path or None
+    if not hasattr(socket, 'AF_UNIX'):
+        return None
+    temp_dir = os.environ.get('TMPDIR') or '/tmp'
+    return os.path.join(temp_dir, f"prompt-combiner-{os.getuid()}.sock")
+
+
+def get_code_version():
+    """
+    Identify the code a client or daemon runs.
+    
+    Returns:
+        A hash of this checkout's location and the size and modification
+        time of its modules
+    """
+    directory = os.path.dirname(os.path.realpath(__file__))
+    modules = sorted(
+        (entry.name, entry.stat().st_mtime_ns, entry.stat().st_size)
+        for entry in os.scandir(directory) if entry.name.endswith('.py')
+    )
+    return hashlib.sha256(json.dumps([directory, modules]).encode('utf-8')).hexdigest()[:16]
+
+
+def _command_environment():
+    """Get the environment variables that configure commands, except the socket."""
+    return {
+        key: value for key, value in os.environ.items()
+        if key.startswith(ENV_PREFIX) and key != SOCKET_ENV
+    }
+
+
+def _set_command_environment(values):
+    """Replace the environment variables that configure commands."""
+    for key in _command_environment():
+        if key not in values:
+            del os.environ[key]
+    os.environ.update(values)
+
+
+def _receive_all(connection):
+    """Read from a socket until the other side closes it."""
+    chunks = []
+    while True:
+        chunk = connection.recv(65536)
+        if not chunk:
+            return b"".join(chunks)
+        chunks.append(chunk)
+
+
+def forward_command(argv, socket_path=None, timeout=30.0):
+    """
+    Run a CLI command in the daemon if one is listening.
+    
+    Args:
+        argv: Command-line arguments, without the program name
+        socket_path: Daemon socket, by default from get_socket_path()
+        timeout: Seconds to wait for the daemon before giving up
+    
+    Returns:
+        The command's exit code after writing its output, or None if the
+        command is not forwarded, no daemon accepted the connection, or the
+        daemon runs different code. Once the request is sent the command
+        may have run, so later failures return 1 instead of running it again.
+    """
+    if not argv or argv[0] not in FORWARDED_COMMANDS:
+        return None
+    
+    socket_path = socket_path or get_socket_path()
+    if not socket_path or not os.path.exists(socket_path):
+        return None
+    
+    request = json.dumps({
+        "argv": argv,
+        "cwd": os.getcwd(),
+        "env": _command_environment(),
+        "version": get_code_version()
+    }) + "\n"
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as client:
+        client.settimeout(timeout)
+        try:
+            client.connect(socket_path)
+        except OSError:
+            # A stale socket or a daemon that went away; run in-process instead
+            return None
+        
+        try:
+            client.sendall(request.encode('utf-8'))
+            data = _receive_all(client)
+            if not data:
+                raise ValueError("it closed the connection without a reply")
+            response = json.loads(data.decode('utf-8'))
+            if 'exit_code' not in response:
+                # The daemon declined to run code other than its own
+                print(f"Note: The daemon on '{socket_path}' runs different code; running the command here.",
+                      file=sys.stderr)
+                return None
+            stdout, stderr, exit_code = response['stdout'], response['stderr'], response['exit_code']
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            print(f"Error: The daemon on '{socket_path}' did not answer the command: {e or type(e).__name__}",
+                  file=sys.stderr)
+            return 1
+    
+    sys.stdout.write(stdout)
+    sys.stderr.write(stderr)
+    return exit_code
+
+
+def _is_listening(socket_path):
+    """Check whether a daemon is accepting connections on a socket."""
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as client:
+            client.settimeout(1.0)
+            client.connect(socket_path)
+        return True
+    except OSError:
+        return False
+
+
+def _exit_code(code, stderr):
+    """Translate a SystemExit code the way the interpreter does."""
+    if code is None:
+        return 0
+    if isinstance(code, int):
+        return code
+    print(code, file=stderr)
+    return 1
+
+
+def serve(socket_path, execute):
+    """
+    Answer forwarded commands on a Unix domain socket until stopped.
+    
+    Requests are handled one at a time in this process, so commands can
+    share warm state and redirecting their output stays safe.
+    
+    Args:
+        socket_path: Path of the socket to create
+        execute: Function running a command for an argv list in the current
+            process. It returns the exit code or raises SystemExit.
+    
+    Raises:
+        RuntimeError: If another daemon is already listening on the socket
+    """
+    import io
+    import signal
+    import traceback
+    import socketserver
+    from contextlib import redirect_stdout, redirect_stderr
+    
+    if os.path.exists(socket_path):
+        if _is_listening(socket_path):
+            raise RuntimeError(f"A daemon is already listening on '{socket_path}'.")
+        os.unlink(socket_path)
+    
+    version = get_code_version()
+    
+    class CommandHandler(socketserver.StreamRequestHandler):
+        def handle(self):
+            try:
+                request = json.loads(self.rfile.readline().decode('utf-8'))
+                argv, cwd = request['argv'], request['cwd']
+                env = {
+                    key: value for key, value in request.get('env', {}).items()
+                    if key.startswith(ENV_PREFIX) and key != SOCKET_ENV and isinstance(value, str)
+                }
+            except (ValueError, KeyError, TypeError, AttributeError):
+                return
+            
+            if request.get('version') != version:
+                self.wfile.write(json.dumps({"version": version}).encode('utf-8'))
+                return
+            
+            # Run the command as the client would, then put the daemon's own
+            # directory and settings back for the next request
+            daemon_cwd = os.getcwd()
+            daemon_env = _command_environment()
+            stdout = io.StringIO()
+            stderr = io.StringIO()
+            with redirect_stdout(stdout), redirect_stderr(stderr):
+                try:
+                    os.chdir(cwd)
+                    _set_command_environment(env)
+                    exit_code = execute(argv) or 0
+                except SystemExit as e:
+                    exit_code = _exit_code(e.code, stderr)
+                except Exception:
+                    traceback.print_exc()
+                    exit_code = 1
+                finally:
+                    _set_command_environment(daemon_env)
+                    os.chdir(daemon_cwd)
+            
+            response = {"exit_code": exit_code, "stdout": stdout.getvalue(), "stderr": stderr.getvalue()}
+            self.wfile.write(json.dumps(response).encode('utf-8'))
+    
+    # Only the owner may connect, since commands can write files
+    old_umask = os.umask(0o177)
+    try:
+        server = socketserver.UnixStreamServer(socket_path, CommandHandler)
+    finally:
+        os.umask(old_umask)
+    
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        if os.path.exists(socket_path):
+            os.unlink(socket_path)
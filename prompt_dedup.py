@@ -0,0 +1,169 @@
+#!/usr/bin/env python3
+"""
+Remove boilerplate repeated across the prompts of a combined stack.
+"""
+import re
+
+
+SENTENCE_SPLIT_PATTERN = re.compile(r'(?<=[.!?])\s+')
+BULLET_PATTERN = re.compile(r'^\s*(?:[-*+]|\d+[.)])\s+')
+NON_WORD_PATTERN = re.compile(r'[^\w\s]')
+
+# Sentences shorter than this are too generic to treat as duplicates
+MIN_SENTENCE_WORDS = 4
+
+
+def _fingerprint(text):
+    """
+    Hash a unit of text after normalizing case, punctuation and whitespace.
+    
+    Returns:
+        A tuple of (hash, word count)
+    """
+    words = NON_WORD_PATTERN.sub(' ', BULLET_PATTERN.sub('', text).lower()).split()
+    return hash(' '.join(words)), len(words)
+
+
+def _split_blocks(content):
+    """Split markdown into blocks that each start at a heading line."""
+    blocks = []
+    current = []
+    for line in content.split('\n'):
+        if line.startswith('#') and current:
+            blocks.append(current)
+            current = []
+        current.append(line)
+    if current:
+        blocks.append(current)
+    return blocks
+
+
+def _split_paragraphs(lines):
+    """Group lines into paragraphs separated by blank lines."""
+    paragraphs = []
+    current = []
+    for line in lines:
+        if line.strip():
+            current.append(line)
+        elif current:
+            paragraphs.append(current)
+            current = []
+    if current:
+        paragraphs.append(current)
+    return paragraphs
+
+
+class Deduplicator:
+    """
+    Track text already emitted in a stack and drop repeats of it.
+    
+    Whole heading blocks (such as a repeated "## Workflow" section),
+    paragraphs and individual sentences are fingerprinted with a hash of
+    their normalized text, so each unit costs one set lookup no matter how
+    many prompts came before it. The first occurrence of a unit is kept.
+    """
+    
+    def __init__(self):
+        self.seen_blocks = set()
+        self.seen_paragraphs = set()
+        self.seen_sentences = set()
+        self.removed_blocks = 0
+        self.removed_paragraphs = 0
+        self.removed_sentences = 0
+    
+    def _dedupe_line(self, line):
+        """Drop sentences of a line that were already seen."""
+        sentences = SENTENCE_SPLIT_PATTERN.split(line.strip())
+        kept = []
+        for sentence in sentences:
+            sentence_hash, word_count = _fingerprint(sentence)
+            if word_count >= MIN_SENTENCE_WORDS:
+                if sentence_hash in self.seen_sentences:
+                    self.removed_sentences += 1
+                    continue
+                self.seen_sentences.add(sentence_hash)
+            kept.append(sentence)
+        
+        if len(kept) == len(sentences):
+            return line
+        if not kept:
+            return None
+        
+        # Keep the line's indentation and bullet marker
+        bullet = BULLET_PATTERN.match(line)
+        first = kept[0]
+        if bullet and not BULLET_PATTERN.match(first):
+            first = bullet.group(0) + first
+        return ' '.join([first] + kept[1:])
+    
+    def _dedupe_paragraph(self, paragraph):
+        """Drop a repeated paragraph, or the repeated sentences within it."""
+        # Headings are structure, not content
+        if len(paragraph) == 1 and paragraph[0].startswith('#'):
+            return paragraph
+        
+        paragraph_hash, _ = _fingerprint(' '.join(paragraph))
+        if paragraph_hash in self.seen_paragraphs:
+            self.removed_paragraphs += 1
+            return None
+        self.seen_paragraphs.add(paragraph_hash)
+        
+        lines = []
+        for line in paragraph:
+            if line.startswith('#'):
+                lines.append(line)
+                continue
+            line = self._dedupe_line(line)
+            if line is not None:
+                lines.append(line)
+        return lines or None
+    
+    def dedupe(self, content):
+        """Return the content with everything seen in earlier content removed."""
+        removed_before = self.removed_blocks + self.removed_paragraphs + self.removed_sentences
+        output_blocks = []
+        
+        for block in _split_blocks(content):
+            has_heading = block[0].startswith('#')
+            if has_heading:
+                block_hash, _ = _fingerprint('\n'.join(block))
+                if block_hash in self.seen_blocks:
+                    self.removed_blocks += 1
+                    continue
+                self.seen_blocks.add(block_hash)
+            
+            paragraphs = []
+            for paragraph in _split_paragraphs(block):
+                paragraph = self._dedupe_paragraph(paragraph)
+                if paragraph:
+                    paragraphs.append('\n'.join(paragraph))
+            
+            # A heading whose whole body was removed goes with it
+            if has_heading and paragraphs == [block[0]] and len(_split_paragraphs(block)) > 1:
+                continue
+            if paragraphs:
+                output_blocks.append('\n\n'.join(paragraphs))
+        
+        # Leave content without repeats exactly as written
+        if self.removed_blocks + self.removed_paragraphs + self.removed_sentences == removed_before:
+            return content
+        return '\n\n'.join(output_blocks)
+    
+    def stats(self):
+        """Return how many blocks, paragraphs and sentences were removed."""
+        return {
+            "blocks_removed": self.removed_blocks,
+            "paragraphs_removed": self.removed_paragraphs,
+            "sentences_removed": self.removed_sentences
+        }
+
+
+def deduplicate_contents(contents):
+    """
+    Deduplicate a sequence of prompt contents in order.
+    
+    Returns:
+        A tuple of (deduplicated contents, removal counts)
+    """
+    deduplicator = Deduplicator()
+    return [deduplicator.dedupe(content) for content in contents], deduplicator.stats()
@@ -0,0 +1,451 @@
+#!/usr/bin/env python3
+"""
+Compiled binary prompt libraries with memory-mapped, lazily decoded content.
+
+Layout (all integers little-endian):
+    
+    header          magic, format version, prompt count, library hash and
+                    the offsets of the sections below
+    records         one fixed-size record per prompt, in library order
+    id index        record numbers of the first prompt for each ID, sorted
+                    by ID
+    members         record numbers listed by the category and subcategory
+                    tables, in library order
+    table           small JSON object with the category and subcategory
+                    tables and the duplicate IDs
+    strings         UTF-8 IDs, titles, categories, subcategories, file paths
+                    and the JSON of any other prompt fields
+    content         UTF-8 prompt content and minified content
+
+Opening a library only reads the header and the category table, so start-up
+cost does not grow with the number of prompts. Everything else is read from
+the memory map on access, and the pages are shared by every process that has
+the file open.
+"""
+import os
+import json
+import mmap
+import struct
+import hashlib
+from collections.abc import Mapping
+
+
+MAGIC = b'PRMTLIB\0'
+FORMAT_VERSION = 1
+
+HEADER = struct.Struct('<8sII32s7Q')
+
+# id, title, category, subcategory, file_path and extra fields as
+# (offset, length) into the strings section, then content and
+# content_min as (offset, length) into the content section
+RECORD = struct.Struct('<12IQIQI')
+INDEX_ENTRY = struct.Struct('<I')
+
+# Length markers for fields that are missing or None
+ABSENT = 0xFFFFFFFF
+NULL = 0xFFFFFFFE
+
+STRING_FIELDS = ('id', 'title', 'category', 'subcategory', 'file_path')
+CONTENT_FIELDS = ('content', 'content_min')
+FIELD_ORDER = ('id', 'title', 'content', 'category', 'subcategory', 'file_path', 'content_min')
+
+# Position of each field's (offset, length) pair in a record, and whether it
+# lives in the content section
+FIELD_LAYOUT = tuple(
+    (key, 12 + CONTENT_FIELDS.index(key) * 2, True) if key in CONTENT_FIELDS
+    else (key, STRING_FIELDS.index(key) * 2, False)
+    for key in FIELD_ORDER
+)
+
+
+def compute_library_hash(prompts):
+    """Compute the content hash identifying a library version."""
+    # Prompt records and other mappings hash like the equivalent dicts
+    serialized = json.dumps(prompts, sort_keys=True, ensure_ascii=False, default=dict)
+    return hashlib.sha256(serialized.encode('utf-8')).hexdigest()
+
+
+def is_library_file(path):
+    """Check whether a file is a compiled prompt library."""
+    try:
+        with open(path, 'rb') as f:
+            return f.read(len(MAGIC)) == MAGIC
+    except OSError:
+        return False
+
+
+def load_prompts(path, keep_file_paths=True):
+    """
+    Load prompts from a JSON file or a compiled library.
+    
+    Args:
+        path: Path of the JSON file or compiled library
+        keep_file_paths: Whether the prompts of a compiled library include
+            their file_path field
+    
+    Returns:
+        A list of prompt dictionaries, or a PromptLibrary for compiled files
+    """
+    if is_library_file(path):
+        return PromptLibrary(path, keep_file_paths=keep_file_paths)
+    
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def _add_blob(blob, value):
+    """Append a field value to a section and return its (offset, length)."""
+    if value is None:
+        return 0, NULL
+    data = value.encode('utf-8')
+    offset = len(blob)
+    blob += data
+    return offset, len(data)
+
+
+def encode_library(prompts):
+    """
+    Encode prompts in the compiled library format.
+    
+    Args:
+        prompts: List of prompt dictionaries, in library order
+    
+    Returns:
+        The sections of the library, in order. Joined, they are the bytes
+        write_library writes.
+    """
+    strings = bytearray()
+    content = bytearray()
+    records = bytearray()
+    first_by_id = {}
+    duplicate_ids = []
+    categories = {}
+    groups = {}
+    
+    for number, prompt in enumerate(prompts):
+        fields = []
+        for field in STRING_FIELDS:
+            fields.extend(_add_blob(strings, prompt[field]) if field in prompt else (0, ABSENT))
+        
+        extra = {key: value for key, value in prompt.items() if key not in FIELD_ORDER}
+        fields.extend(_add_blob(strings, json.dumps(extra, ensure_ascii=False)) if extra else (0, ABSENT))
+        
+        for field in CONTENT_FIELDS:
+            fields.extend(_add_blob(content, prompt[field]) if field in prompt else (0, ABSENT))
+        records += RECORD.pack(*fields)
+        
+        prompt_id = prompt['id']
+        if prompt_id in first_by_id:
+            if prompt_id not in duplicate_ids:
+                duplicate_ids.append(prompt_id)
+        else:
+            first_by_id[prompt_id] = number
+        
+        categories.setdefault(prompt['category'], []).append(number)
+        groups.setdefault((prompt['category'], prompt.get('subcategory')), []).append(number)
+    
+    # Sort the ID index by encoded ID so lookups can bisect over bytes
+    id_index = bytearray()
+    for prompt_id in sorted(first_by_id, key=lambda i: i.encode('utf-8')):
+        id_index += INDEX_ENTRY.pack(first_by_id[prompt_id])
+    
+    members = bytearray()
+    table = {"categories": [], "groups": [], "duplicate_ids": duplicate_ids}
+    for category, numbers in categories.items():
+        table['categories'].append([category, len(members) // INDEX_ENTRY.size, len(numbers)])
+        members += struct.pack(f'<{len(numbers)}I', *numbers)
+    for (category, subcategory), numbers in groups.items():
+        table['groups'].append([category, subcategory, len(members) // INDEX_ENTRY.size, len(numbers)])
+        members += struct.pack(f'<{len(numbers)}I', *numbers)
+    table_data = json.dumps(table, ensure_ascii=False).encode('utf-8')
+    
+    records_offset = HEADER.size
+    id_index_offset = records_offset + len(records)
+    members_offset = id_index_offset + len(id_index)
+    table_offset = members_offset + len(members)
+    strings_offset = table_offset + len(table_data)
+    content_offset = strings_offset + len(strings)
+    
+    header = HEADER.pack(
+        MAGIC, FORMAT_VERSION, len(prompts),
+        bytes.fromhex(compute_library_hash(prompts)),
+        records_offset, id_index_offset, members_offset,
+        table_offset, len(table_data), strings_offset, content_offset
+    )
+    
+    return header, records, id_index, members, table_data, strings, content
+
+
+def write_library(prompts, output_file):
+    """
+    Write prompts to a compiled library file.
+    
+    Args:
+        prompts: List of prompt dictionaries, in library order
+        output_file: Path of the library to write
+    """
+    sections = encode_library(prompts)
+    
+    # Replace the file atomically, since other processes may have the old
+    # version mapped and truncating it in place would break them
+    temp_file = f"{output_file}.tmp{os.getpid()}"
+    with open(temp_file, 'wb') as f:
+        for section in sections:
+            f.write(section)
+    os.replace(temp_file, output_file)
+
+
+class LazyPrompt(Mapping):
+    """
+    Read-only prompt dictionary backed by a compiled library.
+    
+    Fields are decoded from the memory map each time they are read, so a
+    prompt's content only costs memory while it is being used. The fields
+    outside the fixed record layout, such as the display title, are small
+    and share one JSON object, which is decoded once on first access. The
+    file_path field is left out if the library was opened without file paths.
+    """
+    
+    __slots__ = ('_library', '_record', '_extras')
+    
+    def __init__(self, library, number):
+        self._library = library
+        self._record = RECORD.unpack_from(library._map, library._records_offset + number * RECORD.size)
+        self._extras = None
+    
+    def _extra(self):
+        """The fields stored outside the fixed record layout."""
+        if self._extras is None:
+            offset, length = self._record[10:12]
+            self._extras = {} if length == ABSENT else json.loads(self._library._string(offset, length))
+        return self._extras
+    
+    def __getitem__(self, key):
+        if key == 'file_path' and not self._library.keep_file_paths:
+            raise KeyError(key)
+        if key in STRING_FIELDS:
+            position = STRING_FIELDS.index(key) * 2
+            offset, length = self._record[position:position + 2]
+            if length != ABSENT:
+                return self._library._string(offset, length)
+        elif key in CONTENT_FIELDS:
+            position = 12 + CONTENT_FIELDS.index(key) * 2
+            offset, length = self._record[position:position + 2]
+            if length != ABSENT:
+                return self._library._content(offset, length)
+        else:
+            extra = self._extra()
+            if key in extra:
+                return extra[key]
+        raise KeyError(key)
+    
+    def __contains__(self, key):
+        if key == 'file_path' and not self._library.keep_file_paths:
+            return False
+        if key in STRING_FIELDS:
+            return self._record[STRING_FIELDS.index(key) * 2 + 1] != ABSENT
+        if key in CONTENT_FIELDS:
+            return self._record[12 + CONTENT_FIELDS.index(key) * 2 + 1] != ABSENT
+        return key in self._extra()
+    
+    def __iter__(self):
+        for key in FIELD_ORDER:
+            if key in self:
+                yield key
+        yield from self._extra()
+    
+    def __len__(self):
+        return sum(1 for _ in self)
+    
+    def __repr__(self):
+        return f"LazyPrompt({self['id']!r})"
+    
+    def to_dict(self):
+        """Decode every field into a plain dictionary in one pass."""
+        library = self._library
+        record = self._record
+        fields = {}
+        for key, position, is_content in FIELD_LAYOUT:
+            length = record[position + 1]
+            if length != ABSENT and (key != 'file_path' or library.keep_file_paths):
+                decode = library._content if is_content else library._string
+                fields[key] = decode(record[position], length)
+        fields.update(self._extra())
+        return fields
+
+
+class _RecordList:
+    """Sequence of prompts for a run of record numbers in the members section."""
+    
+    def __init__(self, library, start, count):
+        self._library = library
+        self._start = start
+        self._count = count
+    
+    def __len__(self):
+        return self._count
+    
+    def __iter__(self):
+        for position in range(self._count):
+            yield self[position]
+    
+    def __getitem__(self, position):
+        if not 0 <= position < self._count:
+            raise IndexError(position)
+        return self._library[self._library._member(self._start + position)]
+
+
+class _IdIndex(Mapping):
+    """Prompt lookup by ID, bisecting over the sorted ID index."""
+    
+    def __init__(self, library):
+        self._library = library
+    
+    def _find(self, prompt_id):
+        """Return the record number of the first prompt with an ID, or None."""
+        library = self._library
+        target = prompt_id.encode('utf-8')
+        low, high = 0, library._id_count
+        while low < high:
+            middle = (low + high) // 2
+            if library._record_id(library._id_entry(middle)) < target:
+                low = middle + 1
+            else:
+                high = middle
+        if low < library._id_count:
+            number = library._id_entry(low)
+            if library._record_id(number) == target:
+                return number
+        return None
+    
+    def __getitem__(self, prompt_id):
+        number = self._find(prompt_id) if isinstance(prompt_id, str) else None
+        if number is None:
+            raise KeyError(prompt_id)
+        return self._library[number]
+    
+    def __contains__(self, prompt_id):
+        return isinstance(prompt_id, str) and self._find(prompt_id) is not None
+    
+    def __iter__(self):
+        for position in range(self._library._id_count):
+            yield self._library[self._library._id_entry(position)]['id']
+    
+    def __len__(self):
+        return self._library._id_count
+
+
+class PromptLibrary:
+    """
+    Sequence of prompts in a memory-mapped compiled library.
+    
+    Behaves like the list of prompt dictionaries loaded from a JSON file,
+    with each prompt a LazyPrompt. The category tables and the ID index are
+    exposed so PromptCombiner can use them without building its own.
+    """
+    
+    def __init__(self, path=None, buffer=None, keep_file_paths=True):
+        """
+        Open a compiled library from a file or from a buffer holding one.
+        
+        Args:
+            path: Path of a library file, which is memory-mapped read-only
+            buffer: Read-only memoryview of a library, such as a shared
+                memory segment. Prompts are read from it without copying.
+            keep_file_paths: Include each prompt's file_path field, as
+                PromptCombiner's keep_file_paths does for JSON libraries
+        
+        Raises:
+            ValueError: If the data is not a compiled library of a supported
+                version
+        """
+        self.path = path
+        self.keep_file_paths = keep_file_paths
+        if buffer is not None:
+            self._map = buffer
+        else:
+            with open(path, 'rb') as f:
+                self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            
+            # Lookups jump around the file, so reading ahead only wastes memory
+            if hasattr(mmap, 'MADV_RANDOM'):
+                self._map.madvise(mmap.MADV_RANDOM)
+        
+        source = f"'{path}'" if path else "The buffer"
+        if len(self._map) < HEADER.size:
+            raise ValueError(f"{source} is not a compiled prompt library.")
+        (magic, version, self._count, library_hash, self._records_offset, self._id_index_offset,
+         self._members_offset, table_offset, table_length, self._strings_offset,
+         self._content_offset) = HEADER.unpack_from(self._map, 0)
+        if magic != MAGIC:
+            raise ValueError(f"{source} is not a compiled prompt library.")
+        if version != FORMAT_VERSION:
+            raise ValueError(f"Unsupported prompt library version {version} in {source}.")
+        
+        self.library_hash = library_hash.hex()
+        self._id_count = (self._members_offset - self._id_index_offset) // INDEX_ENTRY.size
+        table = json.loads(str(self._map[table_offset:table_offset + table_length], 'utf-8'))
+        
+        self.duplicate_ids = table['duplicate_ids']
+        self.by_id = _IdIndex(self)
+        self.by_category = {
+            category: _RecordList(self, start, count)
+            for category, start, count in table['categories']
+        }
+        self.by_subcategory = {
+            (category, subcategory): _RecordList(self, start, count)
+            for category, subcategory, start, count in table['groups']
+        }
+    
+    def _string(self, offset, length):
+        """Decode a field from the strings section."""
+        if length == NULL:
+            return None
+        start = self._strings_offset + offset
+        return str(self._map[start:start + length], 'utf-8')
+    
+    def _content(self, offset, length):
+        """Decode a field from the content section."""
+        if length == NULL:
+            return None
+        start = self._content_offset + offset
+        return str(self._map[start:start + length], 'utf-8')
+    
+    def _record_id(self, number):
+        """Read the encoded ID of a record without decoding it."""
+        offset, length = struct.unpack_from('<II', self._map, self._records_offset + number * RECORD.size)
+        start = self._strings_offset + offset
+        return bytes(self._map[start:start + length])
+    
+    def _id_entry(self, position):
+        """Read a record number from the ID index."""
+        return INDEX_ENTRY.unpack_from(self._map, self._id_index_offset + position * INDEX_ENTRY.size)[0]
+    
+    def _member(self, position):
+        """Read a record number from the members section."""
+        return INDEX_ENTRY.unpack_from(self._map, self._members_offset + position * INDEX_ENTRY.size)[0]
+    
+    def __len__(self):
+        return self._count
+    
+    def __iter__(self):
+        for number in range(self._count):
+            yield LazyPrompt(self, number)
+    
+    def __getitem__(self, number):
+        if number < 0:
+            number += self._count
+        if not 0 <= number < self._count:
+            raise IndexError(number)
+        return LazyPrompt(self, number)
+    
+    def to_list(self):
+        """Decode every prompt into a plain dictionary."""
+        return [prompt.to_dict() for prompt in self]
+    
+    def close(self):
+        """Release the memory map or buffer. Prompts read from the library become unusable."""
+        if isinstance(self._map, memoryview):
+            self._map.release()
+        else:
+            self._map.close()
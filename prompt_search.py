@@ -0,0 +1,323 @@
+#!/usr/bin/env python3
+"""
+Full-text search over system prompts.
+
+Queries return the exact BM25 top results without scoring every matching
+document. Each term's postings are kept in two orders: by weight, which a
+query walks from the top, and by document, which answers a document's
+exact weight for a term with a binary search. Following Fagin's threshold
+algorithm, every document reached through the weight order is scored, and
+the walk stops once no document further down can beat the current top
+results. Scoring a document stops early as well once the weights still
+missing cannot lift it into the top results.
+"""
+import json
+import math
+import os
+import re
+import heapq
+from array import array
+from bisect import bisect_left
+from collections import Counter
+
+
+INDEX_VERSION = 2
+
+# Term frequency multipliers for the indexed prompt fields
+FIELD_WEIGHTS = {
+    'title': 3.0,
+    'category': 2.0,
+    'subcategory': 2.0,
+    'content': 1.0
+}
+
+TOKEN_PATTERN = re.compile(r'[a-z0-9]+')
+
+# Prefix expansions remembered per index
+EXPANSION_CACHE_SIZE = 4096
+
+
+def tokenize(text):
+    """Split text into lowercase alphanumeric terms."""
+    return TOKEN_PATTERN.findall(text.lower()) if text else []
+
+
+def get_index_path(library_file):
+    """
+    Get the path of the search index stored next to a prompt library.
+    
+    The library's extension is kept, so the JSON and compiled versions of
+    a library do not overwrite each other's index.
+    """
+    return f"{library_file}.search.json"
+
+
+class TermPostings:
+    """The documents containing a term with their BM25 weights, in document and in weight order."""
+    
+    __slots__ = ('docs', 'weights', 'impact_docs', 'impact_weights')
+    
+    def __init__(self, docs, weights, order):
+        """
+        Args:
+            docs: Document numbers in ascending order
+            weights: The weight of the term in each of these documents
+            order: Positions into docs, highest weight first
+        """
+        self.docs = array('i', docs)
+        self.weights = array('d', weights)
+        self.impact_docs = array('i', map(self.docs.__getitem__, order))
+        self.impact_weights = array('d', map(self.weights.__getitem__, order))
+    
+    def __len__(self):
+        return len(self.docs)
+    
+    def weight(self, doc):
+        """The weight of the term in a document, or 0.0 if it does not contain it."""
+        i = bisect_left(self.docs, doc)
+        if i < len(self.docs) and self.docs[i] == doc:
+            return self.weights[i]
+        return 0.0
+    
+    def by_impact(self):
+        """Iterate over (weight, document) pairs, highest weight first."""
+        return zip(self.impact_weights, self.impact_docs)
+
+
+class SearchIndex:
+    """Inverted index over prompts with exact BM25 ranking and prefix matching."""
+    
+    def __init__(self, doc_count=0, postings=None, library_hash=None):
+        """
+        Create an index from precomputed postings.
+        
+        Args:
+            doc_count: Number of indexed prompts
+            postings: Dictionary mapping each term to its TermPostings
+            library_hash: Hash of the library the index was built from
+        """
+        self.doc_count = doc_count
+        self.postings = postings or {}
+        self.library_hash = library_hash
+        self.terms = sorted(self.postings)
+        self._expansions = {}
+    
+    @classmethod
+    def build(cls, prompts, library_hash=None, k1=1.2, b=0.75):
+        """
+        Build an index for a list of prompts.
+        
+        Every posting stores its final BM25 weight, so a query only has to add
+        up precomputed numbers.
+        """
+        term_frequencies = []
+        doc_lengths = []
+        document_frequency = {}
+        
+        for prompt in prompts:
+            frequencies = {}
+            for field, weight in FIELD_WEIGHTS.items():
+                for term, count in Counter(tokenize(prompt.get(field))).items():
+                    frequencies[term] = frequencies.get(term, 0.0) + count * weight
+            
+            term_frequencies.append(frequencies)
+            doc_lengths.append(sum(frequencies.values()))
+            for term in frequencies:
+                document_frequency[term] = document_frequency.get(term, 0) + 1
+        
+        doc_count = len(term_frequencies)
+        average_length = (sum(doc_lengths) / doc_count) if doc_count else 0.0
+        
+        idf = {
+            term: math.log(1 + (doc_count - df + 0.5) / (df + 0.5))
+            for term, df in document_frequency.items()
+        }
+        # Documents are visited in order, so every list ends up sorted by document
+        docs = {term: [] for term in document_frequency}
+        weights = {term: [] for term in document_frequency}
+        for doc, frequencies in enumerate(term_frequencies):
+            length_norm = k1 * (1 - b + b * doc_lengths[doc] / average_length) if average_length else k1
+            for term, tf in frequencies.items():
+                docs[term].append(doc)
+                weights[term].append(idf[term] * tf * (k1 + 1) / (tf + length_norm))
+        
+        postings = {
+            term: TermPostings(docs[term], weights[term], _impact_order(weights[term]))
+            for term in document_frequency
+        }
+        return cls(doc_count, postings, library_hash)
+    
+    def _expand(self, token, max_expansions):
+        """
+        Find the indexed terms a query token matches.
+        
+        The token itself comes first if it is indexed. Of the longer terms
+        it is a prefix of, those in the most documents are used, as the
+        likeliest completions.
+        """
+        key = (token, max_expansions)
+        matches = self._expansions.get(key)
+        if matches is not None:
+            return matches
+        
+        matches = [token] if token in self.postings else []
+        
+        # Single characters match too many terms to be useful as prefixes
+        if len(token) >= 2:
+            start = bisect_left(self.terms, token)
+            end = bisect_left(self.terms, token[:-1] + chr(ord(token[-1]) + 1), start)
+            completions = [term for term in self.terms[start:end] if term != token]
+            slots = max_expansions - len(matches)
+            if len(completions) > slots:
+                completions = heapq.nlargest(slots, completions, key=lambda term: len(self.postings[term]))
+            matches.extend(completions)
+        
+        if len(self._expansions) >= EXPANSION_CACHE_SIZE:
+            self._expansions.clear()
+        self._expansions[key] = matches
+        return matches
+    
+    def search(self, query, limit=10, max_expansions=32):
+        """
+        Rank documents for a query.
+        
+        Each query token matches indexed terms that equal it or start with
+        it. A document scores, for every token, the BM25 weight of its best
+        matching term, and token scores are summed. The results are the
+        exact top documents by that score.
+        
+        Args:
+            query: Free-text query
+            limit: Maximum number of results
+            max_expansions: Maximum number of terms a token can match
+        
+        Returns:
+            A list of (document number, score) tuples, best first
+        """
+        tokens = []
+        for token in set(tokenize(query)):
+            terms = self._expand(token, max_expansions)
+            if terms:
+                tokens.append([self.postings[term] for term in terms])
+        if not tokens or limit <= 0:
+            return []
+        # Tokens with fewer terms are cheaper to look up, so they are scored first
+        tokens.sort(key=len)
+        
+        # Walk each token's postings from the highest weight down
+        streams = [
+            lists[0].by_impact() if len(lists) == 1 else heapq.merge(*(p.by_impact() for p in lists), reverse=True)
+            for lists in tokens
+        ]
+        
+        # Unread postings weigh at most the next weight of each stream. The
+        # stream with the highest next weight is read first, which lowers
+        # that bound fastest and leaves long lists of light terms unread.
+        frontier = [0.0] * len(streams)
+        heads = []
+        for i, stream in enumerate(streams):
+            posting = next(stream, None)
+            if posting is not None:
+                frontier[i] = posting[0]
+                heads.append((-posting[0], i, posting[1]))
+        heapq.heapify(heads)
+        
+        seen = set()
+        top = []
+        while heads:
+            # No unseen document can score more than the sum of the frontier
+            bound = sum(frontier)
+            if len(top) == limit and top[0][0] >= bound:
+                break
+            
+            weight, i, doc = heads[0]
+            posting = next(streams[i], None)
+            if posting is None:
+                frontier[i] = 0.0
+                heapq.heappop(heads)
+            else:
+                frontier[i] = posting[0]
+                heapq.heapreplace(heads, (-posting[0], i, posting[1]))
+            
+            if doc in seen:
+                continue
+            seen.add(doc)
+            
+            # The first posting of a document is its best match for the
+            # token, and it was not reached through the other tokens, so
+            # their weights in it are at most their frontier. Stop adding
+            # them up once the document cannot reach the top results.
+            doc_score = -weight
+            remaining = bound - frontier[i]
+            for j, lists in enumerate(tokens):
+                if j == i:
+                    continue
+                if len(top) == limit and doc_score + remaining < top[0][0]:
+                    doc_score = None
+                    break
+                remaining -= frontier[j]
+                doc_score += lists[0].weight(doc) if len(lists) == 1 else max(p.weight(doc) for p in lists)
+            
+            if doc_score is None:
+                continue
+            if len(top) < limit:
+                heapq.heappush(top, (doc_score, -doc))
+            elif doc_score > top[0][0]:
+                heapq.heapreplace(top, (doc_score, -doc))
+        
+        return [(-doc, doc_score) for doc_score, doc in sorted(top, reverse=True)]
+    
+    def save(self, index_file):
+        """Write the index to a JSON file, replacing it in one step."""
+        data = {
+            "version": INDEX_VERSION,
+            "library_hash": self.library_hash,
+            "doc_count": self.doc_count,
+            "postings": {
+                term: [
+                    term_postings.docs.tolist(),
+                    [round(weight, 6) for weight in term_postings.weights],
+                ]
+                for term, term_postings in self.postings.items()
+            }
+        }
+        temp_file = f"{index_file}.tmp{os.getpid()}"
+        try:
+            with open(temp_file, 'w', encoding='utf-8') as f:
+                f.write(json.dumps(data, separators=(',', ':')))
+            os.replace(temp_file, index_file)
+        except BaseException:
+            try:
+                os.remove(temp_file)
+            except OSError:
+                pass
+            raise
+    
+    @classmethod
+    def load(cls, index_file, library_hash=None):
+        """
+        Load an index from a JSON file.
+        
+        Returns:
+            The index, or None if the file is missing, unreadable, or was
+            built for a different library version
+        """
+        try:
+            with open(index_file, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return None
+        
+        if data.get('version') != INDEX_VERSION or data.get('library_hash') != library_hash:
+            return None
+        
+        postings = {
+            term: TermPostings(docs, weights, _impact_order(weights))
+            for term, (docs, weights) in data['postings'].items()
+        }
+        return cls(data['doc_count'], postings, library_hash)
+
+
+def _impact_order(weights):
+    """Positions of the weights from highest to lowest, ties in document order."""
+    return sorted(range(len(weights)), key=weights.__getitem__, reverse=True) if len(weights) > 1 else [0]
@@ -0,0 +1,381 @@
+#!/usr/bin/env python3
+"""
+HTTP service for listing, searching and combining system prompts.
+
+Endpoints:
+    GET  /prompts?category=&subcategory=   prompt summaries
+    GET  /prompts/<id>                     one prompt
+    GET  /search?q=&limit=                 ranked search results
+    GET  /combine?ids=a,b&title=&max_tokens=&trim=1&dedupe=1
+                                           combined prompt as Markdown
+    POST /combine                          the same, with a JSON body
+    POST /combine/batch                    {"requests": [...]} of combine
+                                           bodies, answered in order
+
+Connections are kept alive between requests. Every GET response carries a
+strong ETag derived from the library hash and the request, so clients and
+reverse proxies can cache responses and revalidate them with
+If-None-Match.
+
+A background task checks for library changes and reloads the library,
+including its search index, in a worker thread. Requests only read the
+current snapshot, so a reload never stalls the event loop.
+"""
+import json
+import asyncio
+import hashlib
+from urllib.parse import urlsplit, parse_qs, unquote
+from prompt_combiner import PromptCombiner, TokenBudgetExceeded
+
+
+# Seconds an idle keep-alive connection stays open
+KEEP_ALIVE_TIMEOUT = 15
+
+# Seconds between checks for a changed library
+REFRESH_INTERVAL = 1.0
+
+MAX_BODY_BYTES = 1024 * 1024
+MAX_HEADER_BYTES = 64 * 1024
+
+STATUS_TEXT = {
+    200: "OK",
+    304: "Not Modified",
+    400: "Bad Request",
+    404: "Not Found",
+    405: "Method Not Allowed",
+    413: "Payload Too Large",
+    422: "Unprocessable Entity",
+    431: "Request Header Fields Too Large",
+    500: "Internal Server Error",
+    501: "Not Implemented"
+}
+
+
+class HTTPError(Exception):
+    """An error answered with a JSON error body."""
+    
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+        self.message = message
+
+
+class RequestFramingError(HTTPError):
+    """A request that could not be read in full, after which the connection is unusable."""
+
+
+def _flag(value):
+    """Interpret a query string or JSON flag."""
+    if isinstance(value, str):
+        return value.lower() in ("1", "true", "yes", "on")
+    return bool(value)
+
+
+def _summary(prompt):
+    """The fields of a prompt listed without its content."""
+    return {
+        "id": prompt['id'],
+        "title": prompt.get('title'),
+        "category": prompt['category'],
+        "subcategory": prompt.get('subcategory')
+    }
+
+
+class PromptServer:
+    """Serves a prompt library over HTTP/1.1 with keep-alive."""
+    
+    def __init__(self, json_file, shared_library=None):
+        """
+        Load and index the library.
+        
+        Args:
+            json_file: Path of a JSON or compiled prompt library. It is
+                reloaded when its modification time or size changes.
+            shared_library: Name of a library published by 'cli.py publish'
+                to attach to instead of loading json_file
+        """
+        self.json_file = json_file
+        self.combiner = PromptCombiner(json_file=json_file, shared_library=shared_library)
+        self.combiner.get_search_index()
+    
+    def refresh(self):
+        """
+        Reload the library if its file changed or a new generation was published.
+        
+        Blocks while loading, so the server calls it from a worker thread.
+        
+        Returns:
+            True if the library was reloaded
+        """
+        # Swaps in a new snapshot; responses being built keep the old one
+        if not self.combiner.refresh():
+            return False
+        self.combiner.get_search_index()
+        return True
+    
+    async def _refresh_periodically(self):
+        """Reload the library off the event loop whenever it changes."""
+        while True:
+            await asyncio.sleep(REFRESH_INTERVAL)
+            try:
+                await asyncio.to_thread(self.refresh)
+            except Exception as e:
+                print(f"Error reloading the library: {e}", flush=True)
+    
+    def _builds_search_index(self, target):
+        """Whether answering a request would first build the current snapshot's search index."""
+        return (self.combiner.snapshot.search_index is None
+                and urlsplit(target).path.rstrip('/') == '/search')
+    
+    def _etag(self, *parts):
+        """Strong ETag for a response derived from the library and the request."""
+        key = json.dumps([self.combiner.library_hash, *parts], ensure_ascii=False)
+        return f'"{hashlib.sha256(key.encode("utf-8")).hexdigest()[:32]}"'
+    
+    def _combine_options(self, params):
+        """
+        Validate combine parameters from a query string or JSON body.
+        
+        Returns:
+            A tuple of (prompt IDs, title, max_tokens, trim, dedupe)
+        """
+        ids = params.get('ids')
+        if isinstance(ids, str):
+            ids = [prompt_id.strip() for prompt_id in ids.split(',') if prompt_id.strip()]
+        if not isinstance(ids, list) or not ids or not all(isinstance(i, str) for i in ids):
+            raise HTTPError(400, "'ids' must be a non-empty list of prompt IDs.")
+        
+        max_tokens = params.get('max_tokens')
+        if max_tokens is not None:
+            try:
+                max_tokens = int(max_tokens)
+            except (TypeError, ValueError):
+                raise HTTPError(400, "'max_tokens' must be an integer.")
+        
+        title = params.get('title') or None
+        return ids, title, max_tokens, _flag(params.get('trim')), _flag(params.get('dedupe'))
+    
+    def _combine(self, options):
+        """Combine a validated selection."""
+        ids, title, max_tokens, trim, dedupe = options
+        try:
+            return self.combiner.combine_prompts(ids, title, max_tokens=max_tokens, trim=trim, dedupe=dedupe)
+        except TokenBudgetExceeded as e:
+            raise HTTPError(422, str(e))
+    
+    def dispatch(self, method, target, headers, body):
+        """
+        Answer a request.
+        
+        Returns:
+            A tuple of (status, content type, body bytes, ETag or None)
+        """
+        url = urlsplit(target)
+        path = url.path.rstrip('/') or '/'
+        query = {name: values[-1] for name, values in parse_qs(url.query).items()}
+        
+        combiner = self.combiner
+        
+        if method == 'POST':
+            try:
+                payload = json.loads(body.decode('utf-8')) if body else {}
+            except (UnicodeDecodeError, ValueError):
+                raise HTTPError(400, "Request body must be JSON.")
+            if not isinstance(payload, dict):
+                raise HTTPError(400, "Request body must be a JSON object.")
+            
+            if path == '/combine':
+                combined = self._combine(self._combine_options(payload))
+                return 200, "text/markdown; charset=utf-8", combined.encode('utf-8'), None
+            
+            if path == '/combine/batch':
+                requests = payload.get('requests')
+                if not isinstance(requests, list):
+                    raise HTTPError(400, "'requests' must be a list of combine requests.")
+                results = []
+                for request in requests:
+                    try:
+                        if not isinstance(request, dict):
+                            raise HTTPError(400, "Each request must be a JSON object.")
+                        options = self._combine_options(request)
+                        results.append({"prompt": self._combine(options), "etag": self._etag('combine', options)})
+                    except HTTPError as e:
+                        results.append({"error": e.message, "status": e.status})
+                return 200, "application/json", json.dumps({"results": results}).encode('utf-8'), None
+            
+            raise HTTPError(405 if path in ('/prompts', '/search') else 404, f"No POST handler for '{path}'.")
+        
+        if method not in ('GET', 'HEAD'):
+            raise HTTPError(405, f"Method {method} is not supported.")
+        
+        # The ETag only depends on the library and the request, so a
+        # matching If-None-Match is answered before doing any work
+        if path == '/combine':
+            options = self._combine_options(query)
+            etag = self._etag('combine', options)
+        else:
+            etag = self._etag(path, sorted(query.items()))
+        if etag in [tag.strip() for tag in headers.get('if-none-match', '').split(',')]:
+            return 304, None, b"", etag
+        
+        if path == '/combine':
+            return 200, "text/markdown; charset=utf-8", self._combine(options).encode('utf-8'), etag
+        
+        if path == '/prompts':
+            category = query.get('category')
+            if category and 'subcategory' in query:
+                prompts = combiner.get_prompts_by_subcategory(category, query['subcategory'] or None)
+            elif category:
+                prompts = combiner.get_prompts_by_category(category)
+            else:
+                prompts = combiner.prompts
+            data = [_summary(prompt) for prompt in prompts]
+        
+        elif path.startswith('/prompts/'):
+            prompt = combiner.get_prompt_by_id(unquote(path[len('/prompts/'):]))
+            if prompt is None:
+                raise HTTPError(404, "Prompt not found.")
+            data = dict(prompt)
+        
+        elif path == '/search':
+            try:
+                limit = int(query.get('limit', 10))
+            except ValueError:
+                raise HTTPError(400, "'limit' must be an integer.")
+            data = [
+                dict(_summary(prompt), score=round(score, 4))
+                for prompt, score in combiner.search(query.get('q', ''), limit)
+            ]
+        
+        else:
+            raise HTTPError(404, f"No handler for '{path}'.")
+        
+        return 200, "application/json", json.dumps(data, ensure_ascii=False).encode('utf-8'), etag
+    
+    async def _read_request(self, reader):
+        """
+        Read one request from a connection.
+        
+        Returns:
+            A tuple of (method, target, version, headers, body), or None when
+            the client closed the connection or stayed idle too long
+        """
+        try:
+            head = await asyncio.wait_for(reader.readuntil(b"\r\n\r\n"), KEEP_ALIVE_TIMEOUT)
+        except (asyncio.IncompleteReadError, asyncio.TimeoutError, ConnectionError):
+            return None
+        except asyncio.LimitOverrunError:
+            raise RequestFramingError(431, "Request headers are too large.")
+        
+        lines = head.decode('latin-1').split("\r\n")
+        try:
+            method, target, version = lines[0].split(" ")
+        except ValueError:
+            raise RequestFramingError(400, "Malformed request line.")
+        
+        headers = {}
+        for line in lines[1:]:
+            if line:
+                name, _, value = line.partition(":")
+                headers[name.strip().lower()] = value.strip()
+        
+        if 'chunked' in headers.get('transfer-encoding', '').lower():
+            raise RequestFramingError(501, "Chunked request bodies are not supported.")
+        try:
+            length = int(headers.get('content-length') or 0)
+        except ValueError:
+            raise RequestFramingError(400, "Invalid Content-Length.")
+        if length < 0:
+            raise RequestFramingError(400, "Invalid Content-Length.")
+        if length > MAX_BODY_BYTES:
+            raise RequestFramingError(413, "Request body is too large.")
+        body = await reader.readexactly(length) if length else b""
+        
+        return method.upper(), target, version, headers, body
+    
+    async def handle_connection(self, reader, writer):
+        """Serve requests on a connection until it closes."""
+        try:
+            while True:
+                keep_alive = True
+                etag = None
+                head_only = False
+                try:
+                    request = await self._read_request(reader)
+                    if request is None:
+                        break
+                    method, target, version, headers, body = request
+                    
+                    connection = headers.get('connection', '').lower()
+                    keep_alive = connection == 'keep-alive' if version == 'HTTP/1.0' else connection != 'close'
+                    head_only = method == 'HEAD'
+                    
+                    # The first search after a reload builds the index in a
+                    # thread, while the other connections are served
+                    if self._builds_search_index(target):
+                        response = await asyncio.to_thread(self.dispatch, method, target, headers, body)
+                    else:
+                        response = self.dispatch(method, target, headers, body)
+                    status, content_type, data, etag = response
+                except HTTPError as e:
+                    status, content_type = e.status, "application/json"
+                    data = json.dumps({"error": e.message}).encode('utf-8')
+                    # The rest of a request we could not read is unusable
+                    if isinstance(e, RequestFramingError):
+                        keep_alive = False
+                except Exception as e:
+                    status, content_type = 500, "application/json"
+                    data = json.dumps({"error": str(e)}).encode('utf-8')
+                
+                response_headers = [f"HTTP/1.1 {status} {STATUS_TEXT.get(status, '')}"]
+                if content_type:
+                    response_headers.append(f"Content-Type: {content_type}")
+                response_headers.append(f"Content-Length: {len(data)}")
+                if etag:
+                    response_headers.append(f"ETag: {etag}")
+                    response_headers.append("Cache-Control: no-cache")
+                response_headers.append("Connection: keep-alive" if keep_alive else "Connection: close")
+                
+                writer.write(("\r\n".join(response_headers) + "\r\n\r\n").encode('latin-1'))
+                if not head_only:
+                    writer.write(data)
+                await writer.drain()
+                
+                if not keep_alive:
+                    break
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+    
+    async def serve(self, host="127.0.0.1", port=8000, ready=None):
+        """
+        Accept connections until cancelled.
+        
+        Args:
+            host: Interface to listen on
+            port: Port to listen on, or 0 for any free port
+            ready: Optional callback receiving the bound (host, port)
+        """
+        server = await asyncio.start_server(self.handle_connection, host, port, limit=MAX_HEADER_BYTES)
+        if ready:
+            ready(server.sockets[0].getsockname()[:2])
+        refresher = asyncio.create_task(self._refresh_periodically())
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            refresher.cancel()
+
+
+def run_server(json_file, host="127.0.0.1", port=8000, shared_library=None):
+    """Serve a library over HTTP until interrupted."""
+    prompt_server = PromptServer(json_file, shared_library)
+    
+    def announce(address):
+        print(f"Serving {len(prompt_server.combiner.prompts)} prompts on http://{address[0]}:{address[1]}", flush=True)
+    
+    try:
+        asyncio.run(prompt_server.serve(host, port, announce))
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,306 @@
+#!/usr/bin/env python3
+"""
+Share one copy of a prompt library between the worker processes on a host.
+
+A publisher loads the library, encodes it in the compiled library format and
+copies it into a multiprocessing.shared_memory segment. Workers attach to the
+segment and read prompts straight out of it through a PromptLibrary, so the
+library is held in memory once per host however many workers use it.
+
+A small control segment with a fixed name says which data segment holds the
+current generation:
+
+    magic, layout version, publisher PID, sequence number, generation,
+    data size, library hash and the name of the data segment
+
+Publishing a new generation fills a new data segment before switching the
+control segment over. The sequence number is odd while the control segment
+is being written, and readers retry until they read the same even number
+before and after the fields. The previous data segment is unlinked straight
+away; workers still using it keep their mapping until they let go of it.
+"""
+import os
+import time
+import struct
+import hashlib
+import weakref
+from multiprocessing import shared_memory, resource_tracker
+from prompt_library import HEADER, PromptLibrary, encode_library, is_library_file, load_prompts
+
+
+SHARED_ENV = "PROMPT_COMBINER_SHARED"
+
+CONTROL_MAGIC = b'PRMTSHM\0'
+CONTROL_VERSION = 1
+
+# magic, version, publisher PID (0 once stopped), sequence, generation,
+# data size, library hash, data segment name
+CONTROL = struct.Struct('<8sIIQQQ32s64s')
+SEQUENCE = struct.Struct('<Q')
+SEQUENCE_OFFSET = 16
+
+# Attempts at reading a consistent control segment or attaching to a
+# generation that was replaced in the meantime
+RETRIES = 1000
+
+# Segments created by publishers in this process
+_created_segments = set()
+
+
+def get_shared_name(library_file):
+    """Get the default control segment name for a library file, unique per user and path."""
+    digest = hashlib.sha1(os.path.abspath(library_file).encode('utf-8')).hexdigest()[:10]
+    uid = os.getuid() if hasattr(os, 'getuid') else 0
+    return f"prompts-{uid}-{digest}"
+
+
+def _attach_segment(name):
+    """
+    Attach to an existing segment.
+    
+    Raises:
+        FileNotFoundError: If there is no segment with this name
+    """
+    try:
+        return shared_memory.SharedMemory(name, track=False)
+    except TypeError:
+        segment = shared_memory.SharedMemory(name)
+        # Before Python 3.13 attaching also registers the segment with the
+        # resource tracker, which would unlink it when this process exits.
+        # Segments created here stay registered for their publisher.
+        if name not in _created_segments:
+            resource_tracker.unregister(segment._name, 'shared_memory')
+        return segment
+
+
+def _create_segment(name, size):
+    """Create a segment, replacing one left over from a publisher that did not shut down cleanly."""
+    try:
+        segment = shared_memory.SharedMemory(name, create=True, size=size)
+    except FileExistsError:
+        stale = shared_memory.SharedMemory(name)
+        stale.close()
+        stale.unlink()
+        segment = shared_memory.SharedMemory(name, create=True, size=size)
+    _created_segments.add(name)
+    return segment
+
+
+def _unlink_segment(segment):
+    """Close and remove a segment created in this process."""
+    segment.close()
+    segment.unlink()
+    _created_segments.discard(segment.name)
+
+
+def _publisher_alive(pid):
+    """Check whether a publisher process is still running."""
+    if not pid:
+        return False
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def _release(view, segment):
+    """Unmap a data segment once the library reading it is gone."""
+    view.release()
+    segment.close()
+
+
+class SharedLibraryPublisher:
+    """Publishes generations of a library file in shared memory."""
+    
+    def __init__(self, library_file, name=None):
+        """
+        Create the control segment.
+        
+        Args:
+            library_file: JSON file or compiled library to publish
+            name: Control segment name, by default from get_shared_name()
+        
+        Raises:
+            RuntimeError: If another running publisher owns the name
+        """
+        self.library_file = library_file
+        self.name = name or get_shared_name(library_file)
+        self.generation = 0
+        self._segment = None
+        
+        # Take over from a publisher that did not shut down cleanly, and
+        # continue its generation numbers so names are not reused
+        try:
+            stale = _attach_segment(self.name)
+        except FileNotFoundError:
+            pass
+        else:
+            fields = CONTROL.unpack_from(stale.buf, 0)
+            stale.close()
+            if fields[0] == CONTROL_MAGIC and _publisher_alive(fields[2]):
+                raise RuntimeError(f"Process {fields[2]} is already publishing '{self.name}'.")
+            if fields[0] == CONTROL_MAGIC:
+                self.generation = fields[4]
+        
+        self._control = _create_segment(self.name, CONTROL.size)
+    
+    def _encode(self):
+        """Get the library file as compiled library sections."""
+        if is_library_file(self.library_file):
+            with open(self.library_file, 'rb') as f:
+                return [f.read()]
+        return encode_library(load_prompts(self.library_file))
+    
+    def _write_control(self, pid, generation, size, library_hash, segment_name):
+        """Update the control segment under the sequence number."""
+        buffer = self._control.buf
+        sequence = SEQUENCE.unpack_from(buffer, SEQUENCE_OFFSET)[0] | 1
+        SEQUENCE.pack_into(buffer, SEQUENCE_OFFSET, sequence)
+        CONTROL.pack_into(
+            buffer, 0, CONTROL_MAGIC, CONTROL_VERSION, pid, sequence,
+            generation, size, library_hash, segment_name.encode('utf-8')
+        )
+        SEQUENCE.pack_into(buffer, SEQUENCE_OFFSET, sequence + 1)
+    
+    def publish(self):
+        """
+        Publish the current contents of the library file as a new generation.
+        
+        Returns:
+            The new generation number
+        """
+        sections = self._encode()
+        size = sum(len(section) for section in sections)
+        generation = self.generation + 1
+        segment_name = f"{self.name}-{generation}"
+        
+        segment = _create_segment(segment_name, size)
+        offset = 0
+        for section in sections:
+            segment.buf[offset:offset + len(section)] = section
+            offset += len(section)
+        library_hash = HEADER.unpack_from(segment.buf, 0)[3]
+        
+        self._write_control(os.getpid(), generation, size, library_hash, segment_name)
+        
+        # Readers that attached to the previous generation keep their mapping
+        previous, self._segment = self._segment, segment
+        self.generation = generation
+        if previous is not None:
+            _unlink_segment(previous)
+        
+        return generation
+    
+    def close(self):
+        """Stop publishing. Workers keep the generation they have attached."""
+        if self._segment is not None:
+            self._write_control(0, self.generation, 0, b'', '')
+            _unlink_segment(self._segment)
+            self._segment = None
+        _unlink_segment(self._control)
+
+
+class SharedLibraryReader:
+    """Attaches to the generations published under a control segment name."""
+    
+    def __init__(self, name, keep_file_paths=True):
+        """
+        Attach to the control segment.
+        
+        Args:
+            name: Name the library is published under
+            keep_file_paths: Whether attached libraries include each
+                prompt's file_path field
+        
+        Raises:
+            FileNotFoundError: If nothing is published under the name
+        """
+        self.name = name
+        self.keep_file_paths = keep_file_paths
+        self._control = _attach_segment(name)
+    
+    def _read_control(self):
+        """Read a consistent copy of the control segment fields."""
+        buffer = self._control.buf
+        for _ in range(RETRIES):
+            sequence = SEQUENCE.unpack_from(buffer, SEQUENCE_OFFSET)[0]
+            if sequence % 2 == 0:
+                fields = CONTROL.unpack_from(buffer, 0)
+                if SEQUENCE.unpack_from(buffer, SEQUENCE_OFFSET)[0] == sequence:
+                    break
+            time.sleep(0.0001)
+        else:
+            raise RuntimeError(f"The control segment '{self.name}' is not being updated consistently.")
+        
+        magic, version = fields[:2]
+        if magic != CONTROL_MAGIC:
+            raise ValueError(f"'{self.name}' is not a shared prompt library.")
+        if version != CONTROL_VERSION:
+            raise ValueError(f"Unsupported shared library version {version} in '{self.name}'.")
+        return fields
+    
+    def _current(self):
+        """
+        Read the live control fields, following a publisher that restarted.
+        
+        Returns:
+            The control fields, or None if no publisher is running
+        """
+        fields = self._read_control()
+        if _publisher_alive(fields[2]):
+            return fields
+        
+        # The publisher stopped; a new one creates a new control segment
+        try:
+            control = _attach_segment(self.name)
+        except FileNotFoundError:
+            return None
+        self._control.close()
+        self._control = control
+        fields = self._read_control()
+        return fields if _publisher_alive(fields[2]) else None
+    
+    def generation(self):
+        """Get the current generation, or None if no publisher is running."""
+        fields = self._current()
+        return fields[4] if fields else None
+    
+    def attach(self):
+        """
+        Attach to the current generation.
+        
+        Returns:
+            A PromptLibrary reading the shared segment, with a generation
+            attribute. The segment is unmapped once the library and every
+            prompt read from it are gone.
+        
+        Raises:
+            FileNotFoundError: If no publisher is running
+        """
+        for _ in range(RETRIES):
+            fields = self._current()
+            if fields is None:
+                raise FileNotFoundError(f"Nothing is published under '{self.name}'.")
+            _, _, _, _, generation, size, library_hash, segment_name = fields
+            
+            try:
+                segment = _attach_segment(segment_name.rstrip(b'\0').decode('utf-8'))
+            except FileNotFoundError:
+                # Replaced between reading the control segment and attaching
+                continue
+            
+            view = segment.buf[:size].toreadonly()
+            library = PromptLibrary(buffer=view, keep_file_paths=self.keep_file_paths)
+            library.generation = generation
+            weakref.finalize(library, _release, view, segment)
+            if library.library_hash == library_hash.hex():
+                return library
+        
+        raise RuntimeError(f"Could not attach to a stable generation of '{self.name}'.")
+    
+    def close(self):
+        """Detach from the control segment."""
+        self._control.close()
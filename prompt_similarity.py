@@ -0,0 +1,221 @@
+#!/usr/bin/env python3
+"""
+Near-duplicate detection for transcripts sent through the same prompt stack.
+
+Each transcript is reduced to a MinHash signature over word shingles of its
+normalized text. Two signatures agree in a fraction of positions that
+estimates the Jaccard similarity of the two shingle sets, so re-dictations
+and lightly reworded texts land close together while unrelated texts do
+not.
+
+Signatures are stored next to the responses in the response cache file and
+indexed with locality-sensitive hashing: the signature is cut into bands,
+and each band is hashed to a bucket together with the stack hash. A lookup
+reads the few transcripts sharing at least one bucket with the query, one
+index seek per band, and verifies them against the full signature. Lookups
+therefore cost the same with millions of stored transcripts as with a few.
+"""
+import re
+import zlib
+import array
+import random
+import hashlib
+import unicodedata
+
+
+# Signature length; more permutations estimate similarity more precisely
+NUM_PERM = 64
+
+# Words per shingle
+SHINGLE_SIZE = 3
+
+DEFAULT_THRESHOLD = 0.85
+
+MERSENNE_PRIME = (1 << 61) - 1
+MAX_HASH = (1 << 32) - 1
+
+WORD_PATTERN = re.compile(r"\w+")
+
+# Fixed seed, since signatures are stored and compared across processes
+_rng = random.Random(20240501)
+PERMUTATIONS = [
+    (_rng.randrange(1, MERSENNE_PRIME), _rng.randrange(0, MERSENNE_PRIME))
+    for _ in range(NUM_PERM)
+]
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS signatures (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    stack_hash TEXT NOT NULL,
+    input_hash TEXT NOT NULL,
+    signature BLOB NOT NULL,
+    UNIQUE (stack_hash, input_hash)
+);
+CREATE TABLE IF NOT EXISTS lsh_buckets (
+    bucket INTEGER NOT NULL,
+    signature_id INTEGER NOT NULL,
+    PRIMARY KEY (bucket, signature_id)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS lsh_buckets_signature ON lsh_buckets (signature_id);
+CREATE TRIGGER IF NOT EXISTS responses_signature_delete AFTER DELETE ON responses BEGIN
+    DELETE FROM signatures WHERE stack_hash = OLD.stack_hash AND input_hash = OLD.input_hash;
+END;
+CREATE TRIGGER IF NOT EXISTS signatures_buckets_delete AFTER DELETE ON signatures BEGIN
+    DELETE FROM lsh_buckets WHERE signature_id = OLD.id;
+END;
+"""
+
+
+def shingles(text, size=SHINGLE_SIZE):
+    """
+    Get the set of word shingles of a text.
+    
+    Case, accents, punctuation and whitespace are ignored. Texts shorter
+    than one shingle are represented by their words.
+    """
+    text = unicodedata.normalize('NFKD', text.lower())
+    words = WORD_PATTERN.findall(text)
+    if len(words) < size:
+        return {" ".join(words)} if words else set()
+    return {" ".join(words[i:i + size]) for i in range(len(words) - size + 1)}
+
+
+def minhash(text):
+    """
+    Compute the MinHash signature of a text.
+    
+    Returns:
+        A list of NUM_PERM integers, or None for a text without words
+    """
+    hashes = [zlib.crc32(shingle.encode('utf-8')) for shingle in shingles(text)]
+    if not hashes:
+        return None
+    return [
+        min((a * h + b) % MERSENNE_PRIME for h in hashes) & MAX_HASH
+        for a, b in PERMUTATIONS
+    ]
+
+
+def similarity(signature, other):
+    """Estimate the Jaccard similarity of two texts from their signatures."""
+    return sum(1 for x, y in zip(signature, other) if x == y) / len(signature)
+
+
+def _false_probabilities(threshold, bands, rows, steps=100):
+    """Probabilities of missing a pair above the threshold and of checking a pair below it."""
+    false_positive = false_negative = 0.0
+    for i in range(steps):
+        s = (i + 0.5) / steps
+        candidate = 1 - (1 - s ** rows) ** bands
+        if s < threshold:
+            false_positive += candidate / steps
+        else:
+            false_negative += (1 - candidate) / steps
+    return false_positive, false_negative
+
+
+def lsh_parameters(threshold, num_perm=NUM_PERM):
+    """
+    Choose the number of bands and rows per band for a similarity threshold.
+    
+    Missed near-duplicates weigh more than extra candidates, which are
+    cheap to verify against the full signature.
+    
+    Returns:
+        A tuple of (bands, rows)
+    """
+    best = None
+    for bands in range(1, num_perm + 1):
+        rows = num_perm // bands
+        false_positive, false_negative = _false_probabilities(threshold, bands, rows)
+        error = 0.3 * false_positive + 0.7 * false_negative
+        if best is None or error < best[0]:
+            best = (error, bands, rows)
+    return best[1], best[2]
+
+
+class SimilarityIndex:
+    """LSH index of transcript signatures, stored in a response cache file."""
+    
+    def __init__(self, cache, threshold=DEFAULT_THRESHOLD):
+        """
+        Create the index tables in a response cache.
+        
+        Signatures and their bucket entries are removed together with their
+        responses when the cache expires or evicts them.
+        
+        Args:
+            cache: ResponseCache whose file holds the index
+            threshold: Minimum estimated Jaccard similarity of a near-duplicate
+        """
+        if not 0 < threshold <= 1:
+            raise ValueError("The similarity threshold must be between 0 and 1.")
+        
+        self.cache = cache
+        self.threshold = threshold
+        self.bands, self.rows = lsh_parameters(threshold)
+        self._connection = cache._connection
+        with cache._lock:
+            self._connection.executescript(f"BEGIN IMMEDIATE;{SCHEMA}COMMIT;")
+    
+    def _buckets(self, stack, signature):
+        """Hash each band of a signature, together with the stack, to a bucket."""
+        buckets = []
+        for band in range(self.bands):
+            values = signature[band * self.rows:(band + 1) * self.rows]
+            digest = hashlib.blake2b(digest_size=8)
+            digest.update(f"{stack}:{self.rows}:{band}:".encode('ascii'))
+            digest.update(array.array('I', values).tobytes())
+            buckets.append(int.from_bytes(digest.digest(), 'little', signed=True))
+        return buckets
+    
+    def find(self, stack, signature):
+        """
+        Find the stored transcript most similar to a signature under the same stack.
+        
+        Returns:
+            A tuple of (input hash, similarity) for the best match at or
+            above the threshold, or None
+        """
+        if signature is None:
+            return None
+        
+        buckets = self._buckets(stack, signature)
+        with self.cache._lock:
+            # Seek the buckets first; the stack check only filters the
+            # few candidates
+            rows = self._connection.execute(
+                "SELECT input_hash, signature, stack_hash FROM signatures WHERE id IN "
+                f"(SELECT signature_id FROM lsh_buckets WHERE bucket IN ({','.join('?' * len(buckets))}))",
+                buckets
+            ).fetchall()
+        
+        best = None
+        for text_hash, stored, stored_stack in rows:
+            if stored_stack != stack:
+                continue
+            score = similarity(signature, array.array('I', stored))
+            if score >= self.threshold and (best is None or score > best[1]):
+                best = (text_hash, score)
+        return best
+    
+    def add(self, stack, text_hash, signature):
+        """Index the signature of a transcript whose response is in the cache."""
+        if signature is None:
+            return
+        
+        with self.cache._lock, self.cache._transaction():
+            cursor = self._connection.execute(
+                "INSERT OR IGNORE INTO signatures (stack_hash, input_hash, signature) VALUES (?, ?, ?)",
+                (stack, text_hash, array.array('I', signature).tobytes())
+            )
+            if cursor.rowcount:
+                self._connection.executemany(
+                    "INSERT OR IGNORE INTO lsh_buckets (bucket, signature_id) VALUES (?, ?)",
+                    [(bucket, cursor.lastrowid) for bucket in self._buckets(stack, signature)]
+                )
+    
+    def count(self):
+        """Get the number of indexed transcripts."""
+        with self.cache._lock:
+            return self._connection.execute("SELECT COUNT(*) FROM signatures").fetchone()[0]
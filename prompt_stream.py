@@ -0,0 +1,527 @@
+#!/usr/bin/env python3
+"""
+Stream large collections of transcripts through a prompt stack.
+
+Transcripts are read lazily, in a deterministic order, from text files,
+directories, glob patterns, tar archives and JSONL files or stdin. Only a
+bounded window of them is read ahead of the requests in flight, and each
+result is written as soon as it completes, so memory stays flat however
+large the corpus is.
+
+A progress journal makes a run resumable after a crash or Ctrl+C. Since the
+input order is deterministic, the journal only records the position before
+which every input is finished, the few finished inputs past it, and how much
+of the JSONL output belonged to them. Rerunning the same command skips the
+finished inputs and cuts off output written after the last checkpoint, so
+every input appears in the output exactly once.
+"""
+import os
+import sys
+import json
+import time
+import fnmatch
+import tarfile
+import asyncio
+from prompt_transform import TransformError
+
+
+TAR_SUFFIXES = ('.tar', '.tar.gz', '.tgz', '.tar.bz2', '.tbz2', '.tar.xz', '.txz')
+
+# Files read from directories and tar archives
+DEFAULT_EXTENSIONS = ('.txt', '.md')
+
+# Seconds between journal checkpoints
+CHECKPOINT_INTERVAL = 1.0
+
+# Seconds between throughput reports
+DEFAULT_PROGRESS_INTERVAL = 10.0
+
+JOURNAL_VERSION = 1
+
+
+def input_kind(source, input_format="text"):
+    """
+    Classify an input argument.
+    
+    Args:
+        source: A path, a glob pattern or '-' for stdin
+        input_format: 'text' or 'jsonl', for stdin and files without a
+            .jsonl extension
+    
+    Returns:
+        'stdin', 'jsonl', 'directory', 'tar', 'glob' or 'file'
+    """
+    if source == "-":
+        return "jsonl" if input_format == "jsonl" else "stdin"
+    if os.path.isdir(source):
+        return "directory"
+    lower = source.lower()
+    if lower.endswith(TAR_SUFFIXES):
+        return "tar"
+    if lower.endswith('.jsonl') or (input_format == "jsonl" and os.path.exists(source)):
+        return "jsonl"
+    if not os.path.exists(source) and any(char in source for char in '*?['):
+        return "glob"
+    return "file"
+
+
+def _safe_relative_path(name):
+    """Turn an archive member or record ID into a relative path inside the output directory."""
+    parts = [part for part in name.replace('\\', '/').split('/') if part not in ('', '.', '..')]
+    return os.path.join(*parts) if parts else "unnamed"
+
+
+def _has_extension(name, extensions):
+    """Whether a file name ends in one of the extensions, or extensions is empty."""
+    return not extensions or name.lower().endswith(extensions)
+
+
+def _file_reader(path):
+    """A function reading a text file."""
+    def read():
+        with open(path, 'r', encoding='utf-8') as f:
+            return f.read()
+    return read
+
+
+def _walk_files(root):
+    """Yield the files under a directory in sorted order, listing one directory at a time."""
+    for entry in sorted(os.scandir(root), key=lambda entry: entry.name):
+        if entry.is_dir():
+            yield from _walk_files(entry.path)
+        elif entry.is_file():
+            yield entry.path
+
+
+def _match_parts(parts, pattern):
+    """Match path components against glob components, where '**' matches any number of them."""
+    if not pattern:
+        return not parts
+    if pattern[0] == '**':
+        return any(_match_parts(parts[i:], pattern[1:]) for i in range(len(parts) + 1))
+    return bool(parts) and fnmatch.fnmatchcase(parts[0], pattern[0]) and _match_parts(parts[1:], pattern[1:])
+
+
+def _iter_glob(pattern):
+    """
+    Yield the files matching a glob pattern in sorted order.
+    
+    Unlike glob.glob(), the matches are never collected into one list.
+    
+    Yields:
+        Tuples of (path, path relative to the pattern's fixed directory)
+    """
+    parts = pattern.replace(os.sep, '/').split('/')
+    fixed = next(i for i, part in enumerate(parts) if any(char in part for char in '*?['))
+    base = '/'.join(parts[:fixed]) or ('/' if pattern.startswith('/') else '.')
+    if not os.path.isdir(base):
+        return
+    for path in _walk_files(base):
+        relative = os.path.relpath(path, base)
+        if _match_parts(relative.split(os.sep), parts[fixed:]):
+            yield path, relative
+
+
+def _iter_tar(source, extensions):
+    """Yield the files of a tar archive in archive order, reading it as a stream."""
+    with tarfile.open(source, 'r|*') as archive:
+        for member in archive:
+            if not member.isfile() or not _has_extension(member.name, extensions):
+                continue
+            # Members can only be read before the stream moves past them
+            fileobj = archive.extractfile(member)
+            read = lambda fileobj=fileobj: fileobj.read().decode('utf-8')
+            yield f"{source}:{member.name}", _safe_relative_path(member.name), read
+
+
+def _iter_jsonl(stream, source):
+    """Yield the records of a JSONL stream with 'id' and 'text' fields."""
+    number = 0
+    for line in stream:
+        if not line.strip():
+            continue
+        number += 1
+        try:
+            record = json.loads(line)
+        except ValueError as e:
+            yield f"{source}:{number}", f"{number}.txt", _failure(f"Invalid JSON: {e}")
+            continue
+        if not isinstance(record, dict) or not isinstance(record.get('text'), str):
+            yield f"{source}:{number}", f"{number}.txt", _failure("Record must be an object with a 'text' string")
+            continue
+        
+        record_id = str(record['id']) if record.get('id') is not None else str(number)
+        path = _safe_relative_path(record_id)
+        if not os.path.splitext(path)[1]:
+            path += ".txt"
+        text = record['text']
+        yield record_id, path, lambda text=text: text
+
+
+def _failure(message):
+    """A reader that fails with a message."""
+    def read():
+        raise ValueError(message)
+    return read
+
+
+def iter_transcripts(sources, input_format="text", extensions=DEFAULT_EXTENSIONS):
+    """
+    Lazily enumerate transcripts from input arguments, in a deterministic order.
+    
+    Directories are walked in sorted order, glob patterns ('**' matches any
+    number of directories) are matched against the sorted walk of their
+    fixed directory, and tar archives are read as a stream in archive order.
+    
+    Args:
+        sources: Paths, glob patterns and '-' for stdin
+        input_format: 'text' to read stdin as one transcript, or 'jsonl'
+            to read stdin and other files as records with 'id' and 'text'
+        extensions: File extensions read from directories and tar
+            archives, or an empty tuple for all files
+    
+    Yields:
+        Tuples of (name, output path, read), where name identifies the
+        transcript in reports, output path is a relative path to write its
+        result to, and read() returns its text. read() raises OSError or
+        ValueError for an unreadable transcript, and for a tar member it
+        must be called before the next transcript is taken.
+    """
+    extensions = tuple(extension.lower() for extension in extensions)
+    for source in sources:
+        kind = input_kind(source, input_format)
+        if kind == "stdin":
+            yield "-", "stdin.txt", sys.stdin.read
+        elif kind == "jsonl":
+            if source == "-":
+                yield from _iter_jsonl(sys.stdin, "-")
+            else:
+                with open(source, 'r', encoding='utf-8') as f:
+                    yield from _iter_jsonl(f, source)
+        elif kind == "directory":
+            for path in _walk_files(source):
+                if _has_extension(path, extensions):
+                    yield path, os.path.relpath(path, source), _file_reader(path)
+        elif kind == "glob":
+            for path, relative in _iter_glob(source):
+                yield path, relative, _file_reader(path)
+        elif kind == "tar":
+            yield from _iter_tar(source, extensions)
+        else:
+            yield source, os.path.basename(source), _file_reader(source)
+
+
+class ProgressJournal:
+    """Checkpoints of the finished inputs of a deterministic transcript stream."""
+    
+    def __init__(self, path, run):
+        """
+        Args:
+            path: Journal file
+            run: JSON-serializable description of the stack, inputs and
+                output, which a resumed run must match
+        """
+        self.path = path
+        self.run = run
+        # Every input before this position is finished
+        self.position = 0
+        # Finished inputs at or after the position, by index, with their names
+        self.finished = {}
+        self.last_name = None
+        self.output_bytes = 0
+        self.completed = 0
+        self.failed = 0
+    
+    def load(self):
+        """
+        Load the last checkpoint.
+        
+        Returns:
+            True if a checkpoint was found
+        
+        Raises:
+            ValueError: If the journal is unreadable or was written by a
+                different run
+        """
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            return False
+        except ValueError:
+            raise ValueError(f"Journal '{self.path}' is damaged.")
+        
+        if data.get('version') != JOURNAL_VERSION or data.get('run') != self.run:
+            raise ValueError(f"Journal '{self.path}' was written for a different stack, input or output.")
+        
+        self.position = data['position']
+        self.finished = {int(index): name for index, name in data['finished'].items()}
+        self.last_name = data['last_name']
+        self.output_bytes = data['output_bytes']
+        self.completed = data['completed']
+        self.failed = data['failed']
+        return True
+    
+    def is_finished(self, index, name):
+        """
+        Whether an input was finished by an earlier run.
+        
+        Raises:
+            ValueError: If the inputs changed since the checkpoint, so
+                positions no longer identify the same transcripts
+        """
+        if index == self.position - 1 and name != self.last_name:
+            raise ValueError(
+                f"Input {index + 1} is '{name}', but was '{self.last_name}' when the journal was written."
+            )
+        return index < self.position or index in self.finished
+    
+    def finish(self, index, name, failed=False):
+        """Record a finished input."""
+        self.finished[index] = name
+        self.completed += 1
+        if failed:
+            self.failed += 1
+        while self.position in self.finished:
+            self.last_name = self.finished.pop(self.position)
+            self.position += 1
+    
+    def save(self, output_bytes=0):
+        """
+        Write a checkpoint, replacing the previous one atomically.
+        
+        Args:
+            output_bytes: Length of the output file that holds exactly the
+                finished inputs' results
+        """
+        self.output_bytes = output_bytes
+        data = {
+            "version": JOURNAL_VERSION,
+            "run": self.run,
+            "position": self.position,
+            "finished": {str(index): name for index, name in self.finished.items()},
+            "last_name": self.last_name,
+            "output_bytes": output_bytes,
+            "completed": self.completed,
+            "failed": self.failed
+        }
+        temporary = f"{self.path}.tmp"
+        with open(temporary, 'w', encoding='utf-8') as f:
+            json.dump(data, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temporary, self.path)
+    
+    def remove(self):
+        """Delete the journal once the run is complete."""
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
+
+
+class DirectoryWriter:
+    """Writes each output to a file under a directory, at its input's relative path."""
+    
+    records_details = False
+    
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+    
+    def write(self, name, path, result):
+        """Write a successful result; failures are only reported."""
+        if "error" in result:
+            return
+        output_file = os.path.join(self.directory, path)
+        parent = os.path.dirname(output_file)
+        if parent:
+            os.makedirs(parent, exist_ok=True)
+        with open(output_file, 'w', encoding='utf-8') as f:
+            f.write(result["output"])
+    
+    def position(self):
+        """Output files are rewritten on resume, so there is nothing to cut off."""
+        return 0
+    
+    def sync(self):
+        pass
+    
+    def close(self):
+        pass
+
+
+class JsonlWriter:
+    """Writes one JSON record per input, with its output or error, to a file or stdout."""
+    
+    records_details = True
+    
+    def __init__(self, path=None, resume_at=None):
+        """
+        Args:
+            path: Output file, or None for stdout
+            resume_at: Length of the file's valid part when resuming, which
+                is kept while anything after it is cut off; None starts a
+                new file
+        
+        Raises:
+            ValueError: If the file is shorter than resume_at
+        """
+        self.path = path
+        if path is None:
+            self.stream = sys.stdout.buffer
+        elif resume_at is None:
+            self.stream = open(path, 'wb')
+        else:
+            if not os.path.exists(path) or os.path.getsize(path) < resume_at:
+                raise ValueError(f"Output file '{path}' is shorter than its journal records.")
+            self.stream = open(path, 'r+b')
+            self.stream.truncate(resume_at)
+            self.stream.seek(resume_at)
+    
+    def write(self, name, path, result):
+        record = {"input": name}
+        record.update({key: result[key] for key in ("output", "error", "near_duplicate", "chunks", "merged") if key in result})
+        self.stream.write((json.dumps(record, ensure_ascii=False) + "\n").encode('utf-8'))
+    
+    def position(self):
+        """Length of the output written so far."""
+        return self.stream.tell() if self.path else 0
+    
+    def sync(self):
+        """Make the written records durable before a checkpoint refers to them."""
+        self.stream.flush()
+        if self.path:
+            os.fsync(self.stream.fileno())
+    
+    def close(self):
+        if self.path:
+            self.stream.close()
+        else:
+            self.stream.flush()
+
+
+class TextWriter:
+    """Writes the output of a single transcript to stdout as plain text."""
+    
+    records_details = False
+    
+    def write(self, name, path, result):
+        if "error" not in result:
+            sys.stdout.write(result["output"] + "\n")
+    
+    def position(self):
+        return 0
+    
+    def sync(self):
+        sys.stdout.flush()
+    
+    def close(self):
+        sys.stdout.flush()
+
+
+async def stream_transform(executor, system_prompt, transcripts, writer, journal=None, window=None,
+                           progress_interval=DEFAULT_PROGRESS_INTERVAL, log=None):
+    """
+    Transform a stream of transcripts, writing each result as it completes.
+    
+    Args:
+        executor: TransformExecutor running the transformations
+        system_prompt: The combined prompt stack
+        transcripts: Iterable from iter_transcripts(). It is advanced in a
+            worker thread, so reading files or a pipe never stalls the
+            requests in flight.
+        writer: DirectoryWriter, JsonlWriter or TextWriter for the results
+        journal: Optional loaded ProgressJournal; finished inputs are
+            skipped and progress is checkpointed to it
+        window: Maximum number of transcripts read but not yet written, by
+            default four times the executor's concurrency
+        progress_interval: Seconds between throughput reports, or 0 for none
+        log: Stream for failures and reports, by default stderr
+    
+    Returns:
+        A dictionary with the numbers of completed, failed, cached and
+        skipped transcripts, the bytes of text read and the seconds taken
+    """
+    log = log or sys.stderr
+    window = window or executor.concurrency * 4
+    summary = {"completed": 0, "failed": 0, "cached": 0, "skipped": 0, "input_bytes": 0, "seconds": 0.0}
+    
+    def unfinished():
+        for index, (name, path, read) in enumerate(transcripts):
+            if journal is not None and journal.is_finished(index, name):
+                summary["skipped"] += 1
+                continue
+            try:
+                yield index, name, path, read(), None
+            except (OSError, ValueError) as e:
+                yield index, name, path, None, str(e)
+    
+    async def run(index, name, path, text, error):
+        if error is None:
+            try:
+                return index, name, path, await executor.transform_result(system_prompt, text)
+            except TransformError as e:
+                error = str(e)
+        return index, name, path, {"error": error}
+    
+    inputs = unfinished()
+    pending = set()
+    exhausted = False
+    start = last_checkpoint = last_report = time.perf_counter()
+    
+    try:
+        while pending or not exhausted:
+            # Top up the window; only it is ever held in memory
+            while not exhausted and len(pending) < window:
+                item = await asyncio.to_thread(next, inputs, None)
+                if item is None:
+                    exhausted = True
+                    break
+                if item[3] is not None:
+                    summary["input_bytes"] += len(item[3].encode('utf-8'))
+                pending.add(asyncio.ensure_future(run(*item)))
+            if not pending:
+                break
+            
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                index, name, path, result = task.result()
+                writer.write(name, path, result)
+                failed = "error" in result
+                summary["completed"] += 1
+                if failed:
+                    summary["failed"] += 1
+                    print(f"Failed to transform '{name}': {result['error']}", file=log)
+                if result.get("cached"):
+                    summary["cached"] += 1
+                if "near_duplicate" in result and not writer.records_details:
+                    match = result["near_duplicate"]
+                    print(f"'{name}' is a near-duplicate ({match['similarity']:.0%}) of an earlier input.", file=log)
+                if journal is not None:
+                    journal.finish(index, name, failed)
+            
+            now = time.perf_counter()
+            if journal is not None and now - last_checkpoint >= CHECKPOINT_INTERVAL:
+                writer.sync()
+                journal.save(writer.position())
+                last_checkpoint = now
+            if progress_interval and now - last_report >= progress_interval:
+                elapsed = now - start
+                print(
+                    f"Progress: {summary['completed']} done ({summary['failed']} failed, "
+                    f"{summary['cached']} from cache, {summary['skipped']} skipped), "
+                    f"{summary['completed'] / elapsed:.1f} texts/s, {summary['input_bytes'] / elapsed / 1024:.1f} KB/s read.",
+                    file=log, flush=True
+                )
+                last_report = now
+    finally:
+        # Unfinished transcripts are not journaled, so a resumed run redoes them
+        for task in pending:
+            task.cancel()
+        writer.sync()
+        if journal is not None:
+            journal.save(writer.position())
+    
+    summary["seconds"] = time.perf_counter() - start
+    return summary
@@ -0,0 +1,742 @@
+#!/usr/bin/env python3
+"""
+Transform dictated text with a combined prompt stack.
+
+A backend sends one (system prompt, text) pair to a model and returns its
+reply. OpenAIBackend talks to any OpenAI-compatible chat completions
+endpoint over pooled keep-alive connections, and MockBackend answers locally
+and deterministically for tests and benchmarks.
+
+TransformExecutor runs many transformations on one event loop with a bound
+on the requests in flight, an optional request rate limit, and retries with
+exponential backoff for rate limiting, server errors and dropped
+connections. Given a TextChunker, it splits long texts and transforms
+their chunks concurrently. TransformRunner gives synchronous callers such as the Streamlit
+app one long-lived loop, so pooled connections survive between calls.
+"""
+import os
+import ssl
+import json
+import time
+import random
+import asyncio
+import threading
+from urllib.parse import urlsplit
+from prompt_similarity import minhash
+
+
+BACKEND_ENV = "PROMPT_COMBINER_BACKEND"
+MODEL_ENV = "PROMPT_COMBINER_MODEL"
+API_KEY_ENV = "OPENAI_API_KEY"
+BASE_URL_ENV = "OPENAI_BASE_URL"
+
+DEFAULT_BASE_URL = "https://api.openai.com/v1"
+DEFAULT_MODEL = "gpt-4o-mini"
+
+# Responses worth retrying: timeouts, rate limiting and transient server errors
+RETRY_STATUSES = (408, 409, 429, 500, 502, 503, 504)
+
+MAX_RESPONSE_BYTES = 16 * 1024 * 1024
+
+
+class TransformError(Exception):
+    """A transformation that failed, and whether trying it again may help."""
+    
+    def __init__(self, message, retryable=False, retry_after=None):
+        super().__init__(message)
+        self.retryable = retryable
+        self.retry_after = retry_after
+
+
+def mock_transform(system_prompt, text):
+    """
+    The deterministic reply of the mock backend.
+    
+    Whitespace inside each paragraph is collapsed and the first letter is
+    capitalized, which is enough to tell output from input.
+    """
+    paragraphs = [" ".join(paragraph.split()) for paragraph in text.split("\n\n")]
+    output = "\n\n".join(paragraph for paragraph in paragraphs if paragraph)
+    return output[:1].upper() + output[1:]
+
+
+class MockBackend:
+    """Deterministic local backend for tests and benchmarks."""
+    
+    name = "mock"
+    
+    def __init__(self, model="mock", latency=0.0, transient_failures=0, word_latency=0.0):
+        """
+        Args:
+            model: Model name reported in parameters()
+            latency: Seconds each call waits before answering
+            transient_failures: Number of retryable failures raised for each
+                distinct input before it succeeds
+            word_latency: Additional seconds per word of the text, like a
+                model generating its output a token at a time
+        """
+        self.model = model
+        self.latency = latency
+        self.word_latency = word_latency
+        self.transient_failures = transient_failures
+        self.calls = 0
+        self._failures = {}
+    
+    def parameters(self):
+        """The settings that determine the output for an input."""
+        return {"backend": self.name, "model": self.model}
+    
+    async def transform(self, system_prompt, text):
+        """Transform a text with a system prompt."""
+        self.calls += 1
+        if self.latency or self.word_latency:
+            await asyncio.sleep(self.latency + self.word_latency * len(text.split()))
+        
+        if self.transient_failures:
+            key = (system_prompt, text)
+            failures = self._failures.get(key, 0)
+            if failures < self.transient_failures:
+                self._failures[key] = failures + 1
+                raise TransformError("Mock backend is temporarily unavailable.", retryable=True, retry_after=0)
+        
+        return mock_transform(system_prompt, text)
+    
+    async def close(self):
+        """Nothing to release."""
+
+
+class ConnectionPool:
+    """Keep-alive connections to one host, reused by requests on an event loop."""
+    
+    def __init__(self, host, port, use_ssl=False, size=16, connect_timeout=10.0):
+        """
+        Args:
+            host: Host name to connect to
+            port: Port to connect to
+            use_ssl: Connect with TLS
+            size: Maximum number of idle connections kept open
+            connect_timeout: Seconds to wait for a new connection
+        """
+        self.host = host
+        self.port = port
+        self.size = size
+        self.connect_timeout = connect_timeout
+        self.ssl_context = ssl.create_default_context() if use_ssl else None
+        self.opened = 0
+        self._idle = []
+        self._loop = None
+    
+    async def acquire(self):
+        """
+        Get an open connection.
+        
+        Returns:
+            A tuple of (reader, writer, reused), where reused says whether
+            the connection already served a request
+        """
+        loop = asyncio.get_running_loop()
+        if loop is not self._loop:
+            # Connections belong to the loop that opened them
+            self.close()
+            self._loop = loop
+        
+        while self._idle:
+            reader, writer = self._idle.pop()
+            if not reader.at_eof() and not writer.is_closing():
+                return reader, writer, True
+            writer.close()
+        
+        reader, writer = await asyncio.wait_for(
+            asyncio.open_connection(
+                self.host, self.port, ssl=self.ssl_context,
+                server_hostname=self.host if self.ssl_context else None
+            ),
+            self.connect_timeout
+        )
+        self.opened += 1
+        return reader, writer, False
+    
+    def release(self, connection, reusable):
+        """Return a connection to the pool, or close it if it cannot serve another request."""
+        reader, writer = connection[:2]
+        if reusable and len(self._idle) < self.size and not writer.is_closing():
+            self._idle.append((reader, writer))
+        else:
+            writer.close()
+    
+    def close(self):
+        """Close the idle connections."""
+        for _, writer in self._idle:
+            try:
+                writer.close()
+            except RuntimeError:
+                # The loop that opened it is already closed
+                pass
+        self._idle = []
+
+
+async def _read_response(reader):
+    """
+    Read one HTTP/1.1 response.
+    
+    Returns:
+        A tuple of (status, headers, body bytes, whether the connection can
+        be reused)
+    """
+    head = await reader.readuntil(b"\r\n\r\n")
+    lines = head.decode('latin-1').split("\r\n")
+    try:
+        version, status = lines[0].split(" ", 2)[:2]
+        status = int(status)
+    except ValueError:
+        raise TransformError(f"Malformed response status line: {lines[0]!r}", retryable=True)
+    
+    headers = {}
+    for line in lines[1:]:
+        if line:
+            name, _, value = line.partition(":")
+            headers[name.strip().lower()] = value.strip()
+    
+    connection = headers.get('connection', '').lower()
+    reusable = connection == 'keep-alive' if version == 'HTTP/1.0' else connection != 'close'
+    
+    if 'chunked' in headers.get('transfer-encoding', '').lower():
+        chunks = []
+        size = 0
+        while True:
+            chunk_size = int((await reader.readuntil(b"\r\n")).split(b";")[0], 16)
+            if chunk_size == 0:
+                # Skip trailers up to the blank line ending the body
+                while (await reader.readuntil(b"\r\n")) != b"\r\n":
+                    pass
+                break
+            size += chunk_size
+            if size > MAX_RESPONSE_BYTES:
+                raise TransformError("Response body is too large.")
+            chunks.append(await reader.readexactly(chunk_size))
+            await reader.readexactly(2)
+        body = b"".join(chunks)
+    elif 'content-length' in headers:
+        length = int(headers['content-length'])
+        if length > MAX_RESPONSE_BYTES:
+            raise TransformError("Response body is too large.")
+        body = await reader.readexactly(length)
+    else:
+        # The body runs until the server closes the connection
+        body = await reader.read(MAX_RESPONSE_BYTES)
+        reusable = False
+    
+    return status, headers, body, reusable
+
+
+def _retry_after(headers):
+    """Seconds to wait from a Retry-After header, if it holds a number."""
+    try:
+        return max(0.0, float(headers['retry-after']))
+    except (KeyError, ValueError):
+        return None
+
+
+class OpenAIBackend:
+    """Client for an OpenAI-compatible chat completions endpoint."""
+    
+    name = "openai"
+    
+    def __init__(self, model=None, api_key=None, base_url=None, temperature=0.0, max_tokens=None,
+                 timeout=120.0, pool_size=16):
+        """
+        Args:
+            model: Model name, by default $PROMPT_COMBINER_MODEL or gpt-4o-mini
+            api_key: API key, by default $OPENAI_API_KEY
+            base_url: API base URL, by default $OPENAI_BASE_URL or the
+                OpenAI API. Local servers such as vLLM or Ollama work too.
+            temperature: Sampling temperature
+            max_tokens: Optional limit on the length of each reply
+            timeout: Seconds to wait for one reply
+            pool_size: Maximum number of idle keep-alive connections
+        
+        Raises:
+            ValueError: If the base URL is invalid, or no API key is set for
+                the OpenAI API
+        """
+        self.model = model or os.environ.get(MODEL_ENV) or DEFAULT_MODEL
+        self.api_key = api_key if api_key is not None else os.environ.get(API_KEY_ENV)
+        self.base_url = (base_url or os.environ.get(BASE_URL_ENV) or DEFAULT_BASE_URL).rstrip('/')
+        self.temperature = temperature
+        self.max_tokens = max_tokens
+        self.timeout = timeout
+        
+        url = urlsplit(self.base_url)
+        if url.scheme not in ('http', 'https') or not url.hostname:
+            raise ValueError(f"Invalid API base URL '{self.base_url}'.")
+        if not self.api_key and self.base_url == DEFAULT_BASE_URL:
+            raise ValueError(f"Set {API_KEY_ENV} to transform text with the OpenAI API.")
+        
+        use_ssl = url.scheme == 'https'
+        self.pool = ConnectionPool(url.hostname, url.port or (443 if use_ssl else 80), use_ssl, pool_size)
+        self._path = f"{url.path.rstrip('/')}/chat/completions"
+        self._host_header = url.netloc
+    
+    def parameters(self):
+        """The settings that determine the output for an input."""
+        return {
+            "backend": self.name,
+            "base_url": self.base_url,
+            "model": self.model,
+            "temperature": self.temperature,
+            "max_tokens": self.max_tokens
+        }
+    
+    def _request(self, system_prompt, text):
+        """Encode a chat completion request."""
+        payload = {
+            "model": self.model,
+            "messages": [
+                {"role": "system", "content": system_prompt},
+                {"role": "user", "content": text}
+            ],
+            "temperature": self.temperature
+        }
+        if self.max_tokens:
+            payload["max_tokens"] = self.max_tokens
+        body = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+        
+        headers = [
+            f"POST {self._path} HTTP/1.1",
+            f"Host: {self._host_header}",
+            "Content-Type: application/json",
+            "Accept: application/json",
+            f"Content-Length: {len(body)}",
+            "Connection: keep-alive"
+        ]
+        if self.api_key:
+            headers.append(f"Authorization: Bearer {self.api_key}")
+        return ("\r\n".join(headers) + "\r\n\r\n").encode('latin-1') + body
+    
+    async def _post(self, request):
+        """Send a request on a pooled connection and read the response."""
+        for attempt in range(2):
+            connection = await self.pool.acquire()
+            reader, writer, reused = connection
+            reusable = False
+            try:
+                writer.write(request)
+                await writer.drain()
+                status, headers, body, reusable = await _read_response(reader)
+                return status, headers, body
+            except (OSError, asyncio.IncompleteReadError, asyncio.LimitOverrunError, ValueError) as e:
+                # The server may have closed an idle connection just as we
+                # reused it; that is worth one immediate retry
+                if reused and attempt == 0:
+                    continue
+                raise TransformError(f"Request to {self.base_url} failed: {e or type(e).__name__}", retryable=True)
+            finally:
+                self.pool.release(connection, reusable)
+    
+    async def transform(self, system_prompt, text):
+        """
+        Transform a text with a system prompt.
+        
+        Raises:
+            TransformError: If the request fails or the reply is unusable
+        """
+        request = self._request(system_prompt, text)
+        try:
+            status, headers, body = await asyncio.wait_for(self._post(request), self.timeout)
+        except asyncio.TimeoutError:
+            raise TransformError(f"No reply from {self.base_url} within {self.timeout:g}s.", retryable=True)
+        except OSError as e:
+            raise TransformError(f"Could not connect to {self.base_url}: {e}", retryable=True)
+        
+        try:
+            payload = json.loads(body.decode('utf-8'))
+        except (UnicodeDecodeError, ValueError):
+            payload = None
+        
+        if status != 200:
+            message = body.decode('utf-8', 'replace')[:200]
+            if isinstance(payload, dict) and isinstance(payload.get('error'), dict):
+                message = payload['error'].get('message') or message
+            raise TransformError(
+                f"HTTP {status} from {self.base_url}: {message}",
+                retryable=status in RETRY_STATUSES,
+                retry_after=_retry_after(headers)
+            )
+        
+        try:
+            return payload['choices'][0]['message']['content']
+        except (TypeError, KeyError, IndexError):
+            raise TransformError(f"Unexpected chat completion response from {self.base_url}.")
+    
+    async def close(self):
+        """Close pooled connections."""
+        self.pool.close()
+
+
+def get_backend(name=None, model=None, base_url=None, api_key=None, latency=0.0):
+    """
+    Create a transformation backend.
+    
+    Args:
+        name: 'openai' or 'mock', by default $PROMPT_COMBINER_BACKEND or 'openai'
+        model: Model name passed to the backend
+        base_url: API base URL for the OpenAI-compatible backend
+        api_key: API key for the OpenAI-compatible backend
+        latency: Seconds the mock backend waits before answering
+    
+    Raises:
+        ValueError: If the backend is unknown or not configured
+    """
+    name = name or os.environ.get(BACKEND_ENV) or "openai"
+    if name == "mock":
+        return MockBackend(model=model or "mock", latency=latency)
+    if name == "openai":
+        return OpenAIBackend(model=model, api_key=api_key, base_url=base_url)
+    raise ValueError(f"Unknown transformation backend '{name}'.")
+
+
+class RateLimiter:
+    """Token bucket limiting how often requests start."""
+    
+    def __init__(self, rate, burst=1):
+        """
+        Args:
+            rate: Requests per second
+            burst: Requests that may start at once after an idle period
+        """
+        self.rate = rate
+        self.burst = max(1, burst)
+        self._tokens = float(self.burst)
+        self._updated = time.monotonic()
+    
+    async def acquire(self):
+        """Wait for the next request slot."""
+        # Reserve a slot before sleeping, so concurrent callers queue up
+        # behind each other without a lock
+        now = time.monotonic()
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+        self._tokens -= 1
+        if self._tokens < 0:
+            await asyncio.sleep(-self._tokens / self.rate)
+
+
+class TransformExecutor:
+    """Runs transformations concurrently with bounded concurrency, rate limiting and retries."""
+    
+    def __init__(self, backend, concurrency=8, retries=3, rate_limit=None, backoff=0.5, max_backoff=30.0,
+                 cache=None, similarity=None, similarity_mode="reuse", chunker=None):
+        """
+        Args:
+            backend: Backend to send requests to
+            concurrency: Maximum number of requests in flight
+            retries: Attempts after the first for retryable failures
+            rate_limit: Optional maximum number of requests started per second
+            backoff: Seconds before the first retry, doubled for each further
+                one, unless the server asks for a specific delay
+            max_backoff: Longest wait between two attempts
+            cache: Optional ResponseCache answering repeated inputs without
+                a request
+            similarity: Optional SimilarityIndex over the cache's inputs
+                that near-duplicate inputs are looked up in
+            similarity_mode: 'reuse' answers a near-duplicate with the
+                output of the most similar earlier input, 'flag' still
+                sends it but reports the match
+            chunker: Optional TextChunker; longer texts are split into
+                chunks that are transformed concurrently and joined
+        """
+        if similarity is not None and (cache is None or similarity.cache is not cache):
+            raise ValueError("A similarity index needs the response cache it is stored in.")
+        if similarity_mode not in ("reuse", "flag"):
+            raise ValueError(f"Unknown similarity mode '{similarity_mode}'.")
+        
+        self.backend = backend
+        self.cache = cache
+        self.similarity = similarity
+        self.similarity_mode = similarity_mode
+        self.chunker = chunker
+        self.concurrency = max(1, concurrency)
+        self.retries = retries
+        self.rate_limiter = RateLimiter(rate_limit, burst=self.concurrency) if rate_limit else None
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.stats = {
+            "requests": 0, "retries": 0, "failures": 0,
+            "cache_hits": 0, "near_duplicates_reused": 0, "near_duplicates_flagged": 0,
+            "near_duplicates_evicted": 0,
+            "chunked": 0, "chunks": 0, "merges": 0
+        }
+        self._semaphore = None
+        self._loop = None
+    
+    def _slots(self):
+        """The semaphore bounding requests in flight on the running loop."""
+        loop = asyncio.get_running_loop()
+        if loop is not self._loop:
+            self._semaphore = asyncio.Semaphore(self.concurrency)
+            self._loop = loop
+        return self._semaphore
+    
+    async def transform(self, system_prompt, text):
+        """
+        Transform one text, from the cache or with retries of retryable failures.
+        
+        Raises:
+            TransformError: If the last attempt fails
+        """
+        return (await self.transform_result(system_prompt, text))["output"]
+    
+    async def transform_result(self, system_prompt, text):
+        """
+        Transform one text and report where the output came from.
+        
+        Returns:
+            A dictionary with the output, 'cached' when it came from the
+            cache, 'near_duplicate' with the input hash and similarity of a
+            similar earlier input that was reused, flagged or no longer
+            cached, and for a text split by the chunker, the number of
+            'chunks' and whether they were 'merged'
+        
+        Raises:
+            TransformError: If the last attempt fails
+        """
+        if self.chunker is not None:
+            chunks = self.chunker.split(text)
+            if len(chunks) > 1:
+                return await self._transform_chunks(system_prompt, chunks)
+        return await self._transform_piece(system_prompt, text)
+    
+    async def _transform_chunks(self, system_prompt, chunks):
+        """Transform the chunks of a text concurrently, then join and optionally merge their outputs."""
+        self.stats["chunked"] += 1
+        self.stats["chunks"] += len(chunks)
+        
+        # Every chunk goes through the cache on its own, so after a failed
+        # chunk only that one is sent again
+        results = await asyncio.gather(
+            *(self._transform_piece(system_prompt, chunk["text"]) for chunk in chunks),
+            return_exceptions=True
+        )
+        for result in results:
+            if isinstance(result, BaseException):
+                raise result
+        
+        output = self.chunker.stitch(chunks, [result["output"] for result in results])
+        result = {"output": output, "chunks": len(chunks), "merged": False}
+        if self.chunker.should_merge(output):
+            merged = await self._transform_piece(self.chunker.merge_prompt(system_prompt), output)
+            self.stats["merges"] += 1
+            result.update(output=merged["output"], merged=True)
+            results.append(merged)
+        if all(piece.get("cached") for piece in results):
+            result["cached"] = True
+        return result
+    
+    async def _transform_piece(self, system_prompt, text):
+        """Transform one text or chunk, from the cache or the backend."""
+        if self.cache is None:
+            return {"output": await self._request(system_prompt, text)}
+        
+        # Cache hits neither wait for a slot nor count against the rate limit
+        stack, text_hash = self.cache.keys(system_prompt, self.backend.parameters(), text)
+        output = self.cache.get(stack, text_hash)
+        if output is not None:
+            self.stats["cache_hits"] += 1
+            return {"output": output, "cached": True}
+        
+        result = {}
+        signature = None
+        if self.similarity is not None:
+            # Hashing a long transcript takes long enough to stall other requests
+            signature = await asyncio.to_thread(minhash, text)
+            match = self.similarity.find(stack, signature)
+            if match:
+                result["near_duplicate"] = {"input_hash": match[0], "similarity": round(match[1], 3)}
+                if self.similarity_mode == "flag":
+                    self.stats["near_duplicates_flagged"] += 1
+                else:
+                    output = self.cache.get(stack, match[0])
+                    if output is not None:
+                        self.stats["near_duplicates_reused"] += 1
+                        result.update(output=output, cached=True)
+                        return result
+                    # The match's response expired or was evicted since it was found
+                    self.stats["near_duplicates_evicted"] += 1
+        
+        result["output"] = await self._request(system_prompt, text)
+        self.cache.put(stack, text_hash, result["output"])
+        if self.similarity is not None:
+            self.similarity.add(stack, text_hash, signature)
+        return result
+    
+    async def _request(self, system_prompt, text):
+        """Send one text to the backend, retrying retryable failures."""
+        async with self._slots():
+            for attempt in range(self.retries + 1):
+                if self.rate_limiter:
+                    await self.rate_limiter.acquire()
+                
+                self.stats["requests"] += 1
+                try:
+                    return await self.backend.transform(system_prompt, text)
+                except TransformError as e:
+                    if not e.retryable or attempt == self.retries:
+                        self.stats["failures"] += 1
+                        raise
+                    delay = e.retry_after
+                    if delay is None:
+                        # Full jitter keeps retrying clients from moving in step
+                        delay = random.uniform(0, min(self.max_backoff, self.backoff * 2 ** attempt))
+                
+                # Keep the slot while waiting, so a struggling server sees
+                # less traffic rather than more
+                self.stats["retries"] += 1
+                await asyncio.sleep(min(delay, self.max_backoff))
+    
+    async def transform_all(self, system_prompt, texts):
+        """
+        Transform texts concurrently with one system prompt.
+        
+        Returns:
+            A result dictionary per text, in input order, with the index,
+            either the fields of transform_result() or an error message, and
+            the seconds it took
+        """
+        async def run(index, text):
+            start = time.perf_counter()
+            result = {"index": index}
+            try:
+                result.update(await self.transform_result(system_prompt, text))
+            except TransformError as e:
+                result["error"] = str(e)
+            result["seconds"] = time.perf_counter() - start
+            return result
+        
+        return await asyncio.gather(*(run(index, text) for index, text in enumerate(texts)))
+    
+    async def close(self):
+        """Release the backend's connections and close the cache."""
+        await self.backend.close()
+        if self.cache is not None:
+            self.cache.close()
+
+
+class TransformRunner:
+    """Runs an executor's transformations for synchronous callers on a background event loop."""
+    
+    def __init__(self, executor):
+        self.executor = executor
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever, name="transform-loop", daemon=True)
+        self._thread.start()
+    
+    def run(self, coroutine, timeout=None):
+        """Run a coroutine on the background loop and wait for its result."""
+        return asyncio.run_coroutine_threadsafe(coroutine, self._loop).result(timeout)
+    
+    def transform(self, system_prompt, text, timeout=None):
+        """
+        Transform one text. Safe to call from several threads at once.
+        
+        Raises:
+            TransformError: If the transformation fails
+        """
+        return self.run(self.executor.transform(system_prompt, text), timeout)
+    
+    def transform_all(self, system_prompt, texts, timeout=None):
+        """Transform texts concurrently, see TransformExecutor.transform_all()."""
+        return self.run(self.executor.transform_all(system_prompt, texts), timeout)
+    
+    def close(self):
+        """Close the backend and stop the loop."""
+        self.run(self.executor.close())
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+        self._loop.close()
+
+
+class MockChatServer:
+    """OpenAI-compatible chat completions endpoint answering like MockBackend."""
+    
+    def __init__(self, latency=0.0):
+        """
+        Args:
+            latency: Seconds each request waits before it is answered
+        """
+        self.backend = MockBackend(latency=latency)
+        self.connections = 0
+        self.requests = 0
+    
+    def _answer(self, body):
+        """Build the status and JSON body for a request body."""
+        try:
+            payload = json.loads(body.decode('utf-8'))
+            messages = payload['messages']
+            system_prompt = "".join(m['content'] for m in messages if m['role'] == 'system')
+            text = [m['content'] for m in messages if m['role'] == 'user'][-1]
+        except (UnicodeDecodeError, ValueError, KeyError, TypeError, IndexError):
+            return 400, {"error": {"message": "Invalid chat completion request."}}, None
+        return 200, payload, (system_prompt, text)
+    
+    async def handle_connection(self, reader, writer):
+        """Answer requests on a connection until it closes."""
+        self.connections += 1
+        try:
+            while True:
+                try:
+                    head = await reader.readuntil(b"\r\n\r\n")
+                except (asyncio.IncompleteReadError, asyncio.LimitOverrunError):
+                    break
+                
+                headers = {}
+                for line in head.decode('latin-1').split("\r\n")[1:]:
+                    if line:
+                        name, _, value = line.partition(":")
+                        headers[name.strip().lower()] = value.strip()
+                body = await reader.readexactly(int(headers.get('content-length') or 0))
+                self.requests += 1
+                
+                status, data, request = self._answer(body)
+                if request:
+                    content = await self.backend.transform(*request)
+                    data = {
+                        "id": f"chatcmpl-mock-{self.requests}",
+                        "object": "chat.completion",
+                        "created": int(time.time()),
+                        "model": data.get('model', 'mock'),
+                        "choices": [{
+                            "index": 0,
+                            "message": {"role": "assistant", "content": content},
+                            "finish_reason": "stop"
+                        }]
+                    }
+                
+                data = json.dumps(data, ensure_ascii=False).encode('utf-8')
+                keep_alive = headers.get('connection', '').lower() != 'close'
+                writer.write((
+                    f"HTTP/1.1 {status} {'OK' if status == 200 else 'Bad Request'}\r\n"
+                    f"Content-Type: application/json\r\nContent-Length: {len(data)}\r\n"
+                    f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n"
+                ).encode('latin-1') + data)
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+    
+    async def serve(self, host="127.0.0.1", port=0, ready=None):
+        """
+        Accept connections until cancelled.
+        
+        Args:
+            host: Interface to listen on
+            port: Port to listen on, or 0 for any free port
+            ready: Optional callback receiving the bound (host, port)
+        """
+        server = await asyncio.start_server(self.handle_connection, host, port)
+        if ready:
+            ready(server.sockets[0].getsockname()[:2])
+        async with server:
+            await server.serve_forever()
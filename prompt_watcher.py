@@ -0,0 +1,463 @@
+#!/usr/bin/env python3
+"""
+Watch the Markdown prompt tree and the library file for changes.
+
+On Linux, changes are reported by inotify, called through ctypes. Elsewhere,
+or when the inotify watch limit is too low for the tree, the watched
+directories are polled instead. Bursts of changes, such as a git checkout
+touching hundreds of files, are debounced into a single batch.
+
+LibraryWatcher builds on this to keep a converted library up to date: it
+incrementally reconverts the tree after a batch of Markdown changes and
+reloads the registered PromptCombiner instances, which swap in the new
+library without a restart.
+"""
+import os
+import sys
+import time
+import errno
+import select
+import struct
+import weakref
+import threading
+
+
+# inotify event masks, from <sys/inotify.h>
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_ISDIR = 0x40000000
+
+WATCH_MASK = (IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+              | IN_DELETE_SELF | IN_MOVE_SELF | IN_ONLYDIR)
+
+# struct inotify_event: wd, mask, cookie, len, then the name
+EVENT_HEADER = struct.Struct('iIII')
+
+
+def _iter_directories(root):
+    """Yield a directory and all directories below it, without following symlinks."""
+    pending = [root]
+    while pending:
+        current = pending.pop()
+        yield current
+        try:
+            with os.scandir(current) as entries:
+                for entry in entries:
+                    try:
+                        if entry.is_dir(follow_symlinks=False):
+                            pending.append(entry.path)
+                    except OSError:
+                        pass
+        except OSError:
+            pass
+
+
+class InotifyWatcher:
+    """
+    Report changed paths using Linux inotify.
+    
+    Each root is a (directory, recursive) tuple. Recursive roots get a watch
+    per directory, and directories created later are watched as they appear.
+    """
+    
+    def __init__(self, roots, include=None):
+        """
+        Args:
+            roots: List of (directory, recursive) tuples to watch
+            include: Optional function (path, is_dir) deciding whether a
+                change is reported
+        
+        Raises:
+            OSError: If inotify is unavailable or the tree needs more
+                watches than the system allows
+        """
+        import ctypes
+        import ctypes.util
+        
+        self.include = include
+        self._libc = ctypes.CDLL(ctypes.util.find_library('c') or None, use_errno=True)
+        self._fd = self._libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self._fd < 0:
+            error = ctypes.get_errno()
+            raise OSError(error, f"inotify_init1 failed: {os.strerror(error)}")
+        
+        # Watch descriptor -> (directory, recursive)
+        self._watches = {}
+        try:
+            for directory, recursive in roots:
+                directories = _iter_directories(directory) if recursive else [directory]
+                for path in directories:
+                    self._add_watch(path, recursive)
+        except OSError:
+            self.close()
+            raise
+    
+    def _add_watch(self, path, recursive):
+        """Start watching one directory."""
+        import ctypes
+        
+        wd = self._libc.inotify_add_watch(self._fd, os.fsencode(path), WATCH_MASK)
+        if wd < 0:
+            error = ctypes.get_errno()
+            # The directory may be gone again already
+            if error in (errno.ENOENT, errno.ENOTDIR):
+                return
+            raise OSError(error, f"Cannot watch '{path}': {os.strerror(error)}")
+        self._watches[wd] = (path, recursive)
+    
+    def _watch_new_tree(self, path, changes):
+        """Watch a directory created under a recursive root, reporting its files."""
+        for directory in _iter_directories(path):
+            try:
+                self._add_watch(directory, True)
+            except OSError as e:
+                print(f"Error: {e}", file=sys.stderr)
+            # Files can land before the watch exists, so report what is there
+            try:
+                with os.scandir(directory) as entries:
+                    for entry in entries:
+                        if not entry.is_dir(follow_symlinks=False):
+                            self._report(entry.path, False, changes)
+            except OSError:
+                pass
+    
+    def _report(self, path, is_dir, changes):
+        """Add a change unless the filter excludes it."""
+        if self.include is None or self.include(path, is_dir):
+            changes.add(path)
+    
+    def read(self, timeout=None):
+        """
+        Wait for changes.
+        
+        Args:
+            timeout: Seconds to wait, or None to wait indefinitely
+        
+        Returns:
+            The set of changed paths, empty if the timeout expired. After an
+            event queue overflow the watched roots themselves are reported.
+        """
+        changes = set()
+        deadline = None if timeout is None else time.monotonic() + timeout
+        
+        # Keep waiting while events arrive that the filter drops
+        while not changes:
+            remaining = None if deadline is None else max(0.0, deadline - time.monotonic())
+            if not select.select([self._fd], [], [], remaining)[0]:
+                break
+            
+            try:
+                data = os.read(self._fd, 65536)
+            except BlockingIOError:
+                continue
+            
+            offset = 0
+            while offset < len(data):
+                wd, mask, _, length = EVENT_HEADER.unpack_from(data, offset)
+                name = data[offset + EVENT_HEADER.size:offset + EVENT_HEADER.size + length].rstrip(b'\0')
+                offset += EVENT_HEADER.size + length
+                
+                if mask & IN_Q_OVERFLOW:
+                    changes.update(path for path, _ in self._watches.values())
+                    continue
+                if mask & IN_IGNORED:
+                    self._watches.pop(wd, None)
+                    continue
+                
+                watch = self._watches.get(wd)
+                if watch is None:
+                    continue
+                directory, recursive = watch
+                
+                if not name:
+                    # The watched directory itself was deleted or moved
+                    self._report(directory, True, changes)
+                    continue
+                
+                path = os.path.join(directory, os.fsdecode(name))
+                is_dir = bool(mask & IN_ISDIR)
+                if is_dir and recursive and mask & (IN_CREATE | IN_MOVED_TO):
+                    self._watch_new_tree(path, changes)
+                self._report(path, is_dir, changes)
+        
+        return changes
+    
+    def close(self):
+        """Stop watching."""
+        if self._fd >= 0:
+            os.close(self._fd)
+            self._fd = -1
+
+
+class PollingWatcher:
+    """Report changed paths by comparing the watched directories between scans."""
+    
+    def __init__(self, roots, include=None, interval=0.5):
+        """
+        Args:
+            roots: List of (directory, recursive) tuples to watch
+            include: Optional function (path, is_dir) deciding whether a
+                change is reported
+            interval: Seconds between scans
+        """
+        self.roots = roots
+        self.include = include
+        self.interval = interval
+        self._state = self._scan()
+        self._next_scan = time.monotonic() + interval
+    
+    def _scan(self):
+        """Map every included path to its modification time and size."""
+        state = {}
+        for root, recursive in self.roots:
+            directories = _iter_directories(root) if recursive else [root]
+            for directory in directories:
+                try:
+                    with os.scandir(directory) as entries:
+                        for entry in entries:
+                            try:
+                                is_dir = entry.is_dir(follow_symlinks=False)
+                                if self.include is None or self.include(entry.path, is_dir):
+                                    stat = entry.stat(follow_symlinks=False)
+                                    state[entry.path] = (stat.st_mtime_ns, stat.st_size, is_dir)
+                            except OSError:
+                                pass
+                except OSError:
+                    pass
+        return state
+    
+    def read(self, timeout=None):
+        """
+        Wait for changes.
+        
+        Args:
+            timeout: Seconds to wait, or None to wait indefinitely
+        
+        Returns:
+            The set of changed paths, empty if the timeout expired
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        
+        while True:
+            now = time.monotonic()
+            if deadline is not None and deadline < self._next_scan:
+                time.sleep(max(0.0, deadline - now))
+                return set()
+            time.sleep(max(0.0, self._next_scan - now))
+            
+            state = self._scan()
+            self._next_scan = time.monotonic() + self.interval
+            changes = {
+                path for path in state.keys() | self._state.keys()
+                if state.get(path) != self._state.get(path)
+            }
+            self._state = state
+            if changes:
+                return changes
+    
+    def close(self):
+        """Stop watching."""
+
+
+def create_watcher(roots, include=None, poll_interval=0.5, polling=False):
+    """
+    Create the best available watcher for some directories.
+    
+    Args:
+        roots: List of (directory, recursive) tuples to watch
+        include: Optional function (path, is_dir) deciding whether a change
+            is reported
+        poll_interval: Seconds between scans when polling
+        polling: Always poll, even where inotify is available
+    """
+    if not polling and sys.platform.startswith('linux'):
+        try:
+            return InotifyWatcher(roots, include)
+        except (OSError, AttributeError) as e:
+            print(f"Falling back to polling for changes: {e}", file=sys.stderr)
+    return PollingWatcher(roots, include, poll_interval)
+
+
+def collect_changes(watcher, timeout=None, quiet=0.2, max_delay=2.0):
+    """
+    Wait for a burst of changes to settle.
+    
+    After the first change, keeps collecting until no change arrives for
+    quiet seconds, or max_delay seconds have passed.
+    
+    Returns:
+        The set of changed paths, empty if timeout expired first
+    """
+    changes = watcher.read(timeout)
+    if not changes:
+        return changes
+    
+    deadline = time.monotonic() + max_delay
+    while True:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            return changes
+        more = watcher.read(min(quiet, remaining))
+        if not more:
+            return changes
+        changes |= more
+
+
+class LibraryWatcher:
+    """
+    Keep a converted prompt library and the combiners using it up to date.
+    
+    Changes to Markdown files under the source directory trigger an
+    incremental reconversion of the library file. Changes to the library
+    file, whether from that reconversion or from someone running
+    'cli.py convert', reload every registered combiner.
+    """
+    
+    def __init__(self, library_file, source_directory=None, minify=False, strip_emphasis=False, jobs=1,
+                 quiet=0.2, max_delay=2.0, poll_interval=0.5, polling=False):
+        """
+        Args:
+            library_file: Path of the JSON or compiled library to keep current
+            source_directory: Markdown prompt tree to reconvert from, or None
+                to only watch the library file
+            minify: Reconvert with a content_min variant of each prompt
+            strip_emphasis: With minify, remove emphasis from content_min
+            jobs: Number of conversion worker processes
+            quiet: Seconds without changes that end a burst
+            max_delay: Longest a burst is collected before rebuilding
+            poll_interval: Seconds between scans when polling
+            polling: Poll even where inotify is available
+        """
+        self.library_file = library_file
+        self.source_directory = source_directory
+        self.minify = minify
+        self.strip_emphasis = strip_emphasis
+        self.jobs = jobs
+        self.quiet = quiet
+        self.max_delay = max_delay
+        self.output_format = "bin" if library_file.endswith('.bin') else "json"
+        self._library_path = os.path.abspath(library_file)
+        self._source_path = os.path.abspath(source_directory) if source_directory else None
+        self._combiners = weakref.WeakSet()
+        self._listeners = []
+        self._signature = self._library_signature()
+        self._stop = threading.Event()
+        self._thread = None
+        
+        roots = [(os.path.dirname(self._library_path), False)]
+        if self._source_path:
+            roots.append((self._source_path, True))
+        self.watcher = create_watcher(roots, self._include, poll_interval, polling)
+    
+    def _include(self, path, is_dir):
+        """Only report Markdown files and directories in the tree, and the library file."""
+        path = os.path.abspath(path)
+        if path == self._library_path:
+            return True
+        if self._source_path and (path == self._source_path or path.startswith(self._source_path + os.sep)):
+            return is_dir or path.endswith('.md')
+        return False
+    
+    def _library_signature(self):
+        """Modification time and size of the library file, or None if missing."""
+        try:
+            stat = os.stat(self.library_file)
+        except OSError:
+            return None
+        return stat.st_mtime_ns, stat.st_size
+    
+    def add_combiner(self, combiner):
+        """Reload a combiner whenever the library changes. It is held weakly."""
+        self._combiners.add(combiner)
+    
+    def add_listener(self, callback):
+        """Call a function with no arguments after each reload."""
+        self._listeners.append(callback)
+    
+    def rebuild(self):
+        """Incrementally reconvert the source directory into the library file."""
+        from prompt_converter import convert_directory_to_json
+        
+        convert_directory_to_json(
+            self.source_directory, self.library_file, incremental=True, jobs=self.jobs,
+            minify=self.minify, strip_emphasis=self.strip_emphasis, output_format=self.output_format
+        )
+    
+    def reload(self):
+        """Reload the registered combiners and notify the listeners."""
+        self._signature = self._library_signature()
+        for combiner in list(self._combiners):
+            try:
+                combiner.reload()
+            except Exception as e:
+                print(f"Error reloading prompts from '{self.library_file}': {e}", file=sys.stderr)
+        for callback in self._listeners:
+            callback()
+    
+    def handle_changes(self, changes):
+        """
+        Rebuild and reload for a batch of changed paths.
+        
+        Returns:
+            True if the library was reloaded
+        """
+        changes = {os.path.abspath(path) for path in changes}
+        
+        if self._source_path and changes - {self._library_path}:
+            try:
+                self.rebuild()
+            except Exception as e:
+                print(f"Error converting prompts in '{self.source_directory}': {e}", file=sys.stderr)
+                return False
+        
+        # Our own rebuild and outside conversions both show up here; only
+        # reload when the file really differs from the version last loaded
+        if self._library_signature() == self._signature:
+            return False
+        self.reload()
+        return True
+    
+    def poll(self, timeout=None):
+        """
+        Wait for one debounced batch of changes and handle it.
+        
+        Returns:
+            True if the library was reloaded
+        """
+        changes = collect_changes(self.watcher, timeout, self.quiet, self.max_delay)
+        return bool(changes) and self.handle_changes(changes)
+    
+    def run(self):
+        """
+        Handle changes until stop() is called.
+        
+        Starts with one reconversion, so edits made while nothing was
+        watching are picked up too.
+        """
+        if self.source_directory:
+            self.handle_changes([self.source_directory])
+        
+        while not self._stop.is_set():
+            self.poll(timeout=0.5)
+    
+    def start(self):
+        """Handle changes in a background thread."""
+        self._thread = threading.Thread(target=self.run, name="library-watcher", daemon=True)
+        self._thread.start()
+        return self
+    
+    def stop(self):
+        """Stop the background thread and release the watcher."""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        self.watcher.close()
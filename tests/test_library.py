@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+"""
+Tests for compiled prompt libraries: every prompt written must read back
+unchanged, along with the ID index and the category tables.
+
+Run with 'python -m unittest tests.test_library' from the repository root.
+"""
+import os
+import shutil
+import struct
+import tempfile
+import unittest
+from unittest import mock
+
+import prompt_library
+from prompt_library import (
+    FORMAT_VERSION, HEADER, PromptLibrary, compute_library_hash, encode_library, is_library_file,
+    load_prompts, write_library
+)
+
+
+PROMPTS = [
+    {"id": "formal", "title": "Formal", "content": "Write formally.", "category": "tone",
+     "subcategory": "register", "file_path": "tone/register/formal.md", "content_min": "Write formally."},
+    {"id": "résumé", "title": "Résumé ✓", "content": "Überprüfe den Text.\n\n日本語も。", "category": "tone",
+     "subcategory": None, "file_path": "tone/résumé.md", "display_title": "Résumé", "token_estimate": 9},
+    {"id": "empty", "title": "", "content": "", "category": "format", "subcategory": None},
+    {"id": "formal", "title": "Formal again", "content": "A duplicate ID.", "category": "format",
+     "subcategory": "lists", "tags": ["a", "b"], "weight": 1.5, "hidden": False},
+]
+
+
+class LibraryRoundTripTest(unittest.TestCase):
+    def setUp(self):
+        self.work_dir = tempfile.mkdtemp(prefix="prompt-library-")
+        self.library_file = os.path.join(self.work_dir, "prompts.bin")
+        write_library(PROMPTS, self.library_file)
+        self.library = PromptLibrary(self.library_file)
+
+    def tearDown(self):
+        self.library.close()
+        shutil.rmtree(self.work_dir, ignore_errors=True)
+
+    def test_prompts_read_back_unchanged(self):
+        self.assertTrue(is_library_file(self.library_file))
+        self.assertEqual(len(self.library), len(PROMPTS))
+        self.assertEqual(self.library.to_list(), PROMPTS)
+        self.assertEqual(self.library.library_hash, compute_library_hash(PROMPTS))
+
+        prompt = self.library[1]
+        self.assertEqual(dict(prompt), PROMPTS[1])
+        self.assertEqual(prompt.get('display_title'), "Résumé")
+        self.assertIn('token_estimate', prompt)
+        self.assertNotIn('content_min', prompt)
+        self.assertIsNone(prompt['subcategory'])
+        self.assertEqual(self.library[-1]['tags'], ["a", "b"])
+
+    def test_extra_fields_are_decoded_once_per_prompt(self):
+        prompt = self.library[1]
+        with mock.patch.object(prompt_library.json, 'loads', wraps=prompt_library.json.loads) as loads:
+            for field in ('display_title', 'token_estimate', 'description'):
+                if field in prompt:
+                    prompt[field]
+            prompt.get('description')
+            dict(prompt)
+
+        self.assertEqual(loads.call_count, 1)
+
+    def test_ids_and_categories_are_indexed(self):
+        # The first prompt with an ID is the one looked up by it
+        self.assertEqual(self.library.duplicate_ids, ["formal"])
+        self.assertEqual(self.library.by_id["formal"]['title'], "Formal")
+        self.assertEqual(self.library.by_id["résumé"]['id'], "résumé")
+        self.assertNotIn("missing", self.library.by_id)
+        self.assertEqual(sorted(self.library.by_id), sorted({"formal", "résumé", "empty"}))
+
+        self.assertEqual([p['title'] for p in self.library.by_category["tone"]], ["Formal", "Résumé ✓"])
+        self.assertEqual([p['id'] for p in self.library.by_subcategory[("format", None)]], ["empty"])
+        self.assertEqual(len(self.library.by_subcategory[("format", "lists")]), 1)
+
+    def test_file_paths_can_be_left_out(self):
+        library = load_prompts(self.library_file, keep_file_paths=False)
+        try:
+            expected = [{k: v for k, v in prompt.items() if k != 'file_path'} for prompt in PROMPTS]
+            self.assertEqual(library.to_list(), expected)
+            self.assertNotIn('file_path', library[0])
+        finally:
+            library.close()
+
+    def test_a_buffer_reads_like_the_file(self):
+        library = PromptLibrary(buffer=memoryview(b"".join(encode_library(PROMPTS))))
+        try:
+            self.assertEqual(library.to_list(), PROMPTS)
+        finally:
+            library.close()
+
+    def test_other_format_versions_are_rejected(self):
+        data = bytearray(b"".join(encode_library(PROMPTS)))
+        struct.pack_into('<I', data, 8, FORMAT_VERSION + 1)
+        self.assertEqual(HEADER.unpack_from(data, 0)[1], FORMAT_VERSION + 1)
+
+        with self.assertRaisesRegex(ValueError, "Unsupported prompt library version"):
+            PromptLibrary(buffer=memoryview(bytes(data)))
+        with self.assertRaisesRegex(ValueError, "not a compiled prompt library"):
+            PromptLibrary(buffer=memoryview(b"PRMT"))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,157 @@
+#!/usr/bin/env python3
+"""
+Tests for the HTTP service: request framing, keep-alive after errors and
+reloading a changed library.
+
+Run with 'python -m unittest tests.test_server' from the repository root.
+"""
+import json
+import os
+import asyncio
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+from unittest import mock
+
+import prompt_server
+from prompt_server import PromptServer
+
+
+def write_library(path, title):
+    """Write a small library whose prompts share a title."""
+    prompts = [
+        {"id": f"prompt-{number}", "title": f"{title} {number}", "content": f"Content {number}.",
+         "category": "tone", "subcategory": None}
+        for number in range(3)
+    ]
+    temp_file = f"{path}.tmp"
+    with open(temp_file, 'w', encoding='utf-8') as f:
+        json.dump(prompts, f)
+    os.replace(temp_file, path)
+
+
+class ServerTest(unittest.TestCase):
+    def setUp(self):
+        self.work_dir = tempfile.mkdtemp(prefix="prompt-server-")
+        self.library_file = os.path.join(self.work_dir, "prompts.json")
+        write_library(self.library_file, "Formal")
+
+    def tearDown(self):
+        shutil.rmtree(self.work_dir, ignore_errors=True)
+
+    def run_with_server(self, client):
+        """Run a coroutine function against a server on a free port."""
+        server = PromptServer(self.library_file)
+
+        async def main():
+            ready = asyncio.get_running_loop().create_future()
+            task = asyncio.create_task(server.serve("127.0.0.1", 0, ready.set_result))
+            address = await ready
+            try:
+                return await client(server, *address)
+            finally:
+                # Let the handlers see the clients close before stopping
+                await asyncio.sleep(0.1)
+                task.cancel()
+
+        with mock.patch.object(prompt_server, 'REFRESH_INTERVAL', 0.05):
+            return asyncio.run(main())
+
+    @staticmethod
+    async def exchange(reader, writer, request):
+        """Send a request and read the status, headers and body of the response."""
+        writer.write(request.encode('latin-1'))
+        await writer.drain()
+        head = (await reader.readuntil(b"\r\n\r\n")).decode('latin-1').split("\r\n")
+        headers = dict(line.lower().split(": ", 1) for line in head[1:] if line)
+        body = await reader.readexactly(int(headers['content-length']))
+        return int(head[0].split(" ")[1]), headers, body
+
+    def test_invalid_ids_keep_the_connection_open(self):
+        async def client(server, host, port):
+            reader, writer = await asyncio.open_connection(host, port)
+            try:
+                bad = await self.exchange(reader, writer, "GET /combine?ids= HTTP/1.1\r\nHost: x\r\n\r\n")
+                good = await self.exchange(reader, writer, "GET /prompts/prompt-1 HTTP/1.1\r\nHost: x\r\n\r\n")
+            finally:
+                writer.close()
+            return bad, good
+
+        bad, good = self.run_with_server(client)
+
+        self.assertEqual(bad[0], 400)
+        self.assertEqual(bad[1]['connection'], 'keep-alive')
+        self.assertEqual(good[0], 200)
+        self.assertEqual(json.loads(good[2])['id'], 'prompt-1')
+
+    def test_negative_content_length_is_rejected(self):
+        async def client(server, host, port):
+            reader, writer = await asyncio.open_connection(host, port)
+            try:
+                response = await self.exchange(
+                    reader, writer, "POST /combine HTTP/1.1\r\nHost: x\r\nContent-Length: -5\r\n\r\n"
+                )
+                closed = await reader.read() == b""
+            finally:
+                writer.close()
+            return response, closed
+
+        (status, headers, body), closed = self.run_with_server(client)
+
+        self.assertEqual(status, 400)
+        self.assertEqual(headers['connection'], 'close')
+        self.assertIn("Content-Length", json.loads(body)['error'])
+        self.assertTrue(closed)
+
+    def test_post_body_is_combined(self):
+        async def client(server, host, port):
+            reader, writer = await asyncio.open_connection(host, port)
+            body = json.dumps({"ids": ["prompt-0", "prompt-2"]})
+            try:
+                return await self.exchange(
+                    reader, writer,
+                    f"POST /combine HTTP/1.1\r\nHost: x\r\nContent-Length: {len(body)}\r\n\r\n{body}"
+                )
+            finally:
+                writer.close()
+
+        status, headers, body = self.run_with_server(client)
+
+        self.assertEqual(status, 200)
+        self.assertIn("Content 0.", body.decode('utf-8'))
+        self.assertIn("Content 2.", body.decode('utf-8'))
+
+    def test_changed_library_is_reloaded_off_the_event_loop(self):
+        reload_thread = []
+        refresh = PromptServer.refresh
+
+        def record_thread(server):
+            reload_thread.append(threading.current_thread())
+            return refresh(server)
+
+        async def client(server, host, port):
+            # A different size changes the file signature even within one mtime tick
+            write_library(self.library_file, "Casual casual")
+            deadline = time.monotonic() + 5
+            while server.combiner.snapshot.version == 0 and time.monotonic() < deadline:
+                await asyncio.sleep(0.02)
+
+            reader, writer = await asyncio.open_connection(host, port)
+            try:
+                return await self.exchange(reader, writer, "GET /search?q=casual HTTP/1.1\r\nHost: x\r\n\r\n")
+            finally:
+                writer.close()
+
+        with mock.patch.object(PromptServer, 'refresh', record_thread):
+            status, headers, body = self.run_with_server(client)
+
+        self.assertEqual(status, 200)
+        self.assertEqual(len(json.loads(body)), 3)
+        self.assertTrue(reload_thread)
+        self.assertTrue(all(thread is not threading.main_thread() for thread in reload_thread))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+"""
+Stress tests for library snapshots.
+
+Reader threads combine prompts and list a category while a writer rewrites
+the library file and reloads it in a loop. Every read must see a single
+library version, and once the readers finish no retired snapshot may still
+be referenced.
+
+Run with 'python -m unittest tests.test_snapshots' from the repository root.
+"""
+import gc
+import json
+import os
+import re
+import shutil
+import tempfile
+import threading
+import unittest
+
+from prompt_combiner import PromptCombiner
+
+
+PROMPT_COUNT = 20
+READER_COUNT = 8
+RELOAD_COUNT = 200
+
+VERSION_PATTERN = re.compile(r"version (\d+)\.")
+
+
+def write_library(path, version):
+    """Write a library whose every prompt names the library version."""
+    prompts = [
+        {
+            "id": f"prompt-{number}",
+            "title": f"Prompt {number}",
+            "content": f"Prompt {number} of version {version}.",
+            "category": "tone",
+            "subcategory": None
+        }
+        for number in range(PROMPT_COUNT)
+    ]
+    # Replace the file in one step, as the converter does
+    temp_file = f"{path}.tmp"
+    with open(temp_file, 'w', encoding='utf-8') as f:
+        json.dump(prompts, f)
+    os.replace(temp_file, path)
+
+
+class SnapshotStressTest(unittest.TestCase):
+    def setUp(self):
+        self.work_dir = tempfile.mkdtemp(prefix="prompt-snapshots-")
+        self.library_file = os.path.join(self.work_dir, "prompts.json")
+        write_library(self.library_file, 0)
+
+    def tearDown(self):
+        shutil.rmtree(self.work_dir, ignore_errors=True)
+
+    def test_first_snapshot_is_the_loaded_library(self):
+        combiner = PromptCombiner(json_file=self.library_file)
+
+        self.assertEqual(combiner.snapshot.version, 0)
+        self.assertEqual(len(combiner.prompts), PROMPT_COUNT)
+
+    def test_readers_never_mix_versions_during_reloads(self):
+        combiner = PromptCombiner(json_file=self.library_file)
+        prompt_ids = [f"prompt-{number}" for number in range(PROMPT_COUNT)]
+        stop = threading.Event()
+        lock = threading.Lock()
+        mixed = []
+        errors = []
+        seen_versions = set()
+
+        def read():
+            try:
+                while not stop.is_set():
+                    combined = combiner.combine_prompts(prompt_ids)
+                    listed = " ".join(prompt['content'] for prompt in combiner.get_prompts_by_category("tone"))
+
+                    for text, expected in ((combined, PROMPT_COUNT), (listed, PROMPT_COUNT)):
+                        versions = VERSION_PATTERN.findall(text)
+                        with lock:
+                            if len(versions) != expected or len(set(versions)) != 1:
+                                mixed.append(sorted(set(versions)))
+                            seen_versions.update(versions)
+            except Exception as error:
+                with lock:
+                    errors.append(error)
+
+        readers = [threading.Thread(target=read) for _ in range(READER_COUNT)]
+        for reader in readers:
+            reader.start()
+        try:
+            for version in range(1, RELOAD_COUNT + 1):
+                write_library(self.library_file, version)
+                combiner.reload()
+        finally:
+            stop.set()
+            for reader in readers:
+                reader.join()
+
+        self.assertEqual(errors, [])
+        self.assertEqual(mixed, [])
+        self.assertGreater(len(seen_versions), 1, "readers never overlapped a reload")
+        self.assertEqual(combiner.snapshot.version, RELOAD_COUNT)
+        self.assertIn(f"version {RELOAD_COUNT}.", combiner.combine_prompts(prompt_ids))
+
+        gc.collect()
+        self.assertEqual(combiner.retired_snapshots(), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
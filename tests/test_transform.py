@@ -0,0 +1,236 @@
+#!/usr/bin/env python3
+"""
+Tests for text transformations: retries, rate limiting, chunked texts and
+the OpenAI-compatible client against the mock chat server.
+
+Run with 'python -m unittest tests.test_transform' from the repository root.
+"""
+import json
+import os
+import asyncio
+import shutil
+import tempfile
+import time
+import unittest
+
+from prompt_cache import ResponseCache
+from prompt_chunking import TextChunker
+from prompt_transform import (
+    MockBackend, MockChatServer, OpenAIBackend, RateLimiter, TransformError, TransformExecutor,
+    mock_transform
+)
+
+
+SYSTEM_PROMPT = "Rewrite the text formally."
+
+SENTENCES = [f"Sentence number {number} talks about topic {number} in a few more words." for number in range(8)]
+
+
+class ScriptedBackend(MockBackend):
+    """Mock backend raising a list of errors, one per call, before answering."""
+
+    def __init__(self, errors):
+        super().__init__()
+        self.errors = list(errors)
+
+    async def transform(self, system_prompt, text):
+        if self.errors:
+            self.calls += 1
+            raise self.errors.pop(0)
+        return await super().transform(system_prompt, text)
+
+
+class PoisonedBackend(MockBackend):
+    """Mock backend failing every text that contains a marker."""
+
+    def __init__(self, marker):
+        super().__init__()
+        self.marker = marker
+        self.texts = []
+
+    async def transform(self, system_prompt, text):
+        self.texts.append(text)
+        if self.marker in text:
+            raise TransformError("Poisoned chunk.")
+        return await super().transform(system_prompt, text)
+
+
+class TransformExecutorTest(unittest.TestCase):
+    def test_transient_failures_are_retried(self):
+        backend = MockBackend(transient_failures=2)
+        executor = TransformExecutor(backend, retries=3, backoff=0.01)
+
+        output = asyncio.run(executor.transform(SYSTEM_PROMPT, "some   text"))
+
+        self.assertEqual(output, "Some text")
+        self.assertEqual(backend.calls, 3)
+        self.assertEqual(executor.stats["requests"], 3)
+        self.assertEqual(executor.stats["retries"], 2)
+        self.assertEqual(executor.stats["failures"], 0)
+
+    def test_failure_after_the_last_retry_is_reported(self):
+        backend = MockBackend(transient_failures=3)
+        executor = TransformExecutor(backend, retries=1, backoff=0.01)
+
+        results = asyncio.run(executor.transform_all(SYSTEM_PROMPT, ["first", "second"]))
+
+        self.assertEqual([result["index"] for result in results], [0, 1])
+        self.assertTrue(all("temporarily unavailable" in result["error"] for result in results))
+        self.assertEqual(backend.calls, 4)
+        self.assertEqual(executor.stats["failures"], 2)
+
+    def test_permanent_failures_are_not_retried(self):
+        backend = ScriptedBackend([TransformError("Bad request.")])
+        executor = TransformExecutor(backend, retries=3, backoff=0.01)
+
+        with self.assertRaises(TransformError):
+            asyncio.run(executor.transform(SYSTEM_PROMPT, "text"))
+        self.assertEqual(backend.calls, 1)
+        self.assertEqual(executor.stats["retries"], 0)
+
+    def test_retry_after_replaces_the_backoff(self):
+        # A backoff of a minute would time the test out if Retry-After were ignored
+        backend = ScriptedBackend([TransformError("Slow down.", retryable=True, retry_after=0.05)])
+        executor = TransformExecutor(backend, retries=1, backoff=60.0, max_backoff=60.0)
+
+        start = time.monotonic()
+        output = asyncio.run(executor.transform(SYSTEM_PROMPT, "text"))
+        elapsed = time.monotonic() - start
+
+        self.assertEqual(output, "Text")
+        self.assertGreaterEqual(elapsed, 0.05)
+        self.assertLess(elapsed, 5.0)
+
+    def test_retry_after_is_capped_by_the_longest_backoff(self):
+        backend = ScriptedBackend([TransformError("Slow down.", retryable=True, retry_after=3600)])
+        executor = TransformExecutor(backend, retries=1, max_backoff=0.05)
+
+        start = time.monotonic()
+        asyncio.run(executor.transform(SYSTEM_PROMPT, "text"))
+
+        self.assertLess(time.monotonic() - start, 5.0)
+
+    def test_failed_chunk_fails_the_text_and_keeps_the_other_chunks(self):
+        work_dir = tempfile.mkdtemp(prefix="prompt-transform-")
+        self.addCleanup(shutil.rmtree, work_dir, True)
+        text = " ".join(SENTENCES)
+        chunker = TextChunker(max_tokens=40, overlap_tokens=0)
+        chunks = chunker.split(text)
+        self.assertGreater(len(chunks), 2)
+
+        cache = ResponseCache(os.path.join(work_dir, "cache.sqlite"), ttl=None)
+        backend = PoisonedBackend("topic 3")
+        executor = TransformExecutor(backend, retries=0, cache=cache, chunker=chunker)
+        with self.assertRaisesRegex(TransformError, "Poisoned"):
+            asyncio.run(executor.transform(SYSTEM_PROMPT, text))
+        self.assertEqual(len(backend.texts), len(chunks))
+
+        # Only the chunk that failed is sent again
+        retry_backend = MockBackend()
+        executor = TransformExecutor(retry_backend, cache=cache, chunker=chunker)
+        result = asyncio.run(executor.transform_result(SYSTEM_PROMPT, text))
+        cache.close()
+
+        self.assertEqual(retry_backend.calls, 1)
+        self.assertEqual(executor.stats["cache_hits"], len(chunks) - 1)
+        self.assertEqual(result["chunks"], len(chunks))
+        for sentence in SENTENCES:
+            self.assertIn(sentence, result["output"])
+
+
+class RateLimiterTest(unittest.TestCase):
+    def test_requests_are_spaced_by_the_rate(self):
+        limiter = RateLimiter(rate=50, burst=1)
+
+        async def acquire_all():
+            start = time.monotonic()
+            await asyncio.gather(*(limiter.acquire() for _ in range(6)))
+            return time.monotonic() - start
+
+        # The first request starts at once, the other five a 50th of a second apart
+        self.assertGreaterEqual(asyncio.run(acquire_all()), 0.09)
+
+    def test_a_burst_starts_without_waiting(self):
+        limiter = RateLimiter(rate=1, burst=4)
+
+        async def acquire_all():
+            start = time.monotonic()
+            for _ in range(4):
+                await limiter.acquire()
+            return time.monotonic() - start
+
+        self.assertLess(asyncio.run(acquire_all()), 0.5)
+
+
+class OpenAIBackendTest(unittest.TestCase):
+    def run_with_server(self, client, handler=None):
+        """Run a coroutine function against a chat server on a free port."""
+        chat_server = MockChatServer()
+
+        async def main():
+            server = await asyncio.start_server(handler or chat_server.handle_connection, "127.0.0.1", 0)
+            host, port = server.sockets[0].getsockname()[:2]
+            backend = OpenAIBackend(api_key="test", base_url=f"http://{host}:{port}/v1")
+            try:
+                async with server:
+                    return await client(backend)
+            finally:
+                await backend.close()
+                await asyncio.sleep(0.1)
+
+        return chat_server, asyncio.run(main())
+
+    def test_requests_share_a_keep_alive_connection(self):
+        texts = ["first   text", "second text", "third\n\n\ntext"]
+
+        async def client(backend):
+            return [await backend.transform(SYSTEM_PROMPT, text) for text in texts], backend.pool.opened
+
+        chat_server, (outputs, opened) = self.run_with_server(client)
+
+        self.assertEqual(outputs, [mock_transform(SYSTEM_PROMPT, text) for text in texts])
+        self.assertEqual(opened, 1)
+        self.assertEqual(chat_server.connections, 1)
+        self.assertEqual(chat_server.requests, 3)
+
+    def test_concurrent_requests_open_at_most_one_connection_each(self):
+        texts = [f"text {number}" for number in range(20)]
+
+        async def client(backend):
+            executor = TransformExecutor(backend, concurrency=4)
+            results = await executor.transform_all(SYSTEM_PROMPT, texts)
+            return results, backend.pool.opened
+
+        chat_server, (results, opened) = self.run_with_server(client)
+
+        self.assertEqual([result["output"] for result in results], [mock_transform(SYSTEM_PROMPT, t) for t in texts])
+        self.assertLessEqual(opened, 4)
+        self.assertEqual(chat_server.requests, len(texts))
+
+    def test_rate_limited_reply_is_retryable_with_its_delay(self):
+        async def handler(reader, writer):
+            await reader.readuntil(b"\r\n\r\n")
+            body = json.dumps({"error": {"message": "Rate limit reached."}}).encode('utf-8')
+            writer.write(
+                b"HTTP/1.1 429 Too Many Requests\r\nRetry-After: 7\r\nConnection: close\r\n"
+                + f"Content-Length: {len(body)}\r\n\r\n".encode('latin-1') + body
+            )
+            await writer.drain()
+            writer.close()
+
+        async def client(backend):
+            try:
+                await backend.transform(SYSTEM_PROMPT, "text")
+            except TransformError as e:
+                return e
+
+        _, error = self.run_with_server(client, handler)
+
+        self.assertIsInstance(error, TransformError)
+        self.assertIn("Rate limit reached.", str(error))
+        self.assertTrue(error.retryable)
+        self.assertEqual(error.retry_after, 7.0)
+
+
+if __name__ == '__main__':
+    unittest.main()
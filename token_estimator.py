@@ -0,0 +1,67 @@
+#!/usr/bin/env python3
+"""
+Token estimators for sizing combined system prompts.
+"""
+import re
+
+
+# Words are split into chunks of up to six characters, roughly how BPE
+# tokenizers break up longer words, and each punctuation mark counts as one.
+HEURISTIC_PATTERN = re.compile(r"\w{1,6}|[^\w\s]")
+
+
+class HeuristicTokenEstimator:
+    """Fast, dependency-free token estimate based on word pieces and punctuation."""
+    
+    name = "heuristic"
+    
+    def count(self, text):
+        """Estimate the number of tokens in a text."""
+        if not text:
+            return 0
+        return len(HEURISTIC_PATTERN.findall(text))
+
+
+class TiktokenEstimator:
+    """Exact token counts using a locally installed tiktoken encoding."""
+    
+    name = "tiktoken"
+    
+    def __init__(self, encoding_name="cl100k_base"):
+        """Load the encoding. Raises ImportError if tiktoken is not installed."""
+        import tiktoken
+        self.encoding = tiktoken.get_encoding(encoding_name)
+        self.name = f"tiktoken:{encoding_name}"
+    
+    def count(self, text):
+        """Count the tokens in a text."""
+        if not text:
+            return 0
+        return len(self.encoding.encode(text, disallowed_special=()))
+
+
+def get_token_estimator(name="heuristic"):
+    """
+    Get a token estimator by name.
+    
+    Args:
+        name: 'heuristic', 'tiktoken', or 'auto' to use tiktoken when it is
+            installed and its encoding is available, and the heuristic
+            otherwise. An estimator instance is returned unchanged.
+    """
+    if not isinstance(name, str):
+        return name
+    
+    if name == "heuristic":
+        return HeuristicTokenEstimator()
+    
+    if name == "tiktoken":
+        return TiktokenEstimator()
+    
+    if name == "auto":
+        try:
+            return TiktokenEstimator()
+        except Exception:
+            return HeuristicTokenEstimator()
+    
+    raise ValueError(f"Unknown token estimator '{name}'.")